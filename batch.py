@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   snurisc-batch: runs many programs (or many inputs of a program) on a
+#   pool of worker processes
+#
+#   Jin-Soo Kim
+#   Systems Software and Architecture Laboratory
+#   Seoul National University
+#   http://csl.snu.ac.kr
+#
+#==========================================================================
+
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pyrisc
+
+
+#--------------------------------------------------------------------------
+#   Batch: options and the result rows
+#--------------------------------------------------------------------------
+
+class Batch(object):
+
+    # Set from the command line
+    machine         = 'sim'
+    engine          = 'numpy'
+    workers         = os.cpu_count() or 1
+    output          = '-'               # '-': stdout
+    max_insts       = None
+    max_cycles      = None
+    regs            = [ ]               # register names to report
+    inputs          = False             # one program, many dmem images
+    cache           = False             # reuse the results of identical runs
+
+    COLUMNS         = [ 'file', 'input', 'status', 'exit', 'pc', 'cycle', 'icount',
+                        'inst_alu', 'inst_mem', 'inst_ctrl', 'error' ]
+
+    @staticmethod
+    def regno(machine, name):
+        # returns the number of register name (e.g., 'a0' or 'x10'), or None
+
+        rname = pyrisc.Tree.get(machine).module('components').rname
+        if name in rname:
+            return rname.index(name)
+        if name[:1] == 'x' and name[1:].isdigit() and int(name[1:]) < len(rname):
+            return int(name[1:])
+        return None
+
+
+#--------------------------------------------------------------------------
+#   Workers
+#--------------------------------------------------------------------------
+
+def init_worker(machine, engine):
+    # imports the simulator once per worker rather than once per run
+    pyrisc.preload(machine, engine)
+
+
+def run_one(filename, image_name, machine, engine, max_insts, max_cycles, regs, cache = False):
+    # runs a program in a worker process; returns its result row
+
+    row = { 'file': filename, 'input': image_name }
+    try:
+        image = None
+        if image_name:
+            with open(image_name, 'rb') as f:
+                image = f.read()
+        r = pyrisc.run(filename, machine, engine, max_insts, max_cycles, dmem_image = image,
+                       cache = cache)
+    except (OSError, ValueError) as e:
+        row['error'] = str(e)
+        return row
+    except Exception as e:
+        # A bad job must not take its worker down with it
+        row['error'] = "%s: %s" % (type(e).__name__, e)
+        return row
+
+    row.update(status = r.status, exit = r.message, pc = "0x%08x" % r.pc,
+               cycle = r.stat.cycle, icount = r.stat.icount, inst_alu = r.stat.inst_alu,
+               inst_mem = r.stat.inst_mem, inst_ctrl = r.stat.inst_ctrl)
+    for name, regno in regs:
+        row[name] = "0x%08x" % r.regs[regno]
+    return row
+
+
+#--------------------------------------------------------------------------
+#   Utility functions for command line parsing
+#--------------------------------------------------------------------------
+
+def show_usage(name):
+    print("snurisc-batch: runs RISC-V executable files in parallel with PyRISC simulators")
+    print("Usage: %s [-m machine] [-e engine] [-j n] [-o file] [-r regs] [--max-insts n] [--max-cycles n] [--cache] files..." % name)
+    print("       %s [options] --inputs program images..." % name)
+    print("\tfiles: RISC-V executable files or glob patterns (e.g., 'tests/*')")
+    print("\t-m selects the simulator: sim (default) or pipe5")
+    print("\t-e selects the execution engine of the simulator (default: numpy)")
+    print("\t-j sets the number of worker processes (default: number of CPUs)")
+    print("\t-o writes the results to file, as CSV if it ends with .csv (default: JSON lines on stdout)")
+    print("\t-r reports the given registers, separated by commas (e.g., a0,a1,x5)")
+    print("\t--max-insts, --max-cycles stop each run after n instructions or cycles")
+    print("\t--inputs runs program once for each image, copied to the beginning of dmem")
+    print("\t--cache reuses the results of identical earlier runs")
+
+
+def parse_args(args):
+    if len(args) < 2:
+        return None
+
+    index = 1
+    while index < len(args) and args[index].startswith('-'):
+        if args[index] in [ '--inputs', '--cache' ]:
+            setattr(Batch, args[index][2:], True)
+            index += 1
+            continue
+        elif index + 1 >= len(args):
+            return None
+        opt, arg = args[index], args[index + 1]
+        index += 2
+        if opt == '-m':
+            if arg not in pyrisc.MACHINES:
+                print("Invalid machine '%s'" % arg)
+                return None
+            Batch.machine = arg
+        elif opt == '-e':
+            Batch.engine = arg
+        elif opt == '-j':
+            if not arg.isdigit() or int(arg) < 1:
+                print("Invalid number of workers '%s'" % arg)
+                return None
+            Batch.workers = int(arg)
+        elif opt == '-o':
+            Batch.output = arg
+        elif opt == '-r':
+            Batch.regs = [ r for r in arg.split(',') if r ]
+        elif opt in [ '--max-insts', '--max-cycles' ]:
+            if not arg.isdigit():
+                print("Invalid number '%s'" % arg)
+                return None
+            if opt == '--max-insts':
+                Batch.max_insts = int(arg)
+            else:
+                Batch.max_cycles = int(arg)
+        else:
+            print("Invalid option '%s'" % opt)
+            return None
+
+    # Expand the patterns not expanded by the shell
+    files = [ ]
+    for arg in args[index:]:
+        files += sorted(glob.glob(arg)) if glob.has_magic(arg) else [ arg ]
+    if not files or (Batch.inputs and len(files) < 2):
+        return None
+
+    # Check the arguments common to all runs only once
+    for name in Batch.regs:
+        if Batch.regno(Batch.machine, name) is None:
+            print("Invalid register '%s'" % name)
+            return None
+    tree = pyrisc.Tree.get(Batch.machine)
+    cls = getattr(tree.module(pyrisc.MACHINES[Batch.machine][0]), pyrisc.MACHINES[Batch.machine][1])
+    if Batch.engine not in cls.engines:
+        print("Invalid engine '%s'" % Batch.engine)
+        return None
+    return files
+
+
+#--------------------------------------------------------------------------
+#   Main
+#--------------------------------------------------------------------------
+
+def main():
+
+    files = parse_args(sys.argv)
+    if not files:
+        show_usage(sys.argv[0])
+        sys.exit()
+
+    if Batch.inputs:
+        jobs = [ (files[0], image) for image in files[1:] ]
+    else:
+        jobs = [ (f, None) for f in files ]
+    regs = [ (name, Batch.regno(Batch.machine, name)) for name in Batch.regs ]
+    columns = Batch.COLUMNS + Batch.regs
+
+    out = sys.stdout if Batch.output == '-' else open(Batch.output, 'w', newline = '')
+    if Batch.output.endswith('.csv'):
+        writer = csv.DictWriter(out, columns, restval = '')
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda row: out.write(json.dumps(row) + '\n')
+
+    t = time.perf_counter()
+    failed = 0
+    workers = min(Batch.workers, len(jobs))
+    with ProcessPoolExecutor(workers, initializer = init_worker,
+                             initargs = (Batch.machine, Batch.engine)) as pool:
+        futures = [ pool.submit(run_one, filename, image, Batch.machine, Batch.engine,
+                                Batch.max_insts, Batch.max_cycles, regs, Batch.cache)
+                    for filename, image in jobs ]
+        # Results are written as soon as each run finishes
+        for future in as_completed(futures):
+            row = future.result()
+            if not Batch.inputs:
+                del row['input']
+            failed += 'error' in row
+            write(row)
+            out.flush()
+
+    if out is not sys.stdout:
+        out.close()
+    sys.stderr.write("%d runs (%d failed) in %.2f s, %d worker process(es)\n" %
+                     (len(jobs), failed, time.perf_counter() - t, workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -75,27 +75,28 @@ class Control(object):
 
     def __init__(self):
         super().__init__()
+        self.cpu = None                     # set by Pipe.set_stages()
 
         # Internal signals:----------------------------
         #
-        #   self.pc_sel             # Pipe.CTL.pc_sel
-        #   self.br_type            # Pipe.CTL.br_type
-        #   self.op1_sel            # Pipe.CTL.op1_sel
-        #   self.op2_sel            # Pipe.CTL.op2_sel
-        #   self.alu_fun            # Pipe.CTL.alu_fun
-        #   self.wb_sel             # Pipe.CTL.wb_sel
-        #   self.rf_wen             # Pipe.CTL.rf_wen
-        #   self.fwd_op1            # Pipe.CTL.fwd_op1
-        #   self.fwd_op2            # Pipe.CTL.fwd_op2
-        #   self.imem_en            # Pipe.CTL.imem_en
-        #   self.imem_rw            # Pipe.CTL.imem_rw
-        #   self.dmem_en            # Pipe.CTL.dmem_en
-        #   self.dmem_rw            # Pipe.CTL.dmem_rw
-        #   self.IF_stall           # Pipe.CTL.IF_stall
-        #   self.ID_stall           # Pipe.CTL.ID_stall
-        #   self.ID_bubble          # Pipe.CTL.ID_bubble
-        #   self.EX_bubble          # Pipe.CTL.EX_bubble
-        #   self.MM_bubble          # Pipe.CTL.MM_bubble
+        #   self.pc_sel             # cpu.ctl.pc_sel
+        #   self.br_type            # cpu.ctl.br_type
+        #   self.op1_sel            # cpu.ctl.op1_sel
+        #   self.op2_sel            # cpu.ctl.op2_sel
+        #   self.alu_fun            # cpu.ctl.alu_fun
+        #   self.wb_sel             # cpu.ctl.wb_sel
+        #   self.rf_wen             # cpu.ctl.rf_wen
+        #   self.fwd_op1            # cpu.ctl.fwd_op1
+        #   self.fwd_op2            # cpu.ctl.fwd_op2
+        #   self.imem_en            # cpu.ctl.imem_en
+        #   self.imem_rw            # cpu.ctl.imem_rw
+        #   self.dmem_en            # cpu.ctl.dmem_en
+        #   self.dmem_rw            # cpu.ctl.dmem_rw
+        #   self.IF_stall           # cpu.ctl.IF_stall
+        #   self.ID_stall           # cpu.ctl.ID_stall
+        #   self.ID_bubble          # cpu.ctl.ID_bubble
+        #   self.EX_bubble          # cpu.ctl.EX_bubble
+        #   self.MM_bubble          # cpu.ctl.MM_bubble
         #
         #----------------------------------------------
 
@@ -106,13 +107,13 @@ class Control(object):
 
 
     def gen(self, inst):
-        from datapath import Pipe, EX, MM, WB
+        cpu = self.cpu
 
         opcode = RISCV.opcode(inst)
         if opcode in [ EBREAK, ECALL ]:
-            Pipe.ID.exception |= EXC_EBREAK
+            cpu.ID.exception |= EXC_EBREAK
         elif opcode == ILLEGAL:
-            Pipe.ID.exception |= EXC_ILLEGAL_INST
+            cpu.ID.exception |= EXC_ILLEGAL_INST
             inst = BUBBLE
             opcode = RISCV.opcode(inst)
 
@@ -138,53 +139,53 @@ class Control(object):
         self.dmem_rw        = cs[CS_MEM_FCN]
 
         # Control signal to select the next PC
-        self.pc_sel         =   PC_BRJMP    if (EX.reg_c_br_type == BR_NE  and (not Pipe.EX.alu_out)) or    \
-                                               (EX.reg_c_br_type == BR_EQ  and Pipe.EX.alu_out) or          \
-                                               (EX.reg_c_br_type == BR_GE  and (not Pipe.EX.alu_out)) or    \
-                                               (EX.reg_c_br_type == BR_GEU and (not Pipe.EX.alu_out)) or    \
-                                               (EX.reg_c_br_type == BR_LT  and Pipe.EX.alu_out) or          \
-                                               (EX.reg_c_br_type == BR_LTU and Pipe.EX.alu_out) or          \
-                                               (EX.reg_c_br_type == BR_J) else                              \
-                                PC_JALR     if  EX.reg_c_br_type == BR_JR else                              \
+        self.pc_sel         =   PC_BRJMP    if (cpu.EX.reg_c_br_type == BR_NE  and (not cpu.EX.alu_out)) or    \
+                                               (cpu.EX.reg_c_br_type == BR_EQ  and cpu.EX.alu_out) or          \
+                                               (cpu.EX.reg_c_br_type == BR_GE  and (not cpu.EX.alu_out)) or    \
+                                               (cpu.EX.reg_c_br_type == BR_GEU and (not cpu.EX.alu_out)) or    \
+                                               (cpu.EX.reg_c_br_type == BR_LT  and cpu.EX.alu_out) or          \
+                                               (cpu.EX.reg_c_br_type == BR_LTU and cpu.EX.alu_out) or          \
+                                               (cpu.EX.reg_c_br_type == BR_J) else                             \
+                                PC_JALR     if  cpu.EX.reg_c_br_type == BR_JR else                             \
                                 PC_4
 
         # Control signal for forwarding rs1 value to op1_data
         # The c_rf_wen signal can be disabled when we have an exception during dmem access,
-        # so Pipe.MM.c_rf_wen should be used instead of MM.reg_c_rf_wen.
-        self.fwd_op1        =   FWD_EX      if (EX.reg_rd == Pipe.ID.rs1) and rs1_oen and   \
-                                               (EX.reg_rd != 0) and EX.reg_c_rf_wen else    \
-                                FWD_MM      if (MM.reg_rd == Pipe.ID.rs1) and rs1_oen and   \
-                                               (MM.reg_rd != 0) and Pipe.MM.c_rf_wen else   \
-                                FWD_WB      if (WB.reg_rd == Pipe.ID.rs1) and rs1_oen and   \
-                                               (WB.reg_rd != 0) and WB.reg_c_rf_wen else    \
+        # so cpu.MM.c_rf_wen should be used instead of cpu.MM.reg_c_rf_wen.
+        self.fwd_op1        =   FWD_EX      if (cpu.EX.reg_rd == cpu.ID.rs1) and rs1_oen and        \
+                                               (cpu.EX.reg_rd != 0) and cpu.EX.reg_c_rf_wen else    \
+                                FWD_MM      if (cpu.MM.reg_rd == cpu.ID.rs1) and rs1_oen and        \
+                                               (cpu.MM.reg_rd != 0) and cpu.MM.c_rf_wen else        \
+                                FWD_WB      if (cpu.WB.reg_rd == cpu.ID.rs1) and rs1_oen and        \
+                                               (cpu.WB.reg_rd != 0) and cpu.WB.reg_c_rf_wen else    \
                                 FWD_NONE
 
         # Control signal for forwarding rs2 value to op2_data
-        self.fwd_op2        =   FWD_EX      if (EX.reg_rd == Pipe.ID.rs2) and               \
-                                               (EX.reg_rd != 0) and EX.reg_c_rf_wen and     \
-                                               self.op2_sel == OP2_RS2 else                 \
-                                FWD_MM      if (MM.reg_rd == Pipe.ID.rs2) and               \
-                                               (MM.reg_rd != 0) and Pipe.MM.c_rf_wen and    \
-                                               self.op2_sel == OP2_RS2 else                 \
-                                FWD_WB      if (WB.reg_rd == Pipe.ID.rs2) and               \
-                                               (WB.reg_rd != 0) and WB.reg_c_rf_wen and     \
-                                               self.op2_sel == OP2_RS2 else                 \
+        self.fwd_op2        =   FWD_EX      if (cpu.EX.reg_rd == cpu.ID.rs2) and                   \
+                                               (cpu.EX.reg_rd != 0) and cpu.EX.reg_c_rf_wen and    \
+                                               self.op2_sel == OP2_RS2 else                        \
+                                FWD_MM      if (cpu.MM.reg_rd == cpu.ID.rs2) and                   \
+                                               (cpu.MM.reg_rd != 0) and cpu.MM.c_rf_wen and        \
+                                               self.op2_sel == OP2_RS2 else                        \
+                                FWD_WB      if (cpu.WB.reg_rd == cpu.ID.rs2) and                   \
+                                               (cpu.WB.reg_rd != 0) and cpu.WB.reg_c_rf_wen and    \
+                                               self.op2_sel == OP2_RS2 else                        \
                                 FWD_NONE
 
         # Control signal for forwarding rs2 value to rs2_data
-        self.fwd_rs2        =   FWD_EX      if (EX.reg_rd == Pipe.ID.rs2) and rs2_oen and   \
-                                               (EX.reg_rd != 0) and EX.reg_c_rf_wen  else   \
-                                FWD_MM      if (MM.reg_rd == Pipe.ID.rs2) and rs2_oen and   \
-                                               (MM.reg_rd != 0) and Pipe.MM.c_rf_wen else   \
-                                FWD_WB      if (WB.reg_rd == Pipe.ID.rs2) and rs2_oen and   \
-                                               (WB.reg_rd != 0) and WB.reg_c_rf_wen  else   \
+        self.fwd_rs2        =   FWD_EX      if (cpu.EX.reg_rd == cpu.ID.rs2) and rs2_oen and         \
+                                               (cpu.EX.reg_rd != 0) and cpu.EX.reg_c_rf_wen  else    \
+                                FWD_MM      if (cpu.MM.reg_rd == cpu.ID.rs2) and rs2_oen and         \
+                                               (cpu.MM.reg_rd != 0) and cpu.MM.c_rf_wen else         \
+                                FWD_WB      if (cpu.WB.reg_rd == cpu.ID.rs2) and rs2_oen and         \
+                                               (cpu.WB.reg_rd != 0) and cpu.WB.reg_c_rf_wen  else    \
                                 FWD_NONE
 
         # Check for load-use data hazard
-        EX_load_inst = EX.reg_c_dmem_en and EX.reg_c_dmem_rw == M_XRD
-        load_use_hazard     = (EX_load_inst and EX.reg_rd != 0) and             \
-                              ((EX.reg_rd == Pipe.ID.rs1 and rs1_oen) or        \
-                               (EX.reg_rd == Pipe.ID.rs2 and rs2_oen))
+        EX_load_inst = cpu.EX.reg_c_dmem_en and cpu.EX.reg_c_dmem_rw == M_XRD
+        load_use_hazard     = (EX_load_inst and cpu.EX.reg_rd != 0) and        \
+                              ((cpu.EX.reg_rd == cpu.ID.rs1 and rs1_oen) or    \
+                               (cpu.EX.reg_rd == cpu.ID.rs2 and rs2_oen))
 
         # Check for mispredicted branch/jump
         EX_brjmp            = self.pc_sel != PC_4
@@ -201,7 +202,7 @@ class Control(object):
         # branch/jump, in which case it should not cause any exception. We just keep track of the exception 
         # state with the instruction along the pipeline until EX. If the instruction survives EX, it is 
         # safe to make the instruction and any following instructions bubble (except for EBREAK)
-        self.MM_bubble = (Pipe.EX.exception and (Pipe.EX.exception != EXC_EBREAK)) or (Pipe.MM.exception)
+        self.MM_bubble = (cpu.EX.exception and (cpu.EX.exception != EXC_EBREAK)) or (cpu.MM.exception)
        
         if inst == BUBBLE:
             return False
@@ -44,88 +44,169 @@ class Pipe(object):
 
     def __init__(self):
         self.name = self.__class__.__name__
+        self.cpu  = None                    # set by set_stages()
+        self.logging = False                # set by execute() if the stage is logged
 
     @staticmethod
     def set_stages(cpu, stages, ctl):
-        Pipe.cpu = cpu
-        Pipe.stages = stages
-        Pipe.IF = stages[S_IF]
-        Pipe.ID = stages[S_ID]
-        Pipe.EX = stages[S_EX]
-        Pipe.MM = stages[S_MM]
-        Pipe.WB = stages[S_WB]
-        Pipe.CTL = ctl
+        # The stages and the control logic reach each other through cpu
+        cpu.stages = stages
+        cpu.IF = stages[S_IF]
+        cpu.ID = stages[S_ID]
+        cpu.EX = stages[S_EX]
+        cpu.MM = stages[S_MM]
+        cpu.WB = stages[S_WB]
+        cpu.ctl = ctl
+        for stage in stages:
+            stage.cpu = cpu
+        ctl.cpu = cpu
 
     @staticmethod
-    def run(entry_point):
-        IF.reg_pc = entry_point
-        while True:
+    def execute(cpu, entry_point, max_insts = None, max_cycles = None):
+        # runs the pipeline until an exception (or ebreak) reaches WB or
+        # the budget runs out, without printing the outcome; returns the
+        # exception in WB, or EXC_NONE if the budget ran out
+        max_insts   = NO_LIMIT if max_insts is None else cpu.stat.icount + max_insts
+        max_cycles  = NO_LIMIT if max_cycles is None else cpu.stat.cycle + max_cycles
+
+        # The log level is fixed during the run: below 3, no stage calls
+        # Pipe.log() at all, and at 3, only WB does
+        level, out = cpu.log.level, cpu.log.out
+        history = cpu.history
+        dump = None
+        if level >= 6:
+            dump = CycleDump(cpu.rf, cpu.dmem if level >= 7 else None)
+        ok = True
+        for stage in cpu.stages:
+            stage.logging = level >= 4 or (level == 3 and stage is cpu.WB)
+
+        cpu.IF.reg_pc = entry_point
+        Startup.mark("first instruction")
+        while cpu.stat.icount < max_insts and cpu.stat.cycle < max_cycles:
             # Run each stage 
             # Should be run in the reverse order because forwarding and 
             # hazard control logic depends on previous instructions
-            Pipe.WB.compute()
-            Pipe.MM.compute()
-            Pipe.EX.compute()
-            Pipe.ID.compute()
-            Pipe.IF.compute()
+            cpu.WB.compute()
+            cpu.MM.compute()
+            cpu.EX.compute()
+            cpu.ID.compute()
+            cpu.IF.compute()
 
             # Update states
-            Pipe.IF.update()
-            Pipe.ID.update()
-            Pipe.EX.update()
-            Pipe.MM.update()
-            ok = Pipe.WB.update()
-
-            Stat.cycle      += 1
-            if Pipe.WB.inst != BUBBLE:
-                Stat.icount += 1
-                opcode = RISCV.opcode(Pipe.WB.inst)
+            cpu.IF.update()
+            cpu.ID.update()
+            cpu.EX.update()
+            cpu.MM.update()
+            ok = cpu.WB.update()
+
+            cpu.stat.cycle      += 1
+            wb = cpu.WB
+            flags = TR_EXC if wb.exception else 0
+            if wb.inst != BUBBLE:
+                cpu.stat.icount += 1
+                opcode = RISCV.opcode(wb.inst)
+                if wb.c_rf_wen:
+                    flags |= TR_RD
                 if isa[opcode][IN_CLASS] == CL_ALU:
-                    Stat.inst_alu += 1
+                    cpu.stat.inst_alu += 1
                 elif isa[opcode][IN_CLASS] == CL_MEM:
-                    Stat.inst_mem += 1
+                    cpu.stat.inst_mem += 1
+                    flags |= TR_LOAD if wb.c_rf_wen else TR_STORE
                 elif isa[opcode][IN_CLASS] == CL_CTRL:
-                    Stat.inst_ctrl += 1
+                    cpu.stat.inst_ctrl += 1
+
+            # Record the instruction retired (or the one that raised an
+            # exception) in the history; History.add(), inlined
+            if history is not None and (wb.inst != BUBBLE or flags):
+                inst = wb.inst
+                if inst == BUBBLE:
+                    # An illegal instruction is replaced with a bubble in ID
+                    inst = cpu.imem.read_word(wb.pc)
+                    if inst is None:
+                        inst = BUBBLE
+                history.records[history.n % history.size] = \
+                    (cpu.stat.cycle - 1, wb.pc, inst, wb.rd, wb.wbdata, flags, wb.alu_out)
+                history.n += 1
 
             # Show logs after executing a single instruction
-            if Log.level >= 6:
-                Pipe.cpu.rf.dump()                      # dump register file
-            if Log.level >= 7:
-                Pipe.cpu.dmem.dump(skipzero = True)     # dump dmem
-            if Log.level >= 4:
-                print("-" * 50)
+            if level >= 4:
+                if dump is not None:
+                    dump.show(out)                      # dump register file and dmem
+                print("-" * 50, file = out)
 
             if not ok:
-                break;
+                break
+        if dump is not None:
+            dump.close()
+        return EXC_NONE if ok else cpu.WB.exception
+
+    @staticmethod
+    def report(cpu, status):
+        # prints the outcome of execute() and the final dumps
 
         # Handle exceptions, if any
-        if (Pipe.WB.exception & EXC_DMEM_ERROR):
-            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_DMEM_ERROR], Pipe.WB.pc))
-        elif (Pipe.WB.exception & EXC_EBREAK):
-            print("Execution completed")
-        elif (Pipe.WB.exception & EXC_ILLEGAL_INST):
-            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_ILLEGAL_INST], Pipe.WB.pc))
-        elif (Pipe.WB.exception & EXC_IMEM_ERROR):
-            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_IMEM_ERROR], Pipe.WB.pc))
-
-        if Log.level > 0:
-            if Log.level < 6:
-                Pipe.cpu.rf.dump()                      # dump register file
-            if Log.level > 1 and Log.level < 7:
-                Pipe.cpu.dmem.dump(skipzero = True)     # dump dmem
+        out = cpu.log.out
+        if (status & EXC_DMEM_ERROR):
+            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_DMEM_ERROR], cpu.WB.pc), file = out)
+        elif (status & EXC_EBREAK):
+            print("Execution completed", file = out)
+        elif (status & EXC_ILLEGAL_INST):
+            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_ILLEGAL_INST], cpu.WB.pc), file = out)
+        elif (status & EXC_IMEM_ERROR):
+            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_IMEM_ERROR], cpu.WB.pc), file = out)
+
+        # Show the instructions that led to the exception
+        if status not in [ EXC_NONE, EXC_EBREAK ] and cpu.log.level > 0 and \
+            cpu.history is not None:
+            cpu.history.dump(cpu.asmcache, out)
+
+        if cpu.log.level > 0:
+            if cpu.log.level < 6:
+                cpu.rf.dump(out = out)                  # dump register file
+            if cpu.log.level > 1 and cpu.log.level < 7:
+                cpu.dmem.dump(skipzero = True, out = out)   # dump dmem
        
-    # This function is called by each stage after updating its states
+    # The pipeline registers (reg_* of each stage), in the order they are
+    # saved in checkpoints
     @staticmethod
-    def log(stage, pc, inst, info):
+    def registers(cpu):
+        return [ (stage, name) for stage in cpu.stages for name in vars(type(stage))
+                 if name.startswith('reg_') ]
 
-        if Stat.cycle < Log.start_cycle:
-            return
-        if Log.level < 5:
-            info = ''
-        if Log.level >= 4 or (Log.level == 3 and stage == S_WB):
-            print("%d [%s] 0x%08x: %-30s%-s" % (Stat.cycle, S[stage], pc, Program.disasm(pc, inst), info))
-        else:
+    @staticmethod
+    def save_state(cpu):
+        # returns the pc of the oldest instruction not retired yet, and the
+        # values of the pipeline registers
+
+        pc = cpu.IF.reg_pc
+        for stage in [ cpu.ID, cpu.EX, cpu.MM, cpu.WB ]:
+            if stage.reg_inst != BUBBLE or stage.reg_exception != EXC_NONE:
+                pc = stage.reg_pc
+        return pc, [ int(getattr(stage, name)) for stage, name in Pipe.registers(cpu) ]
+
+    @staticmethod
+    def restore_state(cpu, values):
+        # sets the pipeline registers from save_state(); returns the pc to
+        # pass to execute()
+
+        for (stage, name), value in zip(Pipe.registers(cpu), values):
+            if isinstance(getattr(type(stage), name), bool):
+                value = bool(value)
+            elif cpu.engine != ENGINE_INT:
+                value = WORD(value)
+            setattr(stage, name, value)
+        return cpu.IF.reg_pc
+
+    # This function is called by each stage s after updating its states, if
+    # s.logging is set. s.log() formats the details only when they are shown.
+    @staticmethod
+    def log(cpu, stage, s):
+
+        if cpu.stat.cycle < cpu.log.start_cycle:
             return
+        info = s.log() if cpu.log.level >= 5 else ''
+        print("%d [%s] 0x%08x: %-30s%-s" % (cpu.stat.cycle, S[stage], s.pc, Program.disasm(s.pc, s.inst, cpu.asmcache), info),
+              file = cpu.log.out)
 
 
 #--------------------------------------------------------------------------
@@ -136,7 +217,7 @@ class IF(Pipe):
 
     # Pipeline registers ------------------------------
 
-    reg_pc          = WORD(0)       # IF.reg_pc
+    reg_pc          = WORD(0)       # cpu.IF.reg_pc
 
     #--------------------------------------------------
 
@@ -146,21 +227,23 @@ class IF(Pipe):
 
         # Internal signals:----------------------------
         #
-        #   self.pc                 # Pipe.IF.pc
-        #   self.inst               # Pipe.IF.inst
-        #   self.exception          # Pipe.IF.exception
-        #   self.pc_next            # Pipe.IF.pc_next
-        #   self.pcplus4            # Pipe.IF.pcplus4
+        #   self.pc                 # cpu.IF.pc
+        #   self.inst               # cpu.IF.inst
+        #   self.exception          # cpu.IF.exception
+        #   self.pc_next            # cpu.IF.pc_next
+        #   self.pcplus4            # cpu.IF.pcplus4
         #
         #----------------------------------------------
 
     def compute(self):
 
+        cpu = self.cpu
+
         # Readout pipeline register values 
-        self.pc     = IF.reg_pc
+        self.pc     = cpu.IF.reg_pc
 
         # Fetch an instruction from instruction memory (imem)
-        self.inst, status = Pipe.cpu.imem.access(Pipe.CTL.imem_en, self.pc, 0, Pipe.CTL.imem_rw)
+        self.inst, status = cpu.imem.access(cpu.ctl.imem_en, self.pc, 0, cpu.ctl.imem_rw)
 
         # Handle exception during imem access
         if not status:
@@ -170,38 +253,41 @@ class IF(Pipe):
             self.exception = EXC_NONE
 
         # Compute PC + 4 using an adder
-        self.pcplus4 = Pipe.cpu.adder_pcplus4.op(self.pc, 4)
+        self.pcplus4 = cpu.adder_pcplus4.op(self.pc, 4)
 
         # Select next PC
-        self.pc_next =  self.pcplus4            if Pipe.CTL.pc_sel == PC_4      else \
-                        Pipe.EX.brjmp_target    if Pipe.CTL.pc_sel == PC_BRJMP  else \
-                        Pipe.EX.jump_reg_target if Pipe.CTL.pc_sel == PC_JALR   else \
+        self.pc_next =  self.pcplus4            if cpu.ctl.pc_sel == PC_4      else \
+                        cpu.EX.brjmp_target     if cpu.ctl.pc_sel == PC_BRJMP  else \
+                        cpu.EX.jump_reg_target  if cpu.ctl.pc_sel == PC_JALR   else \
                         WORD(0)                 
 
 
     def update(self):
 
-        if not Pipe.CTL.IF_stall:
-            IF.reg_pc           = self.pc_next
+        cpu = self.cpu
+
+        if not cpu.ctl.IF_stall:
+            cpu.IF.reg_pc           = self.pc_next
 
-        if (Pipe.CTL.ID_bubble and Pipe.CTL.ID_stall):
+        if (cpu.ctl.ID_bubble and cpu.ctl.ID_stall):
             print("Assert failed: ID_bubble && ID_stall")
             sys.exit()
         
-        if Pipe.CTL.ID_bubble:
-            ID.reg_pc           = self.pc
-            ID.reg_inst         = WORD(BUBBLE)
-            ID.reg_exception    = WORD(EXC_NONE)
-            ID.reg_pcplus4      = WORD(0)
-        elif not Pipe.CTL.ID_stall:
-            ID.reg_pc           = self.pc
-            ID.reg_inst         = self.inst
-            ID.reg_exception    = self.exception
-            ID.reg_pcplus4      = self.pcplus4
-        else:               # Pipe.CTL.ID_stall
+        if cpu.ctl.ID_bubble:
+            cpu.ID.reg_pc           = self.pc
+            cpu.ID.reg_inst         = WORD(BUBBLE)
+            cpu.ID.reg_exception    = WORD(EXC_NONE)
+            cpu.ID.reg_pcplus4      = WORD(0)
+        elif not cpu.ctl.ID_stall:
+            cpu.ID.reg_pc           = self.pc
+            cpu.ID.reg_inst         = self.inst
+            cpu.ID.reg_exception    = self.exception
+            cpu.ID.reg_pcplus4      = self.pcplus4
+        else:               # cpu.ctl.ID_stall
             pass            # Do not update
 
-        Pipe.log(S_IF, self.pc, self.inst, self.log())
+        if self.logging:
+            Pipe.log(cpu, S_IF, self)
 
     def log(self):
         return ("# inst=0x%08x, pc_next=0x%08x" % (self.inst, self.pc_next))
@@ -216,10 +302,10 @@ class ID(Pipe):
 
     # Pipeline registers ------------------------------
 
-    reg_pc          = WORD(0)           # ID.reg_pc
-    reg_inst        = WORD(BUBBLE)      # ID.reg_inst
-    reg_exception   = WORD(EXC_NONE)    # ID.reg_exception
-    reg_pcplus4     = WORD(0)           # ID.reg_pcplus4
+    reg_pc          = WORD(0)           # cpu.ID.reg_pc
+    reg_inst        = WORD(BUBBLE)      # cpu.ID.reg_inst
+    reg_exception   = WORD(EXC_NONE)    # cpu.ID.reg_exception
+    reg_pcplus4     = WORD(0)           # cpu.ID.reg_pcplus4
 
     #--------------------------------------------------
 
@@ -229,35 +315,37 @@ class ID(Pipe):
 
         # Internal signals:----------------------------
         #
-        #   self.pc                 # Pipe.ID.pc
-        #   self.inst               # Pipe.ID.inst
-        #   self.exception          # Pipe.ID.exception
-        #   self.pcplus4            # Pipe.ID.pcplus4
+        #   self.pc                 # cpu.ID.pc
+        #   self.inst               # cpu.ID.inst
+        #   self.exception          # cpu.ID.exception
+        #   self.pcplus4            # cpu.ID.pcplus4
         #
-        #   self.rs1                # Pipe.ID.rs1
-        #   self.rs2                # Pipe.ID.rs2
-        #   self.rd                 # Pipe.ID.rd
-        #   self.op1_data           # Pipe.ID.op1_data
-        #   self.op2_data           # Pipe.ID.op2_data
-        #   self.rs2_data           # Pipe.ID.rs2_data
+        #   self.rs1                # cpu.ID.rs1
+        #   self.rs2                # cpu.ID.rs2
+        #   self.rd                 # cpu.ID.rd
+        #   self.op1_data           # cpu.ID.op1_data
+        #   self.op2_data           # cpu.ID.op2_data
+        #   self.rs2_data           # cpu.ID.rs2_data
         #
         #----------------------------------------------
 
 
     def compute(self):
 
+        cpu = self.cpu
+
         # Readout pipeline register values
-        self.pc         = ID.reg_pc
-        self.inst       = ID.reg_inst
-        self.exception  = ID.reg_exception
-        self.pcplus4    = ID.reg_pcplus4
+        self.pc         = cpu.ID.reg_pc
+        self.inst       = cpu.ID.reg_inst
+        self.exception  = cpu.ID.reg_exception
+        self.pcplus4    = cpu.ID.reg_pcplus4
 
         self.rs1        = RISCV.rs1(self.inst)          # for CTL (forwarding check)
         self.rs2        = RISCV.rs2(self.inst)          # for CTL (forwarding check)
         self.rd         = RISCV.rd(self.inst)
 
-        rf_rs1_data     = Pipe.cpu.rf.read(self.rs1)
-        rf_rs2_data     = Pipe.cpu.rf.read(self.rs2)
+        rf_rs1_data     = cpu.rf.read(self.rs1)
+        rf_rs2_data     = cpu.rf.read(self.rs2)
 
         imm_i           = RISCV.imm_i(self.inst)
         imm_s           = RISCV.imm_s(self.inst)
@@ -268,71 +356,74 @@ class ID(Pipe):
         # Generate control signals
         # CTL.gen() should be called after getting register numbers to detect forwarding condition
 
-        if not Pipe.CTL.gen(self.inst):
+        if not cpu.ctl.gen(self.inst):
             self.inst = BUBBLE
 
         # Determine ALU operand 2: R[rs2] or immediate values
-        alu_op2 =       rf_rs2_data     if Pipe.CTL.op2_sel == OP2_RS2      else \
-                        imm_i           if Pipe.CTL.op2_sel == OP2_IMI      else \
-                        imm_s           if Pipe.CTL.op2_sel == OP2_IMS      else \
-                        imm_b           if Pipe.CTL.op2_sel == OP2_IMB      else \
-                        imm_u           if Pipe.CTL.op2_sel == OP2_IMU      else \
-                        imm_j           if Pipe.CTL.op2_sel == OP2_IMJ      else \
+        alu_op2 =       rf_rs2_data     if cpu.ctl.op2_sel == OP2_RS2      else \
+                        imm_i           if cpu.ctl.op2_sel == OP2_IMI      else \
+                        imm_s           if cpu.ctl.op2_sel == OP2_IMS      else \
+                        imm_b           if cpu.ctl.op2_sel == OP2_IMB      else \
+                        imm_u           if cpu.ctl.op2_sel == OP2_IMU      else \
+                        imm_j           if cpu.ctl.op2_sel == OP2_IMJ      else \
                         WORD(0)
 
         # Determine ALU operand 1: PC or R[rs1]
         # Get forwarded value for rs1 if necessary
         # The order matters: EX -> MM -> WB (forwarding from the closest stage)
-        self.op1_data = self.pc         if Pipe.CTL.op1_sel == OP1_PC       else \
-                        Pipe.EX.alu_out if Pipe.CTL.fwd_op1 == FWD_EX       else \
-                        Pipe.MM.wbdata  if Pipe.CTL.fwd_op1 == FWD_MM       else \
-                        Pipe.WB.wbdata  if Pipe.CTL.fwd_op1 == FWD_WB       else \
+        self.op1_data = self.pc         if cpu.ctl.op1_sel == OP1_PC       else \
+                        cpu.EX.alu_out  if cpu.ctl.fwd_op1 == FWD_EX       else \
+                        cpu.MM.wbdata   if cpu.ctl.fwd_op1 == FWD_MM       else \
+                        cpu.WB.wbdata   if cpu.ctl.fwd_op1 == FWD_WB       else \
                         rf_rs1_data
 
         # Get forwarded value for rs2 if necessary
         # The order matters: EX -> MM -> WB (forwarding from the closest stage)
-        self.op2_data = Pipe.EX.alu_out if Pipe.CTL.fwd_op2 == FWD_EX       else \
-                        Pipe.MM.wbdata  if Pipe.CTL.fwd_op2 == FWD_MM       else \
-                        Pipe.WB.wbdata  if Pipe.CTL.fwd_op2 == FWD_WB       else \
+        self.op2_data = cpu.EX.alu_out  if cpu.ctl.fwd_op2 == FWD_EX       else \
+                        cpu.MM.wbdata   if cpu.ctl.fwd_op2 == FWD_MM       else \
+                        cpu.WB.wbdata   if cpu.ctl.fwd_op2 == FWD_WB       else \
                         alu_op2
 
         # Get forwarded value for rs2 if necessary
         # The order matters: EX -> MM -> WB (forwarding from the closest stage)
         # For sw and branch instructions, we need to carry R[rs2] as well
         # -- in these instructions, op2_data will hold an immediate value
-        self.rs2_data = Pipe.EX.alu_out if Pipe.CTL.fwd_rs2 == FWD_EX       else \
-                        Pipe.MM.wbdata  if Pipe.CTL.fwd_rs2 == FWD_MM       else \
-                        Pipe.WB.wbdata  if Pipe.CTL.fwd_rs2 == FWD_WB       else \
+        self.rs2_data = cpu.EX.alu_out  if cpu.ctl.fwd_rs2 == FWD_EX       else \
+                        cpu.MM.wbdata   if cpu.ctl.fwd_rs2 == FWD_MM       else \
+                        cpu.WB.wbdata   if cpu.ctl.fwd_rs2 == FWD_WB       else \
                         rf_rs2_data
 
 
     def update(self):
 
-        EX.reg_pc                   = self.pc
+        cpu = self.cpu
+
+        cpu.EX.reg_pc                   = self.pc
 
-        if Pipe.CTL.EX_bubble:
-            EX.reg_inst             = WORD(BUBBLE)
-            EX.reg_exception        = WORD(EXC_NONE)
-            EX.reg_c_br_type        = WORD(BR_N)
-            EX.reg_c_rf_wen         = False
-            EX.reg_c_dmem_en        = False
+        if cpu.ctl.EX_bubble:
+            cpu.EX.reg_inst             = WORD(BUBBLE)
+            cpu.EX.reg_exception        = WORD(EXC_NONE)
+            cpu.EX.reg_c_br_type        = WORD(BR_N)
+            cpu.EX.reg_c_rf_wen         = False
+            cpu.EX.reg_c_dmem_en        = False
         else:
-            EX.reg_inst             = self.inst
-            EX.reg_exception        = self.exception
-            EX.reg_rd               = self.rd
-            EX.reg_op1_data         = self.op1_data
-            EX.reg_op2_data         = self.op2_data
-            EX.reg_rs2_data         = self.rs2_data
-            EX.reg_c_br_type        = Pipe.CTL.br_type
-            EX.reg_c_alu_fun        = Pipe.CTL.alu_fun
-            EX.reg_c_wb_sel         = Pipe.CTL.wb_sel
-            EX.reg_c_rf_wen         = Pipe.CTL.rf_wen
-            EX.reg_c_dmem_en        = Pipe.CTL.dmem_en
-            EX.reg_c_dmem_rw        = Pipe.CTL.dmem_rw
-            EX.reg_pcplus4          = self.pcplus4
-
-
-        Pipe.log(S_ID, self.pc, self.inst, self.log())
+            cpu.EX.reg_inst             = self.inst
+            cpu.EX.reg_exception        = self.exception
+            cpu.EX.reg_rd               = self.rd
+            cpu.EX.reg_op1_data         = self.op1_data
+            cpu.EX.reg_op2_data         = self.op2_data
+            cpu.EX.reg_rs2_data         = self.rs2_data
+            cpu.EX.reg_c_br_type        = cpu.ctl.br_type
+            cpu.EX.reg_c_alu_fun        = cpu.ctl.alu_fun
+            cpu.EX.reg_c_wb_sel         = cpu.ctl.wb_sel
+            cpu.EX.reg_c_rf_wen         = cpu.ctl.rf_wen
+            cpu.EX.reg_c_dmem_en        = cpu.ctl.dmem_en
+            cpu.EX.reg_c_dmem_rw        = cpu.ctl.dmem_rw
+            cpu.EX.reg_pcplus4          = self.pcplus4
+
+
+        if self.logging:
+            Pipe.log(cpu, S_ID, self)
 
     def log(self):
         if self.inst in [ BUBBLE, ILLEGAL ]:
@@ -349,20 +440,20 @@ class EX(Pipe):
 
     # Pipeline registers ------------------------------
 
-    reg_pc              = WORD(0)           # EX.reg_pc
-    reg_inst            = WORD(BUBBLE)      # EX.reg_inst
-    reg_exception       = WORD(EXC_NONE)    # EX.exception
-    reg_rd              = WORD(0)           # EX.reg_rd
-    reg_c_rf_wen        = False             # EX.reg_c_rf_wen
-    reg_c_wb_sel        = WORD(WB_X)        # EX.reg_c_wb_sel
-    reg_c_dmem_en       = False             # EX.reg_c_dmem_en
-    reg_c_dmem_rw       = WORD(M_X)         # EX.reg_c_dmem_rw
-    reg_c_br_type       = WORD(BR_N)        # EX.reg_c_br_type
-    reg_c_alu_fun       = WORD(ALU_X)       # EX.reg_c_alu_fun
-    reg_op1_data        = WORD(0)           # EX.reg_op1_data
-    reg_op2_data        = WORD(0)           # EX.reg_op2_data
-    reg_rs2_data        = WORD(0)           # EX.reg_rs2_data
-    reg_pcplus4         = WORD(0)           # EX.reg_pcplus4
+    reg_pc              = WORD(0)           # cpu.EX.reg_pc
+    reg_inst            = WORD(BUBBLE)      # cpu.EX.reg_inst
+    reg_exception       = WORD(EXC_NONE)    # cpu.EX.reg_exception
+    reg_rd              = WORD(0)           # cpu.EX.reg_rd
+    reg_c_rf_wen        = False             # cpu.EX.reg_c_rf_wen
+    reg_c_wb_sel        = WORD(WB_X)        # cpu.EX.reg_c_wb_sel
+    reg_c_dmem_en       = False             # cpu.EX.reg_c_dmem_en
+    reg_c_dmem_rw       = WORD(M_X)         # cpu.EX.reg_c_dmem_rw
+    reg_c_br_type       = WORD(BR_N)        # cpu.EX.reg_c_br_type
+    reg_c_alu_fun       = WORD(ALU_X)       # cpu.EX.reg_c_alu_fun
+    reg_op1_data        = WORD(0)           # cpu.EX.reg_op1_data
+    reg_op2_data        = WORD(0)           # cpu.EX.reg_op2_data
+    reg_rs2_data        = WORD(0)           # cpu.EX.reg_rs2_data
+    reg_pcplus4         = WORD(0)           # cpu.EX.reg_pcplus4
 
     #--------------------------------------------------
 
@@ -372,46 +463,48 @@ class EX(Pipe):
 
         # Internal signals:----------------------------
         #
-        #   self.pc                 # Pipe.EX.pc
-        #   self.inst               # Pipe.EX.inst
-        #   self.exception          # Pipe.EX.exception
-        #   self.rd                 # Pipe.EX.rd
-        #   self.c_rf_wen           # Pipe.EX.c_rf_wen
-        #   self.c_wb_sel           # Pipe.EX.c_wb_sel
-        #   self.c_dmem_en          # Pipe.EX.c_dmem_en
-        #   self.c_dmem_rw          # Pipe.EX.c_dmem_fcn
-        #   self.c_br_type          # Pipe.EX.c_br_type
-        #   self.c_alu_fun          # Pipe.EX.c_alu_fun
-        #   self.op1_data           # Pipe.EX.op1_data
-        #   self.op2_data           # Pipe.EX.op2_data
-        #   self.rs2_data           # Pipe.EX.rs2_data
-        #   self.pcplus4            # Pipe.EX.pcplus4
+        #   self.pc                 # cpu.EX.pc
+        #   self.inst               # cpu.EX.inst
+        #   self.exception          # cpu.EX.exception
+        #   self.rd                 # cpu.EX.rd
+        #   self.c_rf_wen           # cpu.EX.c_rf_wen
+        #   self.c_wb_sel           # cpu.EX.c_wb_sel
+        #   self.c_dmem_en          # cpu.EX.c_dmem_en
+        #   self.c_dmem_rw          # cpu.EX.c_dmem_fcn
+        #   self.c_br_type          # cpu.EX.c_br_type
+        #   self.c_alu_fun          # cpu.EX.c_alu_fun
+        #   self.op1_data           # cpu.EX.op1_data
+        #   self.op2_data           # cpu.EX.op2_data
+        #   self.rs2_data           # cpu.EX.rs2_data
+        #   self.pcplus4            # cpu.EX.pcplus4
         #
-        #   self.alu2_data          # Pipe.EX.alu2_data
-        #   self.alu_out            # Pipe.EX.alu_out
-        #   self.brjmp_target       # Pipe.EX.brjmp_target
-        #   self.jump_reg_target    # Pipe.EX.jump_reg_target
+        #   self.alu2_data          # cpu.EX.alu2_data
+        #   self.alu_out            # cpu.EX.alu_out
+        #   self.brjmp_target       # cpu.EX.brjmp_target
+        #   self.jump_reg_target    # cpu.EX.jump_reg_target
         #
         #----------------------------------------------
 
 
     def compute(self):
 
+        cpu = self.cpu
+
         # Readout pipeline register values
-        self.pc                 = EX.reg_pc
-        self.inst               = EX.reg_inst
-        self.exception          = EX.reg_exception
-        self.rd                 = EX.reg_rd
-        self.c_rf_wen           = EX.reg_c_rf_wen
-        self.c_wb_sel           = EX.reg_c_wb_sel
-        self.c_dmem_en          = EX.reg_c_dmem_en
-        self.c_dmem_rw          = EX.reg_c_dmem_rw
-        self.c_br_type          = EX.reg_c_br_type
-        self.c_alu_fun          = EX.reg_c_alu_fun
-        self.op1_data           = EX.reg_op1_data
-        self.op2_data           = EX.reg_op2_data
-        self.rs2_data           = EX.reg_rs2_data
-        self.pcplus4            = EX.reg_pcplus4
+        self.pc                 = cpu.EX.reg_pc
+        self.inst               = cpu.EX.reg_inst
+        self.exception          = cpu.EX.reg_exception
+        self.rd                 = cpu.EX.reg_rd
+        self.c_rf_wen           = cpu.EX.reg_c_rf_wen
+        self.c_wb_sel           = cpu.EX.reg_c_wb_sel
+        self.c_dmem_en          = cpu.EX.reg_c_dmem_en
+        self.c_dmem_rw          = cpu.EX.reg_c_dmem_rw
+        self.c_br_type          = cpu.EX.reg_c_br_type
+        self.c_alu_fun          = cpu.EX.reg_c_alu_fun
+        self.op1_data           = cpu.EX.reg_op1_data
+        self.op2_data           = cpu.EX.reg_op2_data
+        self.rs2_data           = cpu.EX.reg_rs2_data
+        self.pcplus4            = cpu.EX.reg_pcplus4
 
 
         # For branch instructions, we use ALU to make comparisons between rs1 and rs2.
@@ -421,13 +514,13 @@ class EX(Pipe):
                           self.op2_data
         
         # Perform ALU operation
-        self.alu_out = Pipe.cpu.alu.op(self.c_alu_fun, self.op1_data, self.alu2_data)
+        self.alu_out = cpu.alu.op(self.c_alu_fun, self.op1_data, self.alu2_data)
 
         # Adjust the output for jalr instruction (forwarded to IF)
-        self.jump_reg_target    = self.alu_out & WORD(0xfffffffe) 
+        self.jump_reg_target    = self.alu_out & 0xfffffffe
 
         # Calculate the branch/jump target address using an adder (forwarded to IF)
-        self.brjmp_target       = Pipe.cpu.adder_brtarget.op(self.pc, self.op2_data) 
+        self.brjmp_target       = cpu.adder_brtarget.op(self.pc, self.op2_data) 
 
         # For jal and jalr instructions, pc+4 should be written to the rd
         if self.c_wb_sel == WB_PC4:                   
@@ -436,49 +529,57 @@ class EX(Pipe):
 
     def update(self):
 
-        MM.reg_pc                   = self.pc
+        cpu = self.cpu
+
+        cpu.MM.reg_pc                   = self.pc
         # Exception should not be cleared in MM even if MM_bubble is enabled.
         # Otherwise we will lose any exception status.
         # For cancelled instructions, exception has been cleared already
         # as they enter ID or EX stage.
-        MM.reg_exception            = self.exception
+        cpu.MM.reg_exception            = self.exception
 
-        if Pipe.CTL.MM_bubble:
-            MM.reg_inst             = WORD(BUBBLE)
-            MM.reg_c_rf_wen         = False
-            MM.reg_c_dmem_en        = False
+        if cpu.ctl.MM_bubble:
+            cpu.MM.reg_inst             = WORD(BUBBLE)
+            cpu.MM.reg_c_rf_wen         = False
+            cpu.MM.reg_c_dmem_en        = False
         else:
-            MM.reg_inst             = self.inst
-            MM.reg_rd               = self.rd
-            MM.reg_c_rf_wen         = self.c_rf_wen
-            MM.reg_c_wb_sel         = self.c_wb_sel
-            MM.reg_c_dmem_en        = self.c_dmem_en
-            MM.reg_c_dmem_rw        = self.c_dmem_rw
-            MM.reg_alu_out          = self.alu_out
-            MM.reg_rs2_data         = self.rs2_data
-
-        Pipe.log(S_EX, self.pc, self.inst, self.log())
-
+            cpu.MM.reg_inst             = self.inst
+            cpu.MM.reg_rd               = self.rd
+            cpu.MM.reg_c_rf_wen         = self.c_rf_wen
+            cpu.MM.reg_c_wb_sel         = self.c_wb_sel
+            cpu.MM.reg_c_dmem_en        = self.c_dmem_en
+            cpu.MM.reg_c_dmem_rw        = self.c_dmem_rw
+            cpu.MM.reg_alu_out          = self.alu_out
+            cpu.MM.reg_rs2_data         = self.rs2_data
+
+        if self.logging:
+            Pipe.log(cpu, S_EX, self)
+
+
+    # Formats for log(): only the one for the ALU operation is filled in
+    ALU_OPS = {
+        ALU_X       : '# -',
+        ALU_ADD     : '# {out:#010x} <- {op1:#010x} + {op2:#010x}',
+        ALU_SUB     : '# {out:#010x} <- {op1:#010x} - {op2:#010x}',
+        ALU_AND     : '# {out:#010x} <- {op1:#010x} & {op2:#010x}',
+        ALU_OR      : '# {out:#010x} <- {op1:#010x} | {op2:#010x}',
+        ALU_XOR     : '# {out:#010x} <- {op1:#010x} ^ {op2:#010x}',
+        ALU_SLT     : '# {out:#010x} <- {op1:#010x} < {op2:#010x} (signed)',
+        ALU_SLTU    : '# {out:#010x} <- {op1:#010x} < {op2:#010x} (unsigned)',
+        ALU_SLL     : '# {out:#010x} <- {op1:#010x} << {shamt}',
+        ALU_SRL     : '# {out:#010x} <- {op1:#010x} >> {shamt} (logical)',
+        ALU_SRA     : '# {out:#010x} <- {op1:#010x} >> {shamt} (arithmetic)',
+        ALU_COPY1   : '# {out:#010x} <- {op1:#010x} (pass 1)',
+        ALU_COPY2   : '# {out:#010x} <- {op2:#010x} (pass 2)',
+        ALU_SEQ     : '# {out:#010x} <- {op1:#010x} == {op2:#010x}',
+    }
 
     def log(self):
 
-        ALU_OPS = {
-            ALU_X       : f'# -',
-            ALU_ADD     : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} + {self.alu2_data:#010x}',
-            ALU_SUB     : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} - {self.alu2_data:#010x}',
-            ALU_AND     : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} & {self.alu2_data:#010x}',
-            ALU_OR      : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} | {self.alu2_data:#010x}',
-            ALU_XOR     : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} ^ {self.alu2_data:#010x}',
-            ALU_SLT     : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} < {self.alu2_data:#010x} (signed)',
-            ALU_SLTU    : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} < {self.alu2_data:#010x} (unsigned)',
-            ALU_SLL     : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} << {self.alu2_data & 0x1f}',
-            ALU_SRL     : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} >> {self.alu2_data & 0x1f} (logical)',
-            ALU_SRA     : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} >> {self.alu2_data & 0x1f} (arithmetic)',
-            ALU_COPY1   : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} (pass 1)',
-            ALU_COPY2   : f'# {self.alu_out:#010x} <- {self.alu2_data:#010x} (pass 2)',
-            ALU_SEQ     : f'# {self.alu_out:#010x} <- {self.op1_data:#010x} == {self.alu2_data:#010x}',
-        }
-        return('# -' if self.inst == BUBBLE else ALU_OPS[self.c_alu_fun]);
+        if self.inst == BUBBLE:
+            return('# -')
+        return EX.ALU_OPS[self.c_alu_fun].format(out = self.alu_out, op1 = self.op1_data,
+                                                 op2 = self.alu2_data, shamt = self.alu2_data & 0x1f)
 
 
 #--------------------------------------------------------------------------
@@ -489,16 +590,16 @@ class MM(Pipe):
 
     # Pipeline registers ------------------------------
 
-    reg_pc              = WORD(0)           # MM.reg_pc
-    reg_inst            = WORD(BUBBLE)      # MM.reg_inst
-    reg_exception       = WORD(EXC_NONE)    # MM.reg_exception
-    reg_rd              = WORD(0)           # MM.reg_rd
-    reg_c_rf_wen        = False             # MM.reg_c_rf_wen
-    reg_c_wb_sel        = WORD(WB_X)        # MM.reg_c_wb_sel
-    reg_c_dmem_en       = False             # MM.reg_c_dmem_en
-    reg_c_dmem_rw       = WORD(M_X)         # MM.reg_c_dmem_rw
-    reg_alu_out         = WORD(0)           # MM.reg_alu_out
-    reg_rs2_data        = WORD(0)           # MM.reg_rs2_data
+    reg_pc              = WORD(0)           # cpu.MM.reg_pc
+    reg_inst            = WORD(BUBBLE)      # cpu.MM.reg_inst
+    reg_exception       = WORD(EXC_NONE)    # cpu.MM.reg_exception
+    reg_rd              = WORD(0)           # cpu.MM.reg_rd
+    reg_c_rf_wen        = False             # cpu.MM.reg_c_rf_wen
+    reg_c_wb_sel        = WORD(WB_X)        # cpu.MM.reg_c_wb_sel
+    reg_c_dmem_en       = False             # cpu.MM.reg_c_dmem_en
+    reg_c_dmem_rw       = WORD(M_X)         # cpu.MM.reg_c_dmem_rw
+    reg_alu_out         = WORD(0)           # cpu.MM.reg_alu_out
+    reg_rs2_data        = WORD(0)           # cpu.MM.reg_rs2_data
 
     #--------------------------------------------------
 
@@ -507,36 +608,38 @@ class MM(Pipe):
 
         # Internal signals:----------------------------
         #
-        #   self.pc                 # Pipe.MM.pc
-        #   self.inst               # Pipe.MM.inst
-        #   self.exception          # Pipe.MM.exception
-        #   self.rd                 # Pipe.MM.rd
-        #   self.c_rf_wen           # Pipe.MM.c_rf_wen
-        #   self.c_wb_sel           # Pipe.MM.c_rf_wen
-        #   self.c_dmem_en          # Pipe.MM.c_dmem_en
-        #   self.c_dmem_rw          # Pipe.MM.c_dmem_rw
-        #   self.alu_out            # Pipe.MM.alu_out
-        #   self.rs2_data           # Pipe.MM.rs2_data
+        #   self.pc                 # cpu.MM.pc
+        #   self.inst               # cpu.MM.inst
+        #   self.exception          # cpu.MM.exception
+        #   self.rd                 # cpu.MM.rd
+        #   self.c_rf_wen           # cpu.MM.c_rf_wen
+        #   self.c_wb_sel           # cpu.MM.c_rf_wen
+        #   self.c_dmem_en          # cpu.MM.c_dmem_en
+        #   self.c_dmem_rw          # cpu.MM.c_dmem_rw
+        #   self.alu_out            # cpu.MM.alu_out
+        #   self.rs2_data           # cpu.MM.rs2_data
         #
-        #   self.wbdata             # Pipe.MM.wbdata
+        #   self.wbdata             # cpu.MM.wbdata
         #
         #----------------------------------------------
 
     def compute(self):
 
-        self.pc             = MM.reg_pc
-        self.inst           = MM.reg_inst
-        self.exception      = MM.reg_exception
-        self.rd             = MM.reg_rd
-        self.c_rf_wen       = MM.reg_c_rf_wen
-        self.c_wb_sel       = MM.reg_c_wb_sel
-        self.c_dmem_en      = MM.reg_c_dmem_en
-        self.c_dmem_rw      = MM.reg_c_dmem_rw
-        self.alu_out        = MM.reg_alu_out  
-        self.rs2_data       = MM.reg_rs2_data 
+        cpu = self.cpu
+
+        self.pc             = cpu.MM.reg_pc
+        self.inst           = cpu.MM.reg_inst
+        self.exception      = cpu.MM.reg_exception
+        self.rd             = cpu.MM.reg_rd
+        self.c_rf_wen       = cpu.MM.reg_c_rf_wen
+        self.c_wb_sel       = cpu.MM.reg_c_wb_sel
+        self.c_dmem_en      = cpu.MM.reg_c_dmem_en
+        self.c_dmem_rw      = cpu.MM.reg_c_dmem_rw
+        self.alu_out        = cpu.MM.reg_alu_out  
+        self.rs2_data       = cpu.MM.reg_rs2_data 
 
         # Access data memory (dmem) if needed
-        mem_data, status = Pipe.cpu.dmem.access(self.c_dmem_en, self.alu_out, self.rs2_data, self.c_dmem_rw)
+        mem_data, status = cpu.dmem.access(self.c_dmem_en, self.alu_out, self.rs2_data, self.c_dmem_rw)
 
         # Handle exception during dmem access
         if not status:
@@ -549,15 +652,19 @@ class MM(Pipe):
 
 
     def update(self):
+
+        cpu = self.cpu
     
-        WB.reg_pc           = self.pc
-        WB.reg_inst         = self.inst
-        WB.reg_exception    = self.exception
-        WB.reg_rd           = self.rd
-        WB.reg_c_rf_wen     = self.c_rf_wen
-        WB.reg_wbdata       = self.wbdata
+        cpu.WB.reg_pc           = self.pc
+        cpu.WB.reg_inst         = self.inst
+        cpu.WB.reg_exception    = self.exception
+        cpu.WB.reg_rd           = self.rd
+        cpu.WB.reg_c_rf_wen     = self.c_rf_wen
+        cpu.WB.reg_wbdata       = self.wbdata
+        cpu.WB.reg_alu_out      = self.alu_out
 
-        Pipe.log(S_MM, self.pc, self.inst, self.log())
+        if self.logging:
+            Pipe.log(cpu, S_MM, self)
 
 
     def log(self):
@@ -577,12 +684,13 @@ class WB(Pipe):
 
     # Pipeline registers ------------------------------
 
-    reg_pc              = WORD(0)           # WB.reg_pc
-    reg_inst            = WORD(BUBBLE)      # WB.reg_inst
-    reg_exception       = WORD(EXC_NONE)    # WB.reg_exception
-    reg_rd              = WORD(0)           # WB.reg_rd
-    reg_c_rf_wen        = False             # WB.reg_c_rf_wen
-    reg_wbdata          = WORD(0)           # WB.reg_wbdata
+    reg_pc              = WORD(0)           # cpu.WB.reg_pc
+    reg_inst            = WORD(BUBBLE)      # cpu.WB.reg_inst
+    reg_exception       = WORD(EXC_NONE)    # cpu.WB.reg_exception
+    reg_rd              = WORD(0)           # cpu.WB.reg_rd
+    reg_c_rf_wen        = False             # cpu.WB.reg_c_rf_wen
+    reg_wbdata          = WORD(0)           # cpu.WB.reg_wbdata
+    reg_alu_out         = WORD(0)           # cpu.WB.reg_alu_out (memory address, for History)
 
     #--------------------------------------------------
 
@@ -592,21 +700,30 @@ class WB(Pipe):
 
     def compute(self):
 
+        cpu = self.cpu
+
         # Readout pipeline register values
-        self.pc                 = WB.reg_pc    
-        self.inst               = WB.reg_inst  
-        self.exception          = WB.reg_exception      
-        self.rd                 = WB.reg_rd    
-        self.c_rf_wen           = WB.reg_c_rf_wen 
-        self.wbdata             = WB.reg_wbdata
+        self.pc                 = cpu.WB.reg_pc    
+        self.inst               = cpu.WB.reg_inst  
+        self.exception          = cpu.WB.reg_exception      
+        self.rd                 = cpu.WB.reg_rd    
+        self.c_rf_wen           = cpu.WB.reg_c_rf_wen 
+        self.wbdata             = cpu.WB.reg_wbdata
+        self.alu_out            = cpu.WB.reg_alu_out
 
 
     def update(self):
 
+        cpu = self.cpu
+
+        if cpu.trace is not None and cpu.stat.cycle >= cpu.log.start_cycle:
+            cpu.trace.wb(cpu, self)
+
         if self.c_rf_wen:
-            Pipe.cpu.rf.write(self.rd, self.wbdata)
+            cpu.rf.write(self.rd, self.wbdata)
 
-        Pipe.log(S_WB, self.pc, self.inst, self.log())
+        if self.logging:
+            Pipe.log(cpu, S_WB, self)
 
         if (self.exception):
             return False
@@ -13,7 +13,14 @@
 #
 #==========================================================================
 
-from elftools.elf import elffile as elf
+import io
+import os
+import sys
+import time
+import zlib
+import hashlib
+import collections
+
 from consts import *
 from isa import *
 from components import *
@@ -35,6 +42,166 @@ class AsmCache(object):
         return self.cache.get(pc)
 
 
+#--------------------------------------------------------------------------
+#   DiskCache: bounds the size of a cache directory
+#--------------------------------------------------------------------------
+
+# The caches on disk are bounded like the result cache of pyrisc.py. An
+# entry is the set of files whose names share the part before the first
+# '.'. Hits update the modification time of an entry, and the least
+# recently used entries are removed once a directory grows beyond MAX_SIZE
+# bytes. The size of a directory is counted once per process and then kept
+# up to date with the entries saved, so it is only scanned again when it
+# crosses MAX_SIZE.
+
+class DiskCache(object):
+
+    MAX_SIZE    = int(os.environ.get('PYRISC_CACHE_SIZE', 256 << 20))   # per directory
+    totals      = { }           # directory -> its size in bytes as far as known
+
+    @staticmethod
+    def touch(path):
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def entries(directory):
+        # returns { path prefix: [ mtime, size, [ path, ... ] ] }
+
+        entries = { }
+        for e in os.scandir(directory):
+            if e.name.endswith('.tmp'):
+                continue                # being written by another run
+            try:
+                st = e.stat()
+            except OSError:
+                continue                # removed by another run
+            entry = entries.setdefault(os.path.join(directory, e.name.split('.')[0]), [ 0, 0, [ ] ])
+            entry[0] = max(entry[0], st.st_mtime)
+            entry[1] += st.st_size
+            entry[2].append(e.path)
+        return entries
+
+    @staticmethod
+    def saved(directory, keep, size):
+        # called after writing the entry keep of size bytes to directory
+
+        total = DiskCache.totals.get(directory)
+        if total is None:
+            total = sum(e[1] for e in DiskCache.entries(directory).values())
+        else:
+            total += size
+        if total > DiskCache.MAX_SIZE:
+            total = DiskCache.evict(directory, keep)
+        DiskCache.totals[directory] = total
+
+    @staticmethod
+    def evict(directory, keep):
+        # removes the least recently used entries but keep, returning the
+        # size of the rest
+
+        entries = DiskCache.entries(directory)
+        total = sum(e[1] for e in entries.values())
+        for mtime, size, prefix in sorted((e[0], e[1], p) for p, e in entries.items()):
+            if total <= DiskCache.MAX_SIZE:
+                break
+            if prefix == keep:
+                continue
+            for path in entries[prefix][2]:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass                # removed by another run
+            total -= size
+        return total
+
+
+#--------------------------------------------------------------------------
+#   ImageCache: caches parsed ELF files on disk
+#--------------------------------------------------------------------------
+
+# Files of the cache are named after the SHA-256 hash of the ELF file.
+# For each validated executable, two NumPy files are kept:
+#
+#   <hash>.hdr.npy  [ VERSION, entry point, addr, memsz, filesz, ... ]
+#   <hash>.img.npy  file images of the PT_LOAD segments, concatenated
+#
+# On a hit, the image file is memory-mapped and copied into imem/dmem
+# without importing pyelftools. Files that fail check_elf() are not
+# cached, so their error messages stay the same on every run.
+#
+# An empty PYRISC_CACHE turns off all the caches on disk (CACHE_ROOT is
+# then None).
+
+CACHE_ROOT = os.environ.get('PYRISC_CACHE',
+                os.path.join(os.path.expanduser('~'), '.cache', 'pyrisc')) or None
+
+class ImageCache(object):
+
+    VERSION     = 1             # bump when the cached format changes
+    CACHE_DIR   = None if CACHE_ROOT is None else os.path.join(CACHE_ROOT, 'image')
+
+    @staticmethod
+    def path(digest):
+        # returns the path prefix of the cache entry for the file digest,
+        # or None if caching is off
+        if ImageCache.CACHE_DIR is None:
+            return None
+        return os.path.join(ImageCache.CACHE_DIR, digest)
+
+    @staticmethod
+    def lookup(path):
+        # returns (entry point, [ (addr, memsz, image), ... ]) or None
+
+        if path is None:
+            return None
+        try:
+            hdr = np.load(path + '.hdr.npy')
+            if hdr.size < 2 or hdr[0] != ImageCache.VERSION:
+                return None
+            img = np.load(path + '.img.npy', mmap_mode = 'r')
+        except (OSError, ValueError):
+            return None
+        DiskCache.touch(path + '.hdr.npy')
+
+        segments = [ ]
+        offset = 0
+        for addr, memsz, filesz in hdr[2:].reshape(-1, 3).tolist():
+            segments.append((addr, memsz, img[offset:offset + filesz]))
+            offset += filesz
+        return WORD(hdr[1]), segments
+
+    @staticmethod
+    def save(path, entry_point, segments):
+
+        hdr = [ ImageCache.VERSION, int(entry_point) ]
+        for addr, memsz, image in segments:
+            hdr += [ addr, memsz, len(image) ]
+        img = b''.join(image for addr, memsz, image in segments)
+        if path is None or len(img) > DiskCache.MAX_SIZE:
+            return
+        try:
+            os.makedirs(ImageCache.CACHE_DIR, exist_ok = True)
+            # The header is written last: it marks the entry as complete
+            ImageCache.write(path + '.img.npy', np.frombuffer(img, dtype = np.uint8))
+            ImageCache.write(path + '.hdr.npy', np.array(hdr, dtype = np.int64))
+            DiskCache.saved(ImageCache.CACHE_DIR, path,
+                            os.stat(path + '.img.npy').st_size + os.stat(path + '.hdr.npy').st_size)
+        except OSError:
+            pass                        # run without caching
+
+    @staticmethod
+    def write(path, array):
+        # writes atomically so that concurrent runs never see a partial file
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+
+
 #--------------------------------------------------------------------------
 #   Program: loads an ELF file into memory and supports disassembling
 #--------------------------------------------------------------------------
@@ -45,6 +212,7 @@ ELF_ERR_CLASS       = 2
 ELF_ERR_DATA        = 3
 ELF_ERR_TYPE        = 4
 ELF_ERR_MACH        = 5
+ELF_ERR_MAGIC       = 6
 
 ELF_ERR_MSG = {
     ELF_ERR_OPEN    : 'File %s not found',
@@ -52,14 +220,22 @@ ELF_ERR_MSG = {
     ELF_ERR_DATA    : 'File %s is not a little-endian ELF file',
     ELF_ERR_TYPE    : 'File %s is not an executable file',
     ELF_ERR_MACH    : 'File %s is not an RISC-V executable file',
+    ELF_ERR_MAGIC   : 'File %s is not an ELF file',
 }
 
 class Program(object):
 
+    def __init__(self, verbose = True):
+        self.verbose    = verbose       # print messages (False for the pyrisc API)
+        self.error      = None          # the last error message, if any
+        self.digest     = None          # SHA-256 of the file loaded (first 32 hex digits)
+        self.segments   = None          # [ (addr, memsz, image), ... ] of the file loaded
 
-    def __init__(self):
-        Program.asmcache = AsmCache()
-
+    def message(self, msg, error = True):
+        if error:
+            self.error = msg
+        if self.verbose:
+            print(msg)
 
     def check_elf(self, filename, header):
         e_ident = header['e_ident']
@@ -83,46 +259,83 @@ class Program(object):
         return ELF_OK
 
 
-    def load(self, cpu, filename):
-        print("Loading file %s" % filename)
-        try:
-            f = open(filename, 'rb')
-        except IOError:
-            print(ELF_ERR_MSG[ELF_ERR_OPEN] % filename) 
-            return WORD(0)
+    def load(self, cpu, filename, data = None):
+        # data: the contents of the file if already in memory, in which
+        # case filename is only used in messages
 
-        with f:
-            ef = elf.ELFFile(f)
-            efh = ef.header
-            ret = self.check_elf(filename, efh)
-            if ret != ELF_OK:
-                print(ELF_ERR_MSG[ret] % filename)
+        self.message("Loading file %s" % filename, error = False)
+        if data is None:
+            try:
+                with open(filename, 'rb') as f:
+                    data = f.read()
+            except IOError:
+                self.message(ELF_ERR_MSG[ELF_ERR_OPEN] % filename)
                 return WORD(0)
 
-            entry_point = WORD(efh['e_entry'])
-            
-            for seg in ef.iter_segments():
-                addr = seg.header['p_vaddr']
-                memsz = seg.header['p_memsz']
-                if seg.header['p_type'] != 'PT_LOAD':
-                    continue
-                if addr >= cpu.imem.mem_start and addr + memsz < cpu.imem.mem_end:
-                    mem = cpu.imem
-                elif addr >= cpu.dmem.mem_start and addr + memsz < cpu.dmem.mem_end:
-                    mem = cpu.dmem
-                else:
-                    print("Invalid address range: 0x%08x - 0x%08x" \
-                        % (addr, addr + memsz - 1))
-                    continue
-                image = seg.data()
-                for i in range(0, len(image), WORD_SIZE):
-                    c = int.from_bytes(image[i:i+WORD_SIZE], byteorder='little')
-                    mem.access(True, addr, c, M_XWR)
-                    addr += WORD_SIZE
-            return entry_point
+        self.digest = hashlib.sha256(data).hexdigest()[:32]
+        path = ImageCache.path(self.digest)
+        cached = ImageCache.lookup(path)
+        if cached is None:
+            cached = self.parse(filename, io.BytesIO(data))
+            if cached is None:
+                return WORD(0)
+            ImageCache.save(path, *cached)
+
+        entry_point, segments = cached
+        self.segments = segments
+        for addr, memsz, image in segments:
+            if not self.load_segment(cpu, addr, memsz, image):
+                self.message("Invalid address range: 0x%08x - 0x%08x" \
+                    % (addr, addr + memsz - 1))
+        return entry_point
+
+    def parse(self, filename, f):
+        # returns (entry point, [ (addr, memsz, image), ... ]) for the
+        # PT_LOAD segments, or None if the file is not a valid executable
+
+        from elftools.elf import elffile as elf
+        from elftools.common.exceptions import ELFError
+
+        try:
+            ef = elf.ELFFile(f)
+        except ELFError:
+            self.message(ELF_ERR_MSG[ELF_ERR_MAGIC] % filename)
+            return None
+        efh = ef.header
+        ret = self.check_elf(filename, efh)
+        if ret != ELF_OK:
+            self.message(ELF_ERR_MSG[ret] % filename)
+            return None
+
+        segments = [ ]
+        for seg in ef.iter_segments():
+            if seg.header['p_type'] != 'PT_LOAD':
+                continue
+            segments.append((seg.header['p_vaddr'], seg.header['p_memsz'], seg.data()))
+        return WORD(efh['e_entry']), segments
+
+    def load_segment(self, cpu, addr, memsz, image):
+        # Copies image to addr in bulk and zero-fills the rest of memsz
+        # bytes (.bss). A segment straddling imem and dmem is split between
+        # them. Returns False if any part of it falls outside both.
+
+        parts = [ ]
+        for mem in [ cpu.imem, cpu.dmem ]:
+            start   = max(addr, int(mem.mem_start))
+            end     = min(addr + memsz, int(mem.mem_end))
+            if start < end:
+                parts.append((mem, start, end))
+        if sum(end - start for mem, start, end in parts) != memsz:
+            return False
+
+        image = memoryview(image)
+        for mem, start, end in parts:
+            mem.load(start, image[start - addr:end - addr], end - start)
+        return True
                    
     @staticmethod
-    def disasm(pc, inst):
+    def disasm(pc, inst, asmcache):
+        # asmcache: the AsmCache of the machine running the program
 
         if inst == BUBBLE:
             asm = "BUBBLE"
@@ -131,14 +344,14 @@ class Program(object):
             asm = "nop"
             return asm
 
-        asm = Program.asmcache.lookup(pc)
+        asm = asmcache.lookup(pc)
         if asm is not None:
             return asm
 
         opcode = RISCV.opcode(inst)
         if opcode == ILLEGAL:
             asm = "(illegal)"
-            Program.asmcache.add(pc, asm)
+            asmcache.add(pc, asm)
             return asm
 
         info    = isa[opcode]
@@ -154,27 +367,27 @@ class Program(object):
         if info[IN_TYPE] == R_TYPE:
             asm = "%-7s%s, %s, %s" % (opname, rname[rd], rname[rs1], rname[rs2])
         elif info[IN_TYPE] == I_TYPE:
-            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], SWORD(imm_i))
+            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], sword(int(imm_i)))
         elif info[IN_TYPE] == IL_TYPE:
-            asm = "%-7s%s, %d(%s)" % (opname, rname[rd], SWORD(imm_i), rname[rs1])
+            asm = "%-7s%s, %d(%s)" % (opname, rname[rd], sword(int(imm_i)), rname[rs1])
         elif info[IN_TYPE] == IJ_TYPE:
-            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], SWORD(imm_i))
+            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], sword(int(imm_i)))
         elif info[IN_TYPE] == IS_TYPE:
-            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], SWORD(imm_i & 0x1f))
+            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], sword(int(imm_i) & 0x1f))
         elif info[IN_TYPE] == U_TYPE:
             asm = "%-7s%s, 0x%05x" % (opname, rname[rd], imm_u)
         elif info[IN_TYPE] == S_TYPE:
-            asm = "%-7s%s, %d(%s)" % (opname, rname[rs2], SWORD(imm_s), rname[rs1])
+            asm = "%-7s%s, %d(%s)" % (opname, rname[rs2], sword(int(imm_s)), rname[rs1])
         elif info[IN_TYPE] == B_TYPE:
-            asm = "%-7s%s, %s, 0x%08x" % (opname, rname[rs1], rname[rs2], pc + SWORD(imm_b))
+            asm = "%-7s%s, %s, 0x%08x" % (opname, rname[rs1], rname[rs2], int(pc) + sword(int(imm_b)))
         elif info[IN_TYPE] == J_TYPE:
-            asm = "%-7s%s, 0x%08x" % (opname, rname[rd], pc + SWORD(imm_j))
+            asm = "%-7s%s, 0x%08x" % (opname, rname[rd], int(pc) + sword(int(imm_j)))
         elif info[IN_TYPE] == X_TYPE:
             return info[IN_NAME]
         else:
             asm = "(unknown)"
 
-        Program.asmcache.add(pc, asm)
+        asmcache.add(pc, asm)
         return asm
 
 
@@ -186,9 +399,480 @@ class Log(object):
 
     MAX_LOG_LEVEL   = 7         # last log level
 
+    # Defaults for new machines (set from the command line)
     level           = 4         # default log level
     start_cycle     = 0
 
+    def __init__(self):
+        self.level          = Log.level
+        self.start_cycle    = Log.start_cycle
+        self.out            = None      # sink of the log output (None: stdout)
+
+    @staticmethod
+    def sink(filename = None, tail = 0):
+        # returns the sink for --log-file and --log-tail (None: stdout)
+
+        out = None
+        if filename:
+            if filename.endswith(('.gz', '.zst')):
+                out = CompressedSink(filename)
+            else:
+                out = FileSink(filename)
+        return RingSink(tail, out) if tail else out
+
+
+#--------------------------------------------------------------------------
+#   History: the last instructions retired, shown after an exception
+#--------------------------------------------------------------------------
+
+# Every instruction executed by the interpreter is recorded in a ring of
+# size preallocated slots as a tuple (cycle, pc, inst, rd, wbdata, flags,
+# addr), with flags and addr as in the trace (TR_* in consts.py), so that
+# the instructions leading to an exception can be shown without running
+# the program again with logging. The instruction that raised the
+# exception is included with TR_EXC if it got far enough to be recorded.
+
+class History(object):
+
+    # Default for new machines (set from the command line, 0: disabled)
+    size            = 16
+
+    def __init__(self, size = None):
+        self.size           = History.size if size is None else size
+        self.records        = [ None ] * self.size
+        self.n              = 0         # number of instructions recorded
+
+    def add(self, cycle, pc, inst, rd, wbdata, flags = 0, addr = 0):
+        # (inlined where it is called for every instruction)
+        self.records[self.n % self.size] = (cycle, pc, inst, rd, wbdata, flags, addr)
+        self.n += 1
+
+    def dump(self, asmcache, out = None):
+
+        n = min(self.n, self.size)
+        if n == 0:
+            return
+        print("Last instructions executed:", file = out)
+        for k in range(self.n - n, self.n):
+            cycle, pc, inst, rd, wbdata, flags, addr = self.records[k % self.size]
+            info = [ ]
+            if flags & TR_RD:
+                info.append("R[%d] <- 0x%08x" % (rd, wbdata))
+            if flags & (TR_LOAD | TR_STORE):
+                info.append("M[0x%08x]" % addr)
+            if flags & TR_CTRL:
+                info.append("pc_next=0x%08x" % addr)
+            if flags & TR_EXC:
+                info.append("exception")
+            print("%d 0x%08x: %-30s%s" % (cycle, pc, Program.disasm(pc, inst, asmcache),
+                  "# " + ", ".join(info) if info else ''), file = out)
+
+
+#--------------------------------------------------------------------------
+#   CycleDump: the register and memory dumps of each cycle
+#--------------------------------------------------------------------------
+
+# At log levels 6-7, dumping all the registers and the whole dmem after
+# every cycle makes the log huge and the run slow, since each dump walks
+# every word of dmem. Instead, the first dump is a full one, and each of
+# the following shows only the registers that changed and the dmem words
+# stored to since the previous dump, as collected by dmem.write_hook.
+# With snapshot n, every n-th dump is a full one again.
+
+class CycleDump(object):
+
+    # Default (set from the command line, 0: only the first, 1: every dump)
+    snapshot        = 0
+
+    def __init__(self, regs, dmem = None):
+        # dmem: None if only the registers are dumped
+
+        self.regs           = regs
+        self.dmem           = dmem
+        self.last           = None      # registers at the previous dump
+        self.dirty          = set()     # words stored to since then
+        self.count          = 0
+        if dmem is not None:
+            dmem.write_hook = self.store
+
+    def store(self, addr):
+        self.dirty.add(int(addr) & ~(WORD_SIZE - 1))
+
+    def show(self, out = None):
+
+        n = CycleDump.snapshot
+        full = self.last is None or (n > 0 and self.count % n == 0)
+        self.count += 1
+
+        regs = self.regs.reg
+        if full:
+            self.regs.dump(out = out)
+        else:
+            changed = [ r for r in range(NUM_REGS) if regs[r] != self.last[r] ]
+            if changed:
+                self.regs.dump(out = out, regnos = changed)
+        self.last = list(regs)
+
+        if self.dmem is not None:
+            if full:
+                self.dmem.dump(skipzero = True, out = out)
+            elif self.dirty:
+                self.dmem.dump_words(sorted(self.dirty), out = out)
+            self.dirty.clear()
+
+    def close(self):
+
+        if self.dmem is not None:
+            self.dmem.write_hook = None
+
+
+#--------------------------------------------------------------------------
+#   Log sinks: where the log output goes instead of stdout
+#--------------------------------------------------------------------------
+
+# The log lines, dumps, and final report of a machine are printed with
+# print(..., file = cpu.log.out), so any object with write(), flush(),
+# and close() can be a sink. Those below avoid writing the output a line
+# at a time to a terminal or pipe, which the simulator otherwise waits for.
+
+class NullSink(object):
+    # discards the output (e.g., to time the simulator without it)
+
+    def write(self, s):
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileSink(object):
+    # writes to a file in large blocks
+
+    BUFSIZE     = 1 << 20
+
+    def __init__(self, filename):
+
+        self.file       = open(filename, 'w', buffering = FileSink.BUFSIZE)
+        self.write      = self.file.write
+        self.flush      = self.file.flush
+        self.close      = self.file.close
+
+
+class CompressedSink(object):
+    # compresses with gzip, or zstd if the name ends with .zst (requires
+    # the zstandard module), on a background thread
+
+    BLOCK       = 1 << 20       # characters handed to the thread at a time
+    DEPTH       = 4             # blocks queued before write() waits
+
+    def __init__(self, filename):
+
+        import queue
+        import threading
+        if filename.endswith('.zst'):
+            import zstandard
+            self.file   = zstandard.ZstdCompressor().stream_writer(open(filename, 'wb'))
+        else:
+            import gzip
+            self.file   = gzip.open(filename, 'wb', 6)
+        self.parts      = [ ]
+        self.size       = 0
+        self.error      = None
+        self.queue      = queue.Queue(CompressedSink.DEPTH)
+        self.thread     = threading.Thread(target = self.writer, daemon = True)
+        self.thread.start()
+
+    def write(self, s):
+
+        self.parts.append(s)
+        self.size += len(s)
+        if self.size >= CompressedSink.BLOCK:
+            self.flush()
+        return len(s)
+
+    def flush(self):
+
+        if self.parts:
+            self.queue.put(''.join(self.parts).encode())
+            self.parts, self.size = [ ], 0
+
+    def writer(self):
+        # zlib and zstd release the GIL while compressing
+
+        while True:
+            block = self.queue.get()
+            if block is None:
+                break
+            if self.error is None:
+                try:
+                    self.file.write(block)
+                except OSError as e:
+                    self.error = e          # raised by close()
+
+    def close(self):
+
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            self.file.close()
+        except OSError as e:
+            self.error = self.error or e
+        if self.error is not None:
+            raise self.error
+
+
+class RingSink(object):
+    # keeps only the last n lines in memory, and writes them to out (None:
+    # stdout) on close()
+
+    def __init__(self, n, out = None):
+
+        self.lines      = collections.deque(maxlen = n)
+        self.partial    = ''
+        self.out        = out
+
+    def write(self, s):
+
+        if '\n' in s:
+            lines = (self.partial + s).split('\n')
+            self.lines.extend(lines[:-1])
+            self.partial = lines[-1]
+        else:
+            self.partial += s
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def dump(self, out = None):
+        # writes the lines kept so far
+
+        out = sys.stdout if out is None else out
+        out.write(''.join(line + '\n' for line in self.lines) + self.partial)
+
+    def close(self):
+
+        self.dump(self.out)
+        if self.out is not None:
+            self.out.close()
+        else:
+            sys.stdout.flush()
+
+
+#--------------------------------------------------------------------------
+#   MemFile: memory contents in files (--load-mem, --dump-mem)
+#--------------------------------------------------------------------------
+
+# A file is either raw little-endian bytes or a NumPy .npy array (of any
+# integer type, stored as its little-endian bytes). Only dmem can be loaded
+# or dumped: the translations of --aot and -e dbt are cached by the ELF
+# file, and would not see changes made to imem.
+
+class MemFile(object):
+
+    @staticmethod
+    def memory(cpu, addr, size):
+        # returns the memory that holds addr - addr + size - 1
+
+        mem = cpu.dmem
+        if addr < mem.mem_start or addr + size > mem.mem_end:
+            raise ValueError("0x%08x - 0x%08x is not in dmem" % (addr, addr + size - 1))
+        return mem
+
+    @staticmethod
+    def load(cpu, filename, addr):
+        # copies the contents of filename to addr; the file is memory-mapped
+        # so that it is copied only once, into the memory itself
+
+        if filename.endswith('.npy'):
+            data = np.load(filename, mmap_mode = 'r')
+            data = data.astype(data.dtype.newbyteorder('<'), copy = False)
+            data = np.ascontiguousarray(data).view(np.uint8).reshape(-1)
+        elif os.path.getsize(filename):
+            data = np.memmap(filename, dtype = np.uint8, mode = 'r')
+        else:
+            data = np.zeros(0, dtype = np.uint8)
+        MemFile.memory(cpu, addr, len(data)).load(addr, data)
+
+    @staticmethod
+    def save(cpu, start, end, filename):
+        # writes the contents of start - end - 1 to filename
+
+        data = MemFile.memory(cpu, start, end - start).read_bytes(start, end - start)
+        if filename.endswith('.npy'):
+            aligned = start % WORD_SIZE == 0 and end % WORD_SIZE == 0
+            np.save(filename, data.view('<u4') if aligned else data)
+        else:
+            data.tofile(filename)
+
+
+#--------------------------------------------------------------------------
+#   Checkpoint: the state at an instruction count (--checkpoint-at, --restore)
+#--------------------------------------------------------------------------
+
+# A checkpoint file holds the architectural state after a number of
+# instructions, so that a later run can start from there instead of from
+# the entry point. Only the memory pages that differ from the image of the
+# ELF file are kept, since the file is restored on top of it:
+#
+#   header:     CKPT_HEADER (elf: hash of the ELF file as in ImageCache)
+#   regs:       NUM_REGS words
+#   pipeline:   npipe words, the pipeline registers (snurisc5 only)
+#   pages:      npages CKPT_PAGE entries
+#   data:       the pages, each compressed with zlib
+#
+# pc is the address of the next instruction to execute. A checkpoint of
+# snurisc can be restored by snurisc5 (starting with an empty pipeline),
+# and vice versa, which allows fast-forwarding with the ISA simulator.
+# The file is written with a single write and memory-mapped to restore.
+
+CKPT_MAGIC          = b'PYRISCCK'
+CKPT_VERSION        = 1
+
+CKPT_HEADER         = np.dtype([ ('magic', 'S8'), ('version', '<u2'), ('npipe', '<u2'),
+                                 ('npages', '<u4'), ('pc', '<u4'), ('reserved', '<u4'),
+                                 ('cycle', '<u8'), ('icount', '<u8'), ('inst_alu', '<u8'),
+                                 ('inst_mem', '<u8'), ('inst_ctrl', '<u8'), ('elf', 'S32') ])
+CKPT_PAGE           = np.dtype([ ('addr', '<u4'), ('size', '<u4'), ('offset', '<u8'),
+                                 ('length', '<u4'), ('reserved', '<u4') ])
+
+class Checkpoint(object):
+
+    PAGE_SIZE   = 1 << 12
+    LEVEL       = 1             # zlib compression level
+
+    def __init__(self, filename, at, prog):
+        # a checkpoint to take after at instructions of the program loaded
+        # by prog
+
+        self.filename   = filename
+        self.at         = at
+        self.prog       = prog
+
+    def base(self, cpu):
+        # returns the pages of the ELF file as loaded, in a PagedMemory
+
+        base = PagedMemory([ (cpu.imem.mem_start, cpu.imem.mem_end - cpu.imem.mem_start, 'rw'),
+                             (cpu.dmem.mem_start, cpu.dmem.mem_end - cpu.dmem.mem_start, 'rw') ],
+                           WORD_SIZE)
+        for addr, memsz, image in self.prog.segments:
+            base.load(addr, image, memsz)
+        return base
+
+    def pages(self, cpu):
+        # returns [ (addr, bytes), ... ] for the pages that differ from the
+        # ELF image. imem and dmem start at page boundaries.
+
+        base = self.base(cpu)
+        pages = [ ]
+        for mem in [ cpu.imem, cpu.dmem ]:
+            start, end = int(mem.mem_start), int(mem.mem_end)
+            first = start // self.PAGE_SIZE
+            if isinstance(mem, PagedMemory):
+                candidates = set(mem.pages)
+            else:
+                # Pages with a nonzero word, found without a copy
+                words = mem.array()
+                n = len(words) // (self.PAGE_SIZE // WORD_SIZE) * (self.PAGE_SIZE // WORD_SIZE)
+                full = words[:n].reshape(-1, self.PAGE_SIZE // WORD_SIZE).any(axis = 1)
+                candidates = set((first + np.flatnonzero(full)).tolist())
+                if words[n:].any():
+                    candidates.add(first + len(full))
+            candidates |= set(base.pages)
+            for pn in sorted(candidates):
+                lo = max(pn * self.PAGE_SIZE, start)
+                hi = min((pn + 1) * self.PAGE_SIZE, end)
+                if lo >= hi:
+                    continue
+                data = mem.read_bytes(lo, hi - lo)
+                if pn in base.pages:
+                    ref = np.frombuffer(base.pages[pn], dtype = np.uint8)[lo - pn * self.PAGE_SIZE:
+                                                                          hi - pn * self.PAGE_SIZE]
+                    dirty = not np.array_equal(data, ref)
+                else:
+                    dirty = data.any()
+                if dirty:
+                    pages.append((lo, data))
+        return pages
+
+    def save(self, cpu, pc, regs, pipeline = ()):
+        # writes the checkpoint; regs: the RegisterFile, pipeline: the
+        # values of the pipeline registers
+
+        pages = self.pages(cpu)
+        blobs = [ zlib.compress(data, self.LEVEL) for addr, data in pages ]
+        table = np.zeros(len(pages), dtype = CKPT_PAGE)
+        offset = 0
+        for i, ((addr, data), blob) in enumerate(zip(pages, blobs)):
+            table[i] = (addr, len(data), offset, len(blob), 0)
+            offset += len(blob)
+
+        s = cpu.stat
+        header = np.array([ (CKPT_MAGIC, CKPT_VERSION, len(pipeline), len(pages), int(pc), 0,
+                             s.cycle, s.icount, s.inst_alu, s.inst_mem, s.inst_ctrl,
+                             self.prog.digest.encode()) ], dtype = CKPT_HEADER)
+        parts = [ header.tobytes(),
+                  np.array([ int(r) for r in regs.reg ], dtype = '<u4').tobytes(),
+                  np.array([ int(v) for v in pipeline ], dtype = '<u4').tobytes(),
+                  table.tobytes() ] + blobs
+
+        # Written atomically so that a failed run leaves no partial file
+        tmp = "%s.%d.tmp" % (self.filename, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(parts))
+        os.replace(tmp, self.filename)
+
+    @staticmethod
+    def restore(cpu, filename, prog, regs):
+        # restores the checkpoint on top of the ELF image loaded by prog;
+        # returns (pc, pipeline). Raises ValueError if it is not a
+        # checkpoint of that program or does not fit in memory.
+
+        if os.path.getsize(filename) < CKPT_HEADER.itemsize:
+            raise ValueError("File %s is not a checkpoint" % filename)
+        data = np.memmap(filename, dtype = np.uint8, mode = 'r')
+        header = np.frombuffer(data[:CKPT_HEADER.itemsize], dtype = CKPT_HEADER)[0]
+        if header['magic'] != CKPT_MAGIC or header['version'] != CKPT_VERSION:
+            raise ValueError("File %s is not a checkpoint" % filename)
+        if header['elf'].decode('ascii', 'replace') != prog.digest:
+            raise ValueError("Checkpoint %s was not taken with this program" % filename)
+
+        offset = CKPT_HEADER.itemsize
+        count = NUM_REGS + int(header['npipe'])
+        npages = int(header['npages'])
+        if len(data) < offset + count * 4 + npages * CKPT_PAGE.itemsize:
+            raise ValueError("Checkpoint %s is truncated" % filename)
+        values = np.frombuffer(data, dtype = '<u4', count = count, offset = offset).tolist()
+        offset += count * 4
+        table = np.frombuffer(data, dtype = CKPT_PAGE, count = npages, offset = offset)
+        offset += table.nbytes
+        if npages and offset + int((table['offset'] + table['length']).max()) > len(data):
+            raise ValueError("Checkpoint %s is truncated" % filename)
+
+        for addr, size, start, length, _ in table.tolist():
+            mem = None
+            for m in [ cpu.imem, cpu.dmem ]:
+                if m.mem_start <= addr and addr + size <= m.mem_end:
+                    mem = m
+            if mem is None:
+                raise ValueError("Checkpoint %s does not fit in memory (0x%08x)" % (filename, addr))
+            try:
+                page = zlib.decompress(data[offset + start:offset + start + length])
+            except zlib.error:
+                raise ValueError("Checkpoint %s is corrupted" % filename)
+            mem.load(addr, page)
+
+        for r in range(1, NUM_REGS):
+            regs.write(r, values[r])
+        s = cpu.stat
+        s.cycle, s.icount, s.inst_alu, s.inst_mem, s.inst_ctrl = \
+            [ int(header[f]) for f in [ 'cycle', 'icount', 'inst_alu', 'inst_mem', 'inst_ctrl' ] ]
+        return int(header['pc']), values[NUM_REGS:]
+
 
 #--------------------------------------------------------------------------
 #   Stat: supports run-time stat collecting and printing
@@ -196,18 +880,43 @@ class Log(object):
 
 class Stat(object):
 
-    cycle           = 0         # number of CPU cycles
-    icount          = 0         # number of instructions executed
+    def __init__(self):
+        self.cycle          = 0         # number of CPU cycles
+        self.icount         = 0         # number of instructions executed
 
-    inst_alu        = 0         # number of ALU instructions
-    inst_mem        = 0         # number of load/store instructions
-    inst_ctrl       = 0         # number of control transfer instructions
+        self.inst_alu       = 0         # number of ALU instructions
+        self.inst_mem       = 0         # number of load/store instructions
+        self.inst_ctrl      = 0         # number of control transfer instructions
 
-    @staticmethod
-    def show():
-        print("%d instructions executed in %d cycles. CPI = %.3f" % (Stat.icount, Stat.cycle, 0.0 if Stat.icount == 0 else  Stat.cycle / Stat.icount))
-        print("Data transfer:    %d instructions (%.2f%%)" % (Stat.inst_mem, 0.0 if Stat.icount == 0 else Stat.inst_mem * 100.0 / Stat.icount))
-        print("ALU operation:    %d instructions (%.2f%%)" % (Stat.inst_alu, 0.0 if Stat.icount == 0 else Stat.inst_alu * 100.0 / Stat.icount))
-        print("Control transfer: %d instructions (%.2f%%)" % (Stat.inst_ctrl, 0.0 if Stat.icount == 0 else Stat.inst_ctrl * 100.0 / Stat.icount))
+    def show(self, out = None):
+        print("%d instructions executed in %d cycles. CPI = %.3f" % (self.icount, self.cycle, 0.0 if self.icount == 0 else  self.cycle / self.icount), file = out)
+        print("Data transfer:    %d instructions (%.2f%%)" % (self.inst_mem, 0.0 if self.icount == 0 else self.inst_mem * 100.0 / self.icount), file = out)
+        print("ALU operation:    %d instructions (%.2f%%)" % (self.inst_alu, 0.0 if self.icount == 0 else self.inst_alu * 100.0 / self.icount), file = out)
+        print("Control transfer: %d instructions (%.2f%%)" % (self.inst_ctrl, 0.0 if self.icount == 0 else self.inst_ctrl * 100.0 / self.icount), file = out)
 
 
+#--------------------------------------------------------------------------
+#   Startup: measures the startup latency (--startup-report)
+#--------------------------------------------------------------------------
+
+class Startup(object):
+
+    enabled         = False
+    marks           = [ ]       # [ (phase, time.perf_counter()), ... ]
+
+    @staticmethod
+    def mark(phase, t = None):
+        # records the end of a phase; only the first mark of a phase counts
+        if Startup.enabled and phase not in [ p for p, _ in Startup.marks ]:
+            Startup.marks.append((phase, time.perf_counter() if t is None else t))
+
+    @staticmethod
+    def show():
+        if len(Startup.marks) < 2:
+            return
+        start = prev = Startup.marks[0][1]
+        print("Startup latency:")
+        for phase, t in Startup.marks[1:]:
+            print("  %-20s %8.2f ms" % (phase, (t - prev) * 1000))
+            prev = t
+        print("  %-20s %8.2f ms" % ("total", (prev - start) * 1000))
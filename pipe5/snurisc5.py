@@ -16,6 +16,10 @@
 #==========================================================================
 
 import sys
+import copy
+import time
+
+STARTED = time.perf_counter()      # for --startup-report
 
 from consts import *
 from isa import *
@@ -24,6 +28,8 @@ from program import *
 from datapath import *
 from control import *
 
+IMPORTED = time.perf_counter()
+
 
 #--------------------------------------------------------------------------
 #   Configurations
@@ -45,21 +51,116 @@ DMEM_SIZE   = WORD(64 * 1024)
 
 class SNURISC5(object):
 
-    def __init__(self):
+    # Engines for -e, and those that work with --paged
+    engines         = [ ENGINE_NUMPY, ENGINE_INT ]
+    paged_engines   = [ ENGINE_NUMPY, ENGINE_INT ]
+
+    # Defaults for new machines (set from the command line)
+    engine          = ENGINE_NUMPY      # default execution engine
+    paged           = False             # use sparse paged memories (--paged)
+    dmem_size       = DMEM_SIZE
+    trace_file      = None              # binary trace file name (--trace)
+    log_file        = None              # log output file name (--log-file)
+    log_tail        = 0                 # lines of the log kept (--log-tail)
+    load_mem        = [ ]               # (file, addr) to load (--load-mem)
+    dump_mem        = [ ]               # (start, end, file) to dump (--dump-mem)
+    checkpoint_at   = None              # instruction count to checkpoint at (--checkpoint-at)
+    checkpoint_file = None
+    restore_file    = None              # checkpoint to start from (--restore)
+
+    def __init__(self, engine = None, paged = None, dmem_size = None):
+
+        if engine is not None:
+            self.engine = engine
+        if paged is not None:
+            self.paged = paged
+        if dmem_size is not None:
+            self.dmem_size = WORD(dmem_size)
 
         stages = [ IF(), ID(), EX(), MM(), WB() ]
         self.ctl = Control()
         Pipe.set_stages(self, stages, self.ctl)
+
+        # Per-machine simulation state
+        self.stat = Stat()
+        self.log = Log()
+        self.asmcache = AsmCache()
+        self.trace = None                   # TraceWriter, if tracing
+        self.history = History() if History.size else None
+        self.checkpoint = None              # Checkpoint to take, if any
        
-        self.rf = RegisterFile()
-        self.alu = ALU()
-        self.imem = Memory(IMEM_START, IMEM_SIZE, WORD_SIZE)
-        self.dmem = Memory(DMEM_START, DMEM_SIZE, WORD_SIZE)
-        self.adder_brtarget = Adder()
-        self.adder_pcplus4 = Adder()
+        if self.engine == ENGINE_INT:
+            self.rf = IntRegisterFile()
+            self.alu = IntALU()
+            self.adder_brtarget = IntAdder()
+            self.adder_pcplus4 = IntAdder()
+        else:
+            self.rf = RegisterFile()
+            self.alu = ALU()
+            self.adder_brtarget = Adder()
+            self.adder_pcplus4 = Adder()
+
+        if self.paged:
+            dtype = None if self.engine == ENGINE_INT else WORD
+            self.imem = PagedMemory([ (IMEM_START, IMEM_SIZE, 'r') ], WORD_SIZE, dtype)
+            self.dmem = PagedMemory([ (DMEM_START, self.dmem_size, 'rw') ], WORD_SIZE, dtype)
+        elif self.engine == ENGINE_INT:
+            self.imem = ByteMemory(IMEM_START, IMEM_SIZE, WORD_SIZE)
+            self.dmem = ByteMemory(DMEM_START, self.dmem_size, WORD_SIZE)
+        else:
+            self.imem = Memory(IMEM_START, IMEM_SIZE, WORD_SIZE)
+            self.dmem = Memory(DMEM_START, self.dmem_size, WORD_SIZE)
 
     def run(self, entry_point):
-        Pipe.run(entry_point)
+
+        ck = self.checkpoint
+        if ck is not None and self.stat.icount < ck.at:
+            # Stop at the checkpoint and go on with the pipeline as it is
+            status = self.execute(entry_point, ck.at - self.stat.icount)
+            if status == EXC_NONE:
+                pc, pipeline = Pipe.save_state(self)
+                try:
+                    ck.save(self, pc, self.rf, pipeline)
+                except OSError as e:
+                    print("Cannot write checkpoint %s: %s" % (ck.filename, e))
+                status = self.execute(self.IF.reg_pc)
+            else:
+                print("No checkpoint taken: the program stopped before %d instructions" % ck.at)
+        else:
+            status = self.execute(entry_point)
+        Pipe.report(self, status)
+
+    def execute(self, entry_point, max_insts = None, max_cycles = None):
+        # runs the program without printing the outcome; returns the
+        # status as Pipe.execute()
+        if self.engine == ENGINE_INT:
+            entry_point = int(entry_point)
+        return Pipe.execute(self, entry_point, max_insts, max_cycles)
+
+    def fork(self):
+        # returns a copy of the machine that goes on independently, e.g.,
+        # with some registers or memory words changed. Only the registers and
+        # the pipeline are copied: with paged memories, the pages are shared
+        # copy-on-write (PagedMemory.fork()), and flat ones are copied. The
+        # copy shares the log output and the disassembly cache, but not the
+        # trace or the checkpoint to take. It can be pickled to run in
+        # another process.
+
+        memo = { id(self.imem): self.imem.fork(), id(self.dmem): self.dmem.fork(),
+                 id(self.asmcache): self.asmcache }
+        child = copy.deepcopy(self, memo)
+        child.log.out = self.log.out
+        return child
+
+    def __getstate__(self):
+        # also used by fork(): the log output, the trace, and the checkpoint
+        # to take stay with this machine
+
+        state = dict(self.__dict__)
+        state.update(trace = None, checkpoint = None)
+        state['log'] = copy.copy(self.log)
+        state['log'].out = None
+        return state
 
 
 #--------------------------------------------------------------------------
@@ -68,7 +169,7 @@ class SNURISC5(object):
 
 def show_usage(name):
     print("SNURISC5: A 5-stage Pipelined RISC-V ISA Simulator in Python")
-    print("Usage: %s [-l n] [-c m] filename" % name)
+    print("Usage: %s [-l n] [-c m] [-e engine] [--paged] [--dmem-size n] [--trace file] [--log-file file] [--log-tail n] [--history n] [--snapshot n] [--load-mem file@addr] [--dump-mem start:end:file] [--checkpoint-at n file] [--restore file] [--startup-report] filename" % name)
     print("\tfilename: RISC-V executable file name")
     print("\t-l sets the desired log level n (default: 4)")
     print("\t   0: shows no output message")
@@ -79,16 +180,57 @@ def show_usage(name):
     print("\t   5: 4 + shows full information for each instruction")
     print("\t   6: 5 + dumps registers for each cycle")
     print("\t   7: 6 + dumps data memory for each cycle")
-    print("\t-c shows logs after cycle m (default: 0, only effective for log level 3 or higher)")
+    print("\t-c shows logs after cycle m (default: 0, only effective for log level 3 or higher or --trace)")
+    print("\t-e selects the execution engine (default: numpy)")
+    print("\t   numpy: keeps registers and memory in NumPy 32-bit integers")
+    print("\t   int:   keeps registers and memory in Python ints (faster)")
+    print("\t--paged allocates memory in 4KB pages on first touch (imem: read-only, dmem: read/write)")
+    print("\t--dmem-size sets the dmem size in bytes, with an optional K/M/G suffix (default: 64K)")
+    print("\t--trace writes a binary trace of the WB stage in each cycle to file (gzip-compressed")
+    print("\t   if it ends with .gz); see tracefile.py to read it")
+    print("\t--log-file writes the output of the run to file in large blocks instead of stdout")
+    print("\t   (compressed on a background thread if it ends with .gz, or .zst with zstandard)")
+    print("\t--log-tail keeps only the last n lines of the output, shown at the end (or written to --log-file)")
+    print("\t--history shows the last n instructions executed when an exception occurs (default: 16, 0: off)")
+    print("\t--snapshot dumps everything every n cycles at log levels 6-7, and only what changed in between")
+    print("\t   (default: 0, only in the first cycle; 1: every cycle)")
+    print("\t--load-mem copies a raw binary or .npy file to dmem at addr after loading (repeatable)")
+    print("\t--dump-mem writes dmem from start up to end (exclusive) to file after the run, as raw")
+    print("\t   little-endian bytes, or as .npy if file ends with .npy (repeatable)")
+    print("\t--checkpoint-at writes the state after n instructions to file, keeping only the memory")
+    print("\t   pages changed since loading, and continues the run")
+    print("\t--restore starts the run from a checkpoint of the same executable file")
+    print("\t--startup-report shows the time spent on imports, loading, and setup before the first instruction")
+
+
+def parse_size(arg):
+    # returns the number of bytes in arg (e.g., 4096, 0x1000, 256M), or None
+    units = { 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30 }
+    try:
+        if arg[-1:].upper() in units:
+            return int(arg[:-1], 0) * units[arg[-1:].upper()]
+        return int(arg, 0)
+    except ValueError:
+        return None
 
 
 def parse_args(args):
-    if (not len(args) in [ 2, 4, 6 ]):
+    if len(args) < 2:
         return None
 
     index = 1
-    while True:
+    while index < len(args):
         if args[index].startswith('-'):
+            if args[index] == '--paged':
+                SNURISC5.paged = True
+                index += 1
+                continue
+            elif args[index] == '--startup-report':
+                Startup.enabled = True
+                index += 1
+                continue
+            elif index + 2 >= len(args):
+                return None
             if args[index] == '-l':
                 try:
                     level = int(args[index + 1])
@@ -107,6 +249,78 @@ def parse_args(args):
                     return None
                 index += 2
                 Log.start_cycle = cycle
+            elif args[index] == '-e':
+                if args[index + 1] not in SNURISC5.engines:
+                    print("Invalid engine '%s'" % args[index + 1])
+                    return None
+                SNURISC5.engine = args[index + 1]
+                index += 2
+            elif args[index] == '--dmem-size':
+                size = parse_size(args[index + 1])
+                if size is None or size <= 0 or size % WORD_SIZE or \
+                    int(DMEM_START) + size >= 1 << 32:
+                    print("Invalid dmem size '%s'" % args[index + 1])
+                    return None
+                SNURISC5.dmem_size = WORD(size)
+                index += 2
+            elif args[index] == '--trace':
+                SNURISC5.trace_file = args[index + 1]
+                index += 2
+            elif args[index] == '--history':
+                if not args[index + 1].isdigit():
+                    print("Invalid number of instructions '%s'" % args[index + 1])
+                    return None
+                History.size = int(args[index + 1])
+                index += 2
+            elif args[index] == '--snapshot':
+                if not args[index + 1].isdigit():
+                    print("Invalid number of cycles '%s'" % args[index + 1])
+                    return None
+                CycleDump.snapshot = int(args[index + 1])
+                index += 2
+            elif args[index] == '--log-file':
+                SNURISC5.log_file = args[index + 1]
+                index += 2
+            elif args[index] == '--log-tail':
+                if not args[index + 1].isdigit() or int(args[index + 1]) < 1:
+                    print("Invalid number of lines '%s'" % args[index + 1])
+                    return None
+                SNURISC5.log_tail = int(args[index + 1])
+                index += 2
+            elif args[index] == '--checkpoint-at':
+                if index + 3 >= len(args):
+                    return None
+                if not args[index + 1].isdigit():
+                    print("Invalid number of instructions '%s'" % args[index + 1])
+                    return None
+                SNURISC5.checkpoint_at = int(args[index + 1])
+                SNURISC5.checkpoint_file = args[index + 2]
+                index += 3
+            elif args[index] == '--restore':
+                SNURISC5.restore_file = args[index + 1]
+                index += 2
+            elif args[index] == '--load-mem':
+                name, _, addr = args[index + 1].rpartition('@')
+                try:
+                    addr = int(addr, 0)
+                except ValueError:
+                    name = ''
+                if not name:
+                    print("Invalid file@addr '%s'" % args[index + 1])
+                    return None
+                SNURISC5.load_mem.append((name, addr))
+                index += 2
+            elif args[index] == '--dump-mem':
+                fields = args[index + 1].split(':', 2)
+                try:
+                    start, end = int(fields[0], 0), int(fields[1], 0)
+                except (ValueError, IndexError):
+                    start, end = 0, 0
+                if start >= end or len(fields) < 3 or not fields[2]:
+                    print("Invalid start:end:file '%s'" % args[index + 1])
+                    return None
+                SNURISC5.dump_mem.append((start, end, fields[2]))
+                index += 2
             else:
                 print("Invalid option '%s'" % args[index])
                 return None
@@ -114,7 +328,8 @@ def parse_args(args):
             break
 
     if len(args) != index + 1:
-        print("Invalid argument '%s'" % args[index + 1:])
+        if index < len(args):
+            print("Invalid argument '%s'" % args[index + 1:])
         return None
 
     return args[index]      # executable file name
@@ -131,13 +346,62 @@ def main():
         show_usage(sys.argv[0])
         sys.exit()
 
+    Startup.mark("start", STARTED)
+    Startup.mark("imports", IMPORTED)
+
     cpu = SNURISC5()                        # make a CPU instance with hw components
+    Startup.mark("machine")
     prog = Program()                        # make a program instance
     entry_point = prog.load(cpu, filename)  # load a program
     if not entry_point:                     # if no entry point, exit
         sys.exit()
+    Startup.mark("load")
+    if SNURISC5.restore_file:               # start from a checkpoint (--restore)
+        try:
+            pc, pipeline = Checkpoint.restore(cpu, SNURISC5.restore_file, prog, cpu.rf)
+            if pipeline and len(pipeline) != len(Pipe.registers(cpu)):
+                raise ValueError("Checkpoint %s has a different pipeline" % SNURISC5.restore_file)
+        except (OSError, ValueError) as e:
+            print(e)
+            sys.exit()
+        # A checkpoint of snurisc starts with an empty pipeline
+        entry_point = Pipe.restore_state(cpu, pipeline) if pipeline else WORD(pc)
+        Startup.mark("restore")
+    if SNURISC5.checkpoint_file:
+        cpu.checkpoint = Checkpoint(SNURISC5.checkpoint_file, SNURISC5.checkpoint_at, prog)
+    try:
+        for name, addr in SNURISC5.load_mem:    # copy data files to dmem (--load-mem)
+            MemFile.load(cpu, name, addr)
+        for start, end, name in SNURISC5.dump_mem:
+            MemFile.memory(cpu, start, end - start)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit()
+    if SNURISC5.trace_file:                 # open the trace file (--trace)
+        from tracefile import TraceWriter
+        try:
+            cpu.trace = TraceWriter(SNURISC5.trace_file)
+        except OSError:
+            print("Cannot open trace file %s" % SNURISC5.trace_file)
+            sys.exit()
+    if SNURISC5.log_file or SNURISC5.log_tail:  # redirect the output (--log-file, --log-tail)
+        try:
+            cpu.log.out = Log.sink(SNURISC5.log_file, SNURISC5.log_tail)
+        except (OSError, ImportError) as e:
+            print("Cannot open log file %s: %s" % (SNURISC5.log_file, e))
+            sys.exit()
     cpu.run(entry_point)                    # run the program starting from entry_point
-    Stat.show()                             # show stats
+    if cpu.trace:
+        cpu.trace.close()
+    try:
+        for start, end, name in SNURISC5.dump_mem: # dump dmem to files (--dump-mem)
+            MemFile.save(cpu, start, end, name)
+    except (OSError, ValueError) as e:
+        print(e)
+    cpu.stat.show(cpu.log.out)              # show stats
+    if cpu.log.out:
+        cpu.log.out.close()
+    Startup.show()                          # show startup latency (--startup-report)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,388 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   pyrisc: runs the PyRISC simulators from Python programs
+#
+#   Jin-Soo Kim
+#   Systems Software and Architecture Laboratory
+#   Seoul National University
+#   http://csl.snu.ac.kr
+#
+#==========================================================================
+
+
+import os
+import json
+import hashlib
+import builtins
+import threading
+import importlib.util
+from dataclasses import dataclass
+
+import numpy as np
+
+
+#--------------------------------------------------------------------------
+#   Constants
+#--------------------------------------------------------------------------
+
+ROOT                = os.path.dirname(os.path.abspath(__file__))
+
+# Simulators: directory -> (main module, machine class)
+MACHINES            = {
+    'sim'       : ('snurisc',  'SNURISC'),
+    'pipe5'     : ('snurisc5', 'SNURISC5'),
+}
+
+# Same as in consts.py
+EXC_NONE            = 0
+EXC_IMEM_ERROR      = 1
+EXC_DMEM_ERROR      = 2
+EXC_ILLEGAL_INST    = 4
+EXC_EBREAK          = 8
+
+EXC_MSG = {         EXC_IMEM_ERROR:     "imem access error",
+                    EXC_DMEM_ERROR:     "dmem access error",
+                    EXC_ILLEGAL_INST:   "illegal instruction",
+                    EXC_EBREAK:         "ebreak",
+}
+
+
+#--------------------------------------------------------------------------
+#   Tree: the modules of a simulator directory, imported in isolation
+#--------------------------------------------------------------------------
+
+# The simulators in ./sim and ./pipe5 import each other's modules by
+# plain names (consts, isa, components, program, ...), some of which
+# exist in both directories. Instead of going through sys.path and
+# sys.modules, the modules of each directory are given their own
+# __import__ that resolves these names within the directory, so both
+# simulators can be used in the same process, from any thread.
+
+class Tree(object):
+
+    lock        = threading.RLock()
+    trees       = { }
+
+    def __init__(self, name):
+
+        self.name       = name
+        self.dir        = os.path.join(ROOT, name)
+        self.names      = { f[:-3] for f in os.listdir(self.dir) if f.endswith('.py') }
+        self.modules    = { }
+        self.builtins   = dict(builtins.__dict__, __import__ = self.importer)
+        self.sources    = None
+
+    @staticmethod
+    def get(name):
+
+        with Tree.lock:
+            tree = Tree.trees.get(name)
+            if tree is None:
+                tree = Tree.trees[name] = Tree(name)
+        return tree
+
+    def importer(self, name, globals = None, locals = None, fromlist = (), level = 0):
+
+        if level == 0 and name in self.names:
+            return self.module(name)
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def module(self, name):
+
+        m = self.modules.get(name)
+        if m is not None:
+            return m
+        with Tree.lock:
+            m = self.modules.get(name)
+            if m is None:
+                spec = importlib.util.spec_from_file_location("pyrisc.%s.%s" % (self.name, name),
+                                                              os.path.join(self.dir, name + '.py'))
+                m = importlib.util.module_from_spec(spec)
+                m.__builtins__ = self.builtins
+                self.modules[name] = m
+                try:
+                    spec.loader.exec_module(m)
+                except BaseException:
+                    del self.modules[name]
+                    raise
+        return m
+
+    def digest(self):
+        # returns the hash of the simulator sources, including this file
+
+        if self.sources is None:
+            h = hashlib.sha256()
+            for path in sorted(os.path.join(self.dir, n + '.py') for n in self.names) + \
+                        [ os.path.abspath(__file__) ]:
+                with open(path, 'rb') as f:
+                    h.update(f.read())
+            self.sources = h.digest()
+        return self.sources
+
+
+#--------------------------------------------------------------------------
+#   Results
+#--------------------------------------------------------------------------
+
+@dataclass
+class Stat:
+    cycle:      int = 0         # number of CPU cycles
+    icount:     int = 0         # number of instructions executed
+    inst_alu:   int = 0         # number of ALU instructions
+    inst_mem:   int = 0         # number of load/store instructions
+    inst_ctrl:  int = 0         # number of control transfer instructions
+
+    @property
+    def cpi(self):
+        return 0.0 if self.icount == 0 else self.cycle / self.icount
+
+
+@dataclass
+class Result:
+    status:     int             # EXC_* of the instruction that stopped the
+                                # program (EXC_EBREAK if it completed), or
+                                # EXC_NONE if the budget ran out
+    pc:         int             # sim: pc of that instruction (or of the next
+                                # one to execute); pipe5: pc in the WB stage
+                                # in the last cycle
+    regs:       list            # x0 - x31 as ints
+    dmem:       object          # dmem contents as a NumPy array of uint32 words
+    dmem_start: int             # address of dmem[0]
+    stat:       Stat
+
+    @property
+    def completed(self):
+        return self.status == EXC_EBREAK
+
+    @property
+    def message(self):
+        return EXC_MSG.get(self.status, "budget exhausted")
+
+    def read_word(self, addr):
+        # returns the dmem word at addr
+        return int(self.dmem[(addr - self.dmem_start) // 4])
+
+
+#--------------------------------------------------------------------------
+#   ResultCache: the results of earlier runs
+#--------------------------------------------------------------------------
+
+# A run is determined by the executable, the dmem image, and the options
+# of run(), so its Result is saved under a hash of these as
+#
+#   <hash>.npz      meta: [ VERSION, status, pc, dmem_start, cycle, icount,
+#                           inst_alu, inst_mem, inst_ctrl ], regs, dmem
+#
+# The hash also covers the simulator sources (Tree.digest()), so editing
+# the simulator invalidates every entry. The modification time of an
+# entry is updated on each hit, and the least recently used entries are
+# removed once the directory grows beyond MAX_SIZE bytes. The size of the
+# directory is counted once per process and then kept up to date with the
+# entries saved, so it is only scanned again when it crosses MAX_SIZE.
+# A result larger than MAX_SIZE by itself is not cached at all.
+
+class ResultCache(object):
+
+    VERSION     = 1             # bump when the cached format changes
+    MAX_SIZE    = int(os.environ.get('PYRISC_RESULT_CACHE_SIZE', 256 << 20))
+
+    lock        = threading.Lock()
+    totals      = { }           # directory -> its size in bytes as far as known
+
+    def __init__(self, directory):
+
+        self.dir        = directory
+
+    def path(self, tree, program, dmem_image, config):
+        # returns the path name of the entry for a run
+
+        h = hashlib.sha256(tree.digest())
+        sizes = [ len(program), -1 if dmem_image is None else len(dmem_image) ]
+        h.update(json.dumps([ ResultCache.VERSION ] + sizes + config).encode())
+        h.update(program)
+        if dmem_image is not None:
+            h.update(dmem_image)
+        return os.path.join(self.dir, h.hexdigest()[:32] + '.npz')
+
+    def lookup(self, path):
+        # returns the cached Result, or None
+
+        try:
+            with np.load(path) as f:
+                meta, regs, dmem = f['meta'].tolist(), f['regs'], f['dmem']
+            if meta[0] != ResultCache.VERSION:
+                return None
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return Result(status = meta[1], pc = meta[2], regs = regs.tolist(), dmem = dmem,
+                      dmem_start = meta[3], stat = Stat(*meta[4:9]))
+
+    def save(self, path, r):
+
+        if r.dmem.nbytes > ResultCache.MAX_SIZE:
+            return
+        s = r.stat
+        meta = [ ResultCache.VERSION, r.status, r.pc, r.dmem_start,
+                 s.cycle, s.icount, s.inst_alu, s.inst_mem, s.inst_ctrl ]
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            os.makedirs(self.dir, exist_ok = True)
+            # Written atomically so that concurrent runs never see a partial file
+            with open(tmp, 'wb') as f:
+                np.savez(f, meta = np.array(meta, dtype = np.int64),
+                         regs = np.array(r.regs, dtype = np.int64), dmem = r.dmem)
+            os.replace(tmp, path)
+            size = os.stat(path).st_size
+            with ResultCache.lock:
+                total = ResultCache.totals.get(self.dir)
+                total = self.scan() if total is None else total + size
+                if total > ResultCache.MAX_SIZE:
+                    total = self.evict(path)
+                ResultCache.totals[self.dir] = total
+        except OSError:
+            pass                        # run without caching
+
+    def entries(self):
+        # returns (mtime, size, path) of each entry
+
+        entries = [ ]
+        for e in os.scandir(self.dir):
+            if e.name.endswith('.npz'):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue            # removed by another run
+                entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def scan(self):
+
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self, keep):
+        # removes the least recently used entries but keep, returning the
+        # size of the rest
+
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= ResultCache.MAX_SIZE:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                pass                    # removed by another run
+            total -= size
+        return total
+
+
+#--------------------------------------------------------------------------
+#   preload: imports the modules for run() in advance
+#--------------------------------------------------------------------------
+
+def preload(machine = 'sim', engine = 'numpy'):
+    # e.g., once per worker process, so that the first run() does not pay
+    # for the imports
+
+    tree = Tree.get(machine)
+    tree.module(MACHINES[machine][0])
+    if engine == 'dbt':
+        tree.module('dbt')
+    elif engine == 'numba':
+        tree.module('jit').JIT.kernel()
+
+
+#--------------------------------------------------------------------------
+#   run: loads and runs a program, returning a Result
+#--------------------------------------------------------------------------
+
+def run(program, machine = 'sim', engine = 'numpy', max_insts = None, max_cycles = None,
+        log = None, paged = False, dmem_size = None, dmem_image = None, cache = None,
+        log_out = None):
+    # program:      the path name or the contents (bytes) of an executable file
+    # machine:      'sim' (snurisc) or 'pipe5' (snurisc5)
+    # engine:       the execution engine as in the -e option
+    # max_insts,
+    # max_cycles:   stop after this many instructions or cycles (no limit if None)
+    # log:          the log level as in the -l option (None: no output at all)
+    # paged,
+    # dmem_size:    as in the --paged and --dmem-size options
+    # dmem_image:   bytes copied to the beginning of dmem after loading
+    #               (e.g., input data of the program)
+    # cache:        True or a directory name to reuse the result of an
+    #               identical earlier run (ignored if log is given, since
+    #               a cached run prints nothing, and True is ignored if
+    #               $PYRISC_CACHE is empty)
+    # log_out:      where the log goes instead of stdout: any object with
+    #               write(), such as io.StringIO or the sinks in program.py
+    #
+    # Nothing is printed unless log is given. Raises ValueError if the
+    # arguments are invalid or the program cannot be loaded.
+
+    if machine not in MACHINES:
+        raise ValueError("Invalid machine '%s'" % machine)
+    tree = Tree.get(machine)
+    main_name, cls_name = MACHINES[machine]
+    main = tree.module(main_name)
+    cls = getattr(main, cls_name)
+
+    if engine not in cls.engines:
+        raise ValueError("Invalid engine '%s' for %s" % (engine, machine))
+    if paged and engine not in cls.paged_engines:
+        raise ValueError("Paged memory is not supported by the '%s' engine" % engine)
+    if dmem_size is not None and (dmem_size <= 0 or dmem_size % main.WORD_SIZE or \
+        int(main.DMEM_START) + dmem_size >= 1 << 32):
+        raise ValueError("Invalid dmem size '%s'" % dmem_size)
+
+    if isinstance(program, (bytes, bytearray, memoryview)):
+        filename, data = '<bytes>', bytes(program)
+    else:
+        filename, data = os.fspath(program), None
+
+    store = None
+    if cache and log is None and not (cache is True and main.CACHE_ROOT is None):
+        store = ResultCache(os.path.join(main.CACHE_ROOT, 'result') if cache is True else cache)
+        try:
+            if data is None:
+                with open(filename, 'rb') as f:
+                    data = f.read()
+            path = store.path(tree, data, None if dmem_image is None else bytes(dmem_image),
+                              [ machine, engine, max_insts, max_cycles, bool(paged), dmem_size ])
+            result = store.lookup(path)
+            if result is not None:
+                return result
+        except OSError:
+            store = None                # let the loader report the error
+
+    cpu = cls(engine = engine, paged = paged, dmem_size = dmem_size)
+    cpu.log.level = 0 if log is None else log
+    cpu.log.out = log_out
+
+    prog = main.Program(verbose = False)
+    entry_point = prog.load(cpu, filename, data)
+    if not entry_point:
+        raise ValueError(prog.error)
+    if dmem_image is not None:
+        if len(dmem_image) > cpu.dmem.mem_end - cpu.dmem.mem_start:
+            raise ValueError("The dmem image is larger than dmem")
+        cpu.dmem.load(cpu.dmem.mem_start, dmem_image)
+
+    status = cpu.execute(entry_point, max_insts, max_cycles)
+
+    if machine == 'sim':
+        pc, regs = cpu.pc.read(), cpu.regs
+    else:
+        pc, regs = cpu.WB.pc if cpu.stat.cycle else entry_point, cpu.rf
+    s = cpu.stat
+    result = Result(status = int(status), pc = int(pc),
+                    regs = [ int(r) for r in regs.reg ],
+                    dmem = cpu.dmem.array(), dmem_start = int(cpu.dmem.mem_start),
+                    stat = Stat(s.cycle, s.icount, s.inst_alu, s.inst_mem, s.inst_ctrl))
+    if store is not None:
+        store.save(path, result)
+    return result
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   snurisc-serve: runs programs submitted over a Unix domain socket on a
+#   pool of warm worker processes
+#
+#   Jin-Soo Kim
+#   Systems Software and Architecture Laboratory
+#   Seoul National University
+#   http://csl.snu.ac.kr
+#
+#==========================================================================
+
+
+import os
+import sys
+import json
+import stat
+import signal
+import asyncio
+
+import pyrisc
+from batch import Batch, run_one
+
+
+#--------------------------------------------------------------------------
+#   Protocol
+#--------------------------------------------------------------------------
+
+# A client sends one JSON object per line and may have several jobs in
+# flight on the same connection:
+#
+#   { "id": 1, "program": "asm/fib", "machine": "sim", "engine": "numpy",
+#     "max_insts": n, "max_cycles": n, "regs": [ "a0" ], "input": "in.bin",
+#     "timeout": 2.5, "cache": true }
+#   { "op": "cancel", "id": 1 }
+#
+# Only "program" is required. Each run is answered by one line with the
+# same "id" and the row of batch.py (status, exit, pc, statistics, and
+# the requested registers), or with "error" if it failed, timed out, or
+# was cancelled. Replies are sent in the order the jobs finish.
+
+QUEUED              = 0
+RUNNING             = 1
+DONE                = 2
+
+
+#--------------------------------------------------------------------------
+#   Server: options and the job queue
+#--------------------------------------------------------------------------
+
+class Server(object):
+
+    # Set from the command line
+    machine         = 'sim'             # preloaded by the workers
+    engine          = 'numpy'
+    workers         = os.cpu_count() or 1
+    timeout         = None              # default timeout of a job in seconds
+    cache           = False             # default of "cache" in the requests
+    path            = None              # socket path name
+
+    def __init__(self):
+
+        self.queue      = asyncio.Queue()
+        self.pool       = [ ]
+
+    async def serve(self):
+
+        # Workers are started before accepting jobs so that they are warm
+        self.pool = [ Worker(self) for i in range(Server.workers) ]
+        for w in self.pool:
+            await w.spawn()
+            w.task = asyncio.ensure_future(w.loop())
+
+        if os.path.exists(Server.path) and stat.S_ISSOCK(os.stat(Server.path).st_mode):
+            os.unlink(Server.path)              # left by a previous server
+        server = await asyncio.start_unix_server(self.client, path = Server.path)
+        sys.stderr.write("Serving on %s with %d workers\n" % (Server.path, len(self.pool)))
+
+        stop = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for sig in [ signal.SIGINT, signal.SIGTERM ]:
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+
+        server.close()
+        await server.wait_closed()
+        for w in self.pool:
+            w.task.cancel()
+            await w.kill()
+        os.unlink(Server.path)
+
+    async def client(self, reader, writer):
+        # serves a connection until the client closes it
+
+        conn = Connection(writer)
+        while True:
+            try:
+                line = await reader.readline()
+            except (ValueError, ConnectionError):
+                break                   # a line over the limit, or a reset
+            if not line:
+                break
+            req = None
+            try:
+                req = json.loads(line)
+                if not isinstance(req, dict):
+                    raise ValueError("Request is not a JSON object")
+                self.request(conn, req)
+            except ValueError as e:
+                reply = { 'error': "Invalid request: %s" % e }
+                if isinstance(req, dict):
+                    reply['id'] = req.get('id')
+                conn.send(reply)
+
+        # The results of the remaining jobs have nowhere to go
+        conn.closed = True
+        for job in list(conn.jobs.values()):
+            job.cancel()
+        writer.close()
+
+    def request(self, conn, req):
+
+        op, jid = req.get('op', 'run'), req.get('id')
+        if isinstance(jid, (list, dict)):
+            raise ValueError("Invalid id")
+        if op == 'cancel':
+            job = conn.jobs.get(jid)
+            if job is None:
+                conn.send({ 'id': jid, 'op': op, 'error': "No such job" })
+            else:
+                job.cancel()
+        elif op == 'run':
+            if jid in conn.jobs:
+                raise ValueError("Duplicate id %s" % json.dumps(jid))
+            if not isinstance(req.get('program'), str):
+                raise ValueError("No program")
+            timeout = req.get('timeout', Server.timeout)
+            if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+                raise ValueError("Invalid timeout")
+            for key in [ 'max_insts', 'max_cycles' ]:
+                n = req.get(key)
+                if n is not None and (not isinstance(n, int) or isinstance(n, bool) or n < 0):
+                    raise ValueError("Invalid %s" % key)
+            if not isinstance(req.get('input', ''), (str, type(None))):
+                raise ValueError("Invalid input")
+            machine = req.get('machine', Server.machine)
+            if not isinstance(machine, str) or machine not in pyrisc.MACHINES:
+                raise ValueError("Invalid machine %s" % json.dumps(machine))
+            engine = req.get('engine', Server.engine)
+            if engine not in engines(machine):
+                raise ValueError("Invalid engine %s" % json.dumps(engine))
+            regs = req.get('regs', [ ])
+            if not isinstance(regs, list):
+                raise ValueError("Invalid regs")
+            for name in regs:
+                if not isinstance(name, str) or Batch.regno(machine, name) is None:
+                    raise ValueError("Invalid register %s" % json.dumps(name))
+            job = conn.jobs[jid] = Job(conn, jid, req, timeout)
+            self.queue.put_nowait(job)
+        else:
+            raise ValueError("Invalid op '%s'" % op)
+
+
+def engines(machine):
+    # returns the names of the engines of a simulator
+
+    tree = pyrisc.Tree.get(machine)
+    main_name, cls_name = pyrisc.MACHINES[machine]
+    return getattr(tree.module(main_name), cls_name).engines
+
+
+#--------------------------------------------------------------------------
+#   Connection and Job
+#--------------------------------------------------------------------------
+
+class Connection(object):
+
+    def __init__(self, writer):
+
+        self.writer     = writer
+        self.jobs       = { }           # id -> unfinished job
+        self.closed     = False
+
+    def send(self, reply):
+
+        if not self.closed:
+            self.writer.write((json.dumps(reply) + '\n').encode())
+
+
+class Job(object):
+
+    def __init__(self, conn, jid, req, timeout):
+
+        self.conn       = conn
+        self.id         = jid
+        self.req        = req
+        self.timeout    = timeout       # counted from when a worker picks it up
+        self.state      = QUEUED
+        self.cancelled  = asyncio.Event()
+
+    def cancel(self):
+
+        if self.state == QUEUED:
+            self.finish({ 'error': "cancelled" })
+        elif self.state == RUNNING:
+            self.cancelled.set()        # the worker running it replies
+
+    def finish(self, row):
+
+        self.state = DONE
+        del self.conn.jobs[self.id]
+        row['id'] = self.id
+        self.conn.send(row)
+
+
+#--------------------------------------------------------------------------
+#   Worker: a child process running one job at a time
+#--------------------------------------------------------------------------
+
+# A running simulation cannot be interrupted from outside, so a job that
+# times out or is cancelled kills its worker, which is then replaced by a
+# fresh one right away.
+
+class Worker(object):
+
+    def __init__(self, server):
+
+        self.server     = server
+        self.proc       = None
+        self.task       = None
+
+    async def spawn(self):
+
+        self.proc = await asyncio.create_subprocess_exec(
+                        sys.executable, os.path.abspath(__file__), '--worker',
+                        Server.machine, Server.engine, str(Server.cache),
+                        stdin = asyncio.subprocess.PIPE, stdout = asyncio.subprocess.PIPE,
+                        start_new_session = True)   # not killed by ^C at the terminal
+
+    async def kill(self):
+
+        if self.proc is not None:
+            if self.proc.returncode is None:
+                self.proc.kill()
+            await self.proc.wait()
+            self.proc = None
+
+    async def loop(self):
+
+        while True:
+            job = await self.server.queue.get()
+            if job.state != QUEUED:
+                continue                # cancelled while queued
+            job.state = RUNNING
+
+            self.proc.stdin.write((json.dumps(job.req) + '\n').encode())
+            read = asyncio.ensure_future(self.proc.stdout.readline())
+            cancel = asyncio.ensure_future(job.cancelled.wait())
+            done, pending = await asyncio.wait([ read, cancel ], timeout = job.timeout,
+                                               return_when = asyncio.FIRST_COMPLETED)
+            cancel.cancel()
+            line = read.result() if read in done else None
+            if line:
+                job.finish(json.loads(line))
+                continue
+
+            read.cancel()
+            await self.kill()
+            await self.spawn()
+            error = "cancelled" if cancel in done else \
+                    "timeout" if read not in done else \
+                    "worker exited"
+            job.finish({ 'error': error })
+
+
+def worker_main(machine, engine):
+    # runs the jobs read from stdin, writing a JSON row for each to stdout
+
+    pyrisc.preload(machine, engine)
+    for line in sys.stdin:
+        # The request has been checked by the server
+        req = json.loads(line)
+        machine = req.get('machine', Server.machine)
+        regs = [ (name, Batch.regno(machine, name)) for name in req.get('regs', [ ]) ]
+        row = run_one(req['program'], req.get('input'), machine,
+                      req.get('engine', Server.engine), req.get('max_insts'),
+                      req.get('max_cycles'), regs, bool(req.get('cache', Server.cache)))
+        if row['input'] is None:
+            del row['input']
+        sys.stdout.write(json.dumps(row) + '\n')
+        sys.stdout.flush()
+
+
+#--------------------------------------------------------------------------
+#   Utility functions for command line parsing
+#--------------------------------------------------------------------------
+
+def show_usage(name):
+    print("snurisc-serve: runs RISC-V executable files submitted over a Unix domain socket")
+    print("Usage: %s [-m machine] [-e engine] [-j n] [-t timeout] [--cache] socket" % name)
+    print("\tsocket: path name of the Unix domain socket to listen on")
+    print("\t-m, -e select the simulator and engine preloaded by the workers (default: sim, numpy)")
+    print("\t-j sets the number of worker processes (default: number of CPUs)")
+    print("\t-t sets the timeout in seconds for the jobs which do not give one (default: none)")
+    print("\t--cache reuses the results of identical earlier runs unless a job sets \"cache\": false")
+
+
+def parse_args(args):
+
+    index = 1
+    while index + 1 < len(args) and args[index].startswith('-'):
+        if args[index] == '--cache':
+            Server.cache = True
+            index += 1
+            continue
+        opt, arg = args[index], args[index + 1]
+        index += 2
+        if opt == '-m':
+            if arg not in pyrisc.MACHINES:
+                print("Invalid machine '%s'" % arg)
+                return None
+            Server.machine = arg
+        elif opt == '-e':
+            Server.engine = arg
+        elif opt == '-j':
+            if not arg.isdigit() or int(arg) < 1:
+                print("Invalid number of workers '%s'" % arg)
+                return None
+            Server.workers = int(arg)
+        elif opt == '-t':
+            try:
+                Server.timeout = float(arg)
+            except ValueError:
+                Server.timeout = 0
+            if not Server.timeout > 0:
+                print("Invalid timeout '%s'" % arg)
+                return None
+        else:
+            print("Invalid option '%s'" % opt)
+            return None
+
+    if index + 1 != len(args):
+        return None
+    if Server.engine not in engines(Server.machine):
+        print("Invalid engine '%s'" % Server.engine)
+        return None
+    Server.path = args[index]
+    return Server.path
+
+
+#--------------------------------------------------------------------------
+#   Main
+#--------------------------------------------------------------------------
+
+def main():
+
+    if len(sys.argv) == 5 and sys.argv[1] == '--worker':
+        Server.machine, Server.engine = sys.argv[2:4]
+        Server.cache = sys.argv[4] == 'True'
+        worker_main(Server.machine, Server.engine)
+        return
+
+    if not parse_args(sys.argv):
+        show_usage(sys.argv[0])
+        sys.exit()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(Server().serve())
+    finally:
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
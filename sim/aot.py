@@ -0,0 +1,217 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Classes for ahead-of-time (static) recompilation of a program (--aot).
+#
+#   Jin-Soo Kim
+#   Systems Software and Architecture Laboratory
+#   Seoul National University
+#   http://csl.snu.ac.kr
+#
+#==========================================================================
+
+
+import os
+import types
+import marshal
+import hashlib
+import importlib.util
+
+from consts import *
+from isa import *
+from components import *
+from program import *
+from dbt import *
+
+
+#--------------------------------------------------------------------------
+#   AOT: recompiles the loaded image into a cached Python module
+#--------------------------------------------------------------------------
+
+# The generated module has one function per basic block, b_<pc>(), with
+# the same calling convention as the blocks of the dbt engine, and a
+# dispatch table
+#
+#   blocks = { pc: (function, end address), ... }
+#
+# The module source and its compiled bytecode are written to AOT.CACHE_DIR
+# under a name derived from the hash of the ELF file, so later runs of the
+# same executable load the bytecode without decoding any instruction. The
+# hash also covers the sources of the code generator, so changing any of
+# them invalidates all cached modules. Nothing is written if caching is
+# off (see CACHE_ROOT in program.py).
+
+class AOT(object):
+
+    CACHE_DIR   = None if CACHE_ROOT is None else os.path.join(CACHE_ROOT, 'aot')
+    SOURCES     = [ 'aot.py', 'dbt.py', 'isa.py', 'consts.py' ]
+    sources     = None          # hash of SOURCES
+
+    @staticmethod
+    def digest():
+
+        if AOT.sources is None:
+            h = hashlib.sha256()
+            for name in AOT.SOURCES:
+                with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), name), 'rb') as f:
+                    h.update(f.read())
+            AOT.sources = h.digest()
+        return AOT.sources
+
+    @staticmethod
+    def key(cpu, filename):
+
+        h = hashlib.sha256(AOT.digest())
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+        # The generated code also depends on the memory map
+        h.update(("%x:%x:%x:%x" % (cpu.imem.mem_start, cpu.imem.mem_end,
+                                   cpu.dmem.mem_start, cpu.dmem.mem_end)).encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def successors(translator, pc, end):
+
+        fetched, status = translator.fetch(end - WORD_SIZE)
+        if fetched is None:
+            return [ ]                          # trap block
+        inst, opcode = fetched
+        if isa[opcode][IN_CLASS] != CL_CTRL:
+            return [ end ]                      # falls through
+        if opcode in [ EBREAK, ECALL ]:
+            return [ ]
+        if opcode == JAL:
+            # pc + 4 is where the callee returns to via jalr
+            return [ (end - WORD_SIZE + RISCV.imm_j(inst)) & WORD_MASK, end ]
+        if opcode == JALR:
+            return [ end ]
+        return [ (end - WORD_SIZE + RISCV.imm_b(inst)) & WORD_MASK, end ]
+
+    @staticmethod
+    def cfg(cpu, entry_point):
+        # returns { pc: (source lines, end address) } for every basic block
+        # reachable from entry_point without knowing jalr targets
+
+        translator = Translator(cpu)
+        blocks = { }
+        worklist = [ entry_point ]
+        while worklist:
+            pc = worklist.pop()
+            if pc in blocks:
+                continue
+            code, end = translator.translate(pc, "b_%08x" % pc)
+            blocks[pc] = (code, end)
+            worklist += AOT.successors(translator, pc, end)
+        return blocks
+
+    @staticmethod
+    def generate(filename, blocks):
+
+        src = [ "# Generated by snurisc --aot from %s -- do not edit" % os.path.basename(filename),
+                "",
+                "R = M = P = Stat = None",
+                "" ]
+        for pc in sorted(blocks):
+            src += blocks[pc][0] + [ "" ]
+        src.append("blocks = {")
+        for pc in sorted(blocks):
+            src.append("    0x%08x: (b_%08x, 0x%08x)," % (pc, pc, blocks[pc][1]))
+        src.append("}")
+        return '\n'.join(src) + '\n'
+
+    @staticmethod
+    def save(path, data):
+        # writes atomically so that concurrent runs never see a partial file
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(cpu, filename, entry_point):
+        # returns the recompiled module for the image loaded in cpu
+
+        name = "aot_%s" % AOT.key(cpu, filename)[:32]
+        path = os.path.join(AOT.CACHE_DIR or '', name)
+        code = None
+        if AOT.CACHE_DIR is not None:
+            try:
+                with open(path + '.bin', 'rb') as f:
+                    data = f.read()
+                if data[:4] == importlib.util.MAGIC_NUMBER:
+                    code = marshal.loads(data[4:])
+                    DiskCache.touch(path + '.bin')
+            except (OSError, ValueError, EOFError):
+                pass
+
+        if code is None:
+            src = AOT.generate(filename, AOT.cfg(cpu, int(entry_point)))
+            code = compile(src, path + '.py', 'exec')
+            src = src.encode()
+            data = importlib.util.MAGIC_NUMBER + marshal.dumps(code)
+            size = len(src) + len(data)
+            if AOT.CACHE_DIR is not None and size <= DiskCache.MAX_SIZE:
+                try:
+                    os.makedirs(AOT.CACHE_DIR, exist_ok = True)
+                    AOT.save(path + '.py', src)
+                    AOT.save(path + '.bin', data)
+                    DiskCache.saved(AOT.CACHE_DIR, path, size)
+                except OSError:
+                    pass                # run without caching
+
+        module = types.ModuleType(name)
+        exec(code, module.__dict__)
+        return module
+
+    @staticmethod
+    def run(cpu, module, step, limit = NO_LIMIT):
+        # step() is the interpreter (Sim.single_step) used for the pcs
+        # not found statically. Returns None with the next pc in cpu.pc
+        # once a block might take the instruction count past limit.
+
+        module.R        = cpu.regs.reg
+        module.M        = cpu.dmem.mem
+        module.P        = cpu.pc
+        module.Stat     = cpu.stat
+
+        table = { pc: fn for pc, (fn, end) in module.blocks.items() }
+        ends  = { pc: end for pc, (fn, end) in module.blocks.items() }
+
+        # Stores into imem make the affected blocks stale
+        hook = cpu.imem.write_hook
+        def invalidate(addr):
+            for pc in [ pc for pc in table if pc <= addr < ends[pc] ]:
+                del table[pc]
+            if hook:
+                hook(addr)
+        cpu.imem.write_hook = invalidate
+
+        stat = cpu.stat
+        limit -= Translator.MAX_BLOCK_INSTS
+        pc = cpu.pc.read()
+        Startup.mark("first instruction")
+        try:
+            while True:
+                if stat.icount > limit:
+                    cpu.pc.write(pc)
+                    return None
+                fn = table.get(pc)
+                if fn is not None:
+                    pc = fn()
+                    if pc < 0:
+                        return -pc
+                    continue
+
+                # Unknown target (e.g., of jalr): interpret a single instruction
+                cpu.pc.write(pc)
+                status = step()
+                stat.cycle      += 1
+                stat.icount     += 1
+                if not status == EXC_NONE:
+                    return status
+                pc = cpu.pc.read()
+        finally:
+            cpu.imem.write_hook = hook      # for the interpreter and later runs
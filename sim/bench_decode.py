@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Microbenchmark for the instruction decoder: compares RISCV.opcode()
+#   (table lookup) against RISCV.opcode_scan() (linear scan of isa).
+#
+#   Jin-Soo Kim
+#   Systems Software and Architecture Laboratory
+#   Seoul National University
+#   http://csl.snu.ac.kr
+#
+#==========================================================================
+
+import sys
+import random
+import timeit
+
+from consts import *
+from isa import *
+
+
+#--------------------------------------------------------------------------
+#   Test vectors
+#--------------------------------------------------------------------------
+
+def make_insts(n):
+
+    # Valid encodings with random don't-care bits, plus random words
+    # (mostly illegal) to exercise the ILLEGAL path as well
+    insts = [ ]
+    for k, v in isa.items():
+        for i in range(n // (2 * len(isa)) + 1):
+            insts.append(WORD(k | (random.getrandbits(32) & ~int(v[IN_MASK]))))
+    while len(insts) < n:
+        insts.append(WORD(random.getrandbits(32)))
+    random.shuffle(insts)
+    return insts
+
+
+def bench(name, func, insts, repeat):
+
+    t = min(timeit.repeat(lambda: [ func(i) for i in insts ], number = 1, repeat = repeat))
+    print("%-14s %8.1f ns/inst" % (name, t * 1e9 / len(insts)))
+    return t
+
+
+#--------------------------------------------------------------------------
+#   Benchmark main
+#--------------------------------------------------------------------------
+
+def main():
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random.seed(0)
+    insts = make_insts(n)
+
+    for inst in insts:
+        if RISCV.opcode(inst) is not RISCV.opcode_scan(inst):
+            print("Mismatch for inst=0x%08x" % inst)
+            sys.exit(1)
+
+    t_scan  = bench("opcode_scan()", RISCV.opcode_scan, insts, 3)
+    t_table = bench("opcode()", RISCV.opcode, insts, 3)
+    print("Speedup: %.1fx (%d instructions)" % (t_scan / t_table, len(insts)))
+
+
+if __name__ == '__main__':
+    main()
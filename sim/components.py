@@ -14,6 +14,8 @@
 #==========================================================================
 
 
+import copy
+
 from consts import *
 from isa import *
 
@@ -58,17 +60,39 @@ class RegisterFile(object):
         else:
             raise ValueError
 
-    def dump(self, columns = 4):
+    def dump(self, columns = 4, out = None, regnos = None):
+        # regnos: the registers to show, e.g., those changed (default: all)
 
-        print("Registers")
-        print("=" * 9)
-        for c in range (0, NUM_REGS, columns):
+        title = "Registers" if regnos is None else "Registers changed"
+        regnos = list(range(NUM_REGS)) if regnos is None else regnos
+        print(title, file = out)
+        print("=" * len(title), file = out)
+        for c in range (0, len(regnos), columns):
             str = ""
-            for r in range (c, min(NUM_REGS, c + columns)):
+            for r in regnos[c:c + columns]:
                 name = rname[r]
                 val = self.reg[r]
                 str += "%-11s0x%08x    " % ("%s ($%d):" % (name, r), val)
-            print(str)
+            print(str, file = out)
+
+
+#--------------------------------------------------------------------------
+#   IntRegisterFile: RegisterFile holding Python ints (ENGINE_INT)
+#--------------------------------------------------------------------------
+
+class IntRegisterFile(RegisterFile):
+
+    def __init__(self):
+        self.reg = [0] * NUM_REGS
+
+    def write(self, regno, value):
+
+        if regno == 0:
+            return
+        elif regno > 0 and regno < NUM_REGS:
+            self.reg[regno] = value & WORD_MASK
+        else:
+            raise ValueError
 
 
 #--------------------------------------------------------------------------
@@ -87,6 +111,19 @@ class Register(object):
         self.r = WORD(val)
 
 
+#--------------------------------------------------------------------------
+#   IntRegister: Register holding a Python int (ENGINE_INT)
+#--------------------------------------------------------------------------
+
+class IntRegister(Register):
+
+    def __init__(self, initval = 0):
+        self.r = initval & WORD_MASK
+
+    def write(self, val):
+        self.r = val & WORD_MASK
+
+
 #--------------------------------------------------------------------------
 #   Memory: models a memory
 #--------------------------------------------------------------------------
@@ -100,6 +137,7 @@ class Memory(object):
         self.mem_start  = mem_start
         self.mem_end    = mem_start + mem_size
         self.mem        = WORD([0] * self.mem_words)
+        self.write_hook = None      # called with the address of each store
 
     def access(self, valid, addr, data, fcn):
 
@@ -113,21 +151,402 @@ class Memory(object):
             res = ( val, True )
         elif fcn == M_XWR:
             self.mem[(addr - self.mem_start) // self.word_size] = WORD(data) 
+            if self.write_hook:
+                self.write_hook(addr)
             res = ( WORD(0), True )
         else:
             res = ( WORD(0), False )
         return res
 
-    def dump(self, skipzero = False):
+    def read_word(self, addr):
+        # fast path for word reads: returns None on an invalid address
 
-        print("Memory 0x%08x - 0x%08x" % (self.mem_start, self.mem_end - 1))
-        print("=" * 30)
-        for a in range(self.mem_start, self.mem_end, self.word_size):
-            val, status = self.access(True, a, 0, M_XRD)
-            if not status:
-                continue
-            if (not skipzero) or (val != 0):
-                print("0x%08x: " % a, ' '.join("%02x" % ((val >> i) & 0xff) for i in [0, 8, 16, 24]), " (0x%08x)" % val)
+        if (addr < self.mem_start) or (addr >= self.mem_end) or \
+            addr % self.word_size != 0:
+            return None
+        return self.mem[(addr - self.mem_start) // self.word_size]
 
+    def write_word(self, addr, data):
+        # fast path for word writes: returns False on an invalid address
 
+        if (addr < self.mem_start) or (addr >= self.mem_end) or \
+            addr % self.word_size != 0:
+            return False
+        self.mem[(addr - self.mem_start) // self.word_size] = WORD(data)
+        if self.write_hook:
+            self.write_hook(addr)
+        return True
+
+    def read(self, addr, mt):
+        # reads a byte, halfword, or word (zero- or sign-extended as per mt);
+        # returns None on an invalid or misaligned address
+
+        size = MT_SIZE.get(mt)
+        if size is None or addr % size != 0:
+            return None
+        offset = addr % self.word_size
+        word = self.read_word(addr - offset)
+        if word is None:
+            return None
+        val = (int(word) >> (offset * 8)) & ((1 << (size * 8)) - 1)
+        if mt in [ MT_B, MT_H ] and val >> (size * 8 - 1):
+            val = (val - (1 << (size * 8))) & WORD_MASK
+        return val
+
+    def write(self, addr, data, mt):
+        # writes the low-order byte, halfword, or word of data;
+        # returns False on an invalid or misaligned address
+
+        size = MT_SIZE.get(mt)
+        if size is None or addr % size != 0:
+            return False
+        offset = addr % self.word_size
+        word = self.read_word(addr - offset)
+        if word is None:
+            return False
+        mask = ((1 << (size * 8)) - 1) << (offset * 8)
+        word = (int(word) & ~mask) | ((int(data) << (offset * 8)) & mask)
+        return self.write_word(addr - offset, word)
+
+    def load(self, addr, image, size = None):
+        # copies the bytes of image to addr and zero-fills the rest up to
+        # size bytes, bypassing any access checks (used by the loader)
+
+        size    = len(image) if size is None else size
+        offset  = int(addr - self.mem_start)
+        data    = self.mem.view(np.uint8)
+        data[offset:offset + len(image)] = np.frombuffer(image, dtype = np.uint8)
+        data[offset + len(image):offset + size] = 0
+
+    def array(self):
+        # returns the contents as an array of WORDs (not a copy)
+        return self.mem
+
+    def fork(self):
+        # returns a copy for a forked machine (only PagedMemory shares the
+        # contents copy-on-write)
+
+        child = copy.copy(self)
+        child.mem           = self.mem.copy()
+        child.write_hook    = None
+        return child
+
+    def __getstate__(self):
+        # write_hook belongs to the run in progress
+        state = dict(self.__dict__)
+        state['write_hook'] = None
+        return state
+
+    def read_bytes(self, addr, size):
+        # returns size bytes from addr as an array of uint8 (not a copy
+        # unless paged), bypassing any access checks
+        offset = int(addr - self.mem_start)
+        return self.array().view(np.uint8)[offset:offset + size]
+
+    # Hex digits, and a line of dump() as a template for format()
+    HEX         = np.frombuffer(b'0123456789abcdef', dtype = np.uint8)
+    LINE        = np.frombuffer(b'0x00000000:  00 00 00 00  (0x00000000)\n', dtype = np.uint8)
+
+    @staticmethod
+    def format(addrs, vals):
+        # returns the lines of dump() for the words vals at addrs; the hex
+        # digits are filled into a copy of LINE per word with NumPy
+
+        addrs   = np.asarray(addrs, dtype = np.uint32)
+        vals    = np.asarray(vals, dtype = np.uint32)
+        lines   = np.tile(Memory.LINE, (len(vals), 1))
+        for k in range(8):
+            lines[:, 2 + k]     = Memory.HEX[(addrs >> (28 - 4 * k)) & 0xf]
+            lines[:, 29 + k]    = Memory.HEX[(vals >> (28 - 4 * k)) & 0xf]
+        for k in range(4):
+            lines[:, 13 + 3 * k] = Memory.HEX[(vals >> (8 * k + 4)) & 0xf]
+            lines[:, 14 + 3 * k] = Memory.HEX[(vals >> (8 * k)) & 0xf]
+        return lines.tobytes().decode()
+
+    def dump(self, skipzero = False, out = None):
+
+        print("Memory 0x%08x - 0x%08x" % (self.mem_start, self.mem_end - 1), file = out)
+        print("=" * 30, file = out)
+        words = self.array()
+        index = np.flatnonzero(words) if skipzero else np.arange(len(words))
+        print(Memory.format(int(self.mem_start) + index * self.word_size, words[index]),
+              end = '', file = out)
+
+    def dump_words(self, addrs, out = None):
+        # shows the words at addrs, e.g., those stored to since the last dump
+
+        print("Memory written", file = out)
+        print("=" * 14, file = out)
+        print(Memory.format(addrs, [ self.read_word(a) for a in addrs ]), end = '', file = out)
 
+
+#--------------------------------------------------------------------------
+#   ByteMemory: Memory on a bytearray (ENGINE_INT, ENGINE_DBT)
+#--------------------------------------------------------------------------
+
+# The memory contents are kept as little-endian bytes in a bytearray, so
+# that a whole image can be loaded or exported without copying. self.mem
+# is a view of the same buffer as 32-bit words, indexed just like
+# Memory.mem (on a little-endian host, as is RISC-V). Word accesses go
+# through self.mem; byte and halfword accesses go through self.data.
+
+class ByteMemory(Memory):
+
+    def __init__(self, mem_start, mem_size, word_size):
+
+        self.word_size  = word_size
+        self.mem_words  = int(mem_size) // word_size
+        self.mem_start  = int(mem_start)
+        self.mem_end    = self.mem_start + int(mem_size)
+        self.mem_size   = int(mem_size)
+        self.data       = bytearray(self.mem_size)
+        self.view       = memoryview(self.data)
+        self.mem        = self.view.cast('I')
+        self.write_hook = None      # called with the address of each store
+
+    def access(self, valid, addr, data, fcn, mt = MT_W):
+
+        if (not valid):
+            return ( 0, True )
+        elif fcn == M_XRD:
+            val = self.read_word(addr) if mt == MT_W else self.read(addr, mt)
+            return ( 0, False ) if val is None else ( val, True )
+        elif fcn == M_XWR:
+            ok = self.write_word(addr, data) if mt == MT_W else self.write(addr, data, mt)
+            return ( 0, ok )
+        else:
+            return ( 0, False )
+
+    def read_word(self, addr):
+
+        offset = addr - self.mem_start
+        if 0 <= offset < self.mem_size and not offset & 3:
+            return self.mem[offset >> 2]
+        return None
+
+    def write_word(self, addr, data):
+
+        offset = addr - self.mem_start
+        if 0 <= offset < self.mem_size and not offset & 3:
+            self.mem[offset >> 2] = data & WORD_MASK
+            if self.write_hook:
+                self.write_hook(addr)
+            return True
+        return False
+
+    def read(self, addr, mt):
+
+        size = MT_SIZE.get(mt)
+        offset = addr - self.mem_start
+        if size is None or not 0 <= offset <= self.mem_size - size or offset % size:
+            return None
+        val = int.from_bytes(self.view[offset:offset + size], 'little')
+        if mt in [ MT_B, MT_H ] and val >> (size * 8 - 1):
+            val = (val - (1 << (size * 8))) & WORD_MASK
+        return val
+
+    def write(self, addr, data, mt):
+
+        size = MT_SIZE.get(mt)
+        offset = addr - self.mem_start
+        if size is None or not 0 <= offset <= self.mem_size - size or offset % size:
+            return False
+        self.view[offset:offset + size] = (int(data) & ((1 << (size * 8)) - 1)).to_bytes(size, 'little')
+        if self.write_hook:
+            self.write_hook(addr)
+        return True
+
+    def load(self, addr, image, size = None):
+
+        size    = len(image) if size is None else size
+        offset  = addr - self.mem_start
+        self.view[offset:offset + len(image)] = image
+        self.view[offset + len(image):offset + size] = bytes(size - len(image))
+
+    def array(self):
+        return np.frombuffer(self.data, dtype = WORD)
+
+    def fork(self):
+
+        child = copy.copy(self)
+        child.data          = bytearray(self.data)
+        child.view          = memoryview(child.data)
+        child.mem           = child.view.cast('I')
+        child.write_hook    = None
+        return child
+
+    def __getstate__(self):
+        # memoryviews cannot be pickled
+        state = Memory.__getstate__(self)
+        del state['view'], state['mem']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.view       = memoryview(self.data)
+        self.mem        = self.view.cast('I')
+
+
+#--------------------------------------------------------------------------
+#   PagedMemory: sparse memory allocated page by page on first write
+#--------------------------------------------------------------------------
+
+# A PagedMemory consists of one or more regions, each with its own
+# permissions ('r' and/or 'w'), and may cover the whole 32-bit address
+# space. Each 4KB page is allocated when it is first written to; reading
+# an untouched page returns zeros. Hence memory usage and startup time
+# depend on the pages actually touched rather than on the region sizes.
+# With dtype = WORD (for ENGINE_NUMPY), words are read as NumPy scalars
+# from an ndarray view of each page instead of as Python ints.
+#
+# fork() shares all the pages with the copy returned, and each of the two
+# copies a shared page when it first writes to it, as fork() in Unix.
+# Only the pages in writable can be written in place.
+
+class PagedMemory(Memory):
+
+    PAGE_SHIFT      = 12
+    PAGE_SIZE       = 1 << PAGE_SHIFT
+    PAGE_MASK       = PAGE_SIZE - 1
+
+    def __init__(self, regions, word_size, dtype = None):
+        # regions: list of (start, size, permissions)
+
+        self.word_size  = word_size
+        self.dtype      = dtype
+        self.zero       = 0 if dtype is None else dtype(0)
+        self.regions    = [ (int(start), int(start) + int(size), perm) for start, size, perm in regions ]
+        self.mem_start  = min(start for start, end, perm in self.regions)
+        self.mem_end    = max(end for start, end, perm in self.regions)
+        self.mem_words  = (self.mem_end - self.mem_start) // word_size
+        self.pages      = { }       # page number -> bytearray
+        self.words      = { }       # page number -> 32-bit word view of the page
+        self.writable   = { }       # pages not shared with a fork, as in words
+        self.write_hook = None      # called with the address of each store
+
+    def allowed(self, addr, perm):
+
+        for start, end, p in self.regions:
+            if start <= addr < end:
+                return perm in p
+        return False
+
+    def page(self, pn):
+        # returns the word view of page pn to write to, allocating it or
+        # copying it from a shared page if necessary
+
+        words = self.writable.get(pn)
+        if words is None:
+            shared = self.pages.get(pn)
+            page = self.pages[pn] = bytearray(self.PAGE_SIZE) if shared is None else bytearray(shared)
+            words = self.words[pn] = self.writable[pn] = self.view(page)
+        return words
+
+    def view(self, page):
+        return memoryview(page).cast('I') if self.dtype is None else \
+               np.frombuffer(page, dtype = self.dtype)
+
+    def fork(self):
+        # returns a copy sharing all the pages; costs a dict copy rather
+        # than a copy of the pages
+
+        child = copy.copy(self)
+        child.pages         = dict(self.pages)
+        child.words         = dict(self.words)
+        child.writable      = { }
+        child.write_hook    = None
+        self.writable       = { }
+        return child
+
+    def __getstate__(self):
+        # the pages only; the views are made again on unpickling
+        state = Memory.__getstate__(self)
+        del state['words'], state['writable']
+        return state
+
+    def __setstate__(self, state):
+        # Pages pickled together with a fork of this memory may still be
+        # shared, so none of them is writable in place
+        self.__dict__.update(state)
+        self.words      = { pn: self.view(page) for pn, page in self.pages.items() }
+        self.writable   = { }
+
+    def access(self, valid, addr, data, fcn, mt = MT_W):
+
+        if (not valid):
+            return ( self.zero, True )
+        elif fcn == M_XRD:
+            val = self.read_word(addr) if mt == MT_W else self.read(addr, mt)
+            return ( self.zero, False ) if val is None else ( val, True )
+        elif fcn == M_XWR:
+            ok = self.write_word(addr, data) if mt == MT_W else self.write(addr, data, mt)
+            return ( self.zero, ok )
+        else:
+            return ( self.zero, False )
+
+    def read_word(self, addr):
+
+        if addr & 3 or not self.allowed(addr, 'r'):
+            return None
+        words = self.words.get(addr >> self.PAGE_SHIFT)
+        return self.zero if words is None else words[(addr & self.PAGE_MASK) >> 2]
+
+    def write_word(self, addr, data):
+
+        if addr & 3 or not self.allowed(addr, 'w'):
+            return False
+        self.page(addr >> self.PAGE_SHIFT)[(addr & self.PAGE_MASK) >> 2] = data & WORD_MASK
+        if self.write_hook:
+            self.write_hook(addr)
+        return True
+
+    def load(self, addr, image, size = None):
+        # zero-filling leaves untouched pages unallocated
+
+        size    = len(image) if size is None else size
+        image   = memoryview(image)
+        end     = addr + size
+        while addr < end:
+            pn      = addr >> self.PAGE_SHIFT
+            offset  = addr & self.PAGE_MASK
+            n       = min(end - addr, self.PAGE_SIZE - offset)
+            chunk, image = image[:n], image[n:]
+            if len(chunk) or pn in self.pages:
+                self.page(pn)
+                page = self.pages[pn]
+                page[offset:offset + len(chunk)] = chunk
+                page[offset + len(chunk):offset + n] = bytes(n - len(chunk))
+            addr += n
+
+    def read_bytes(self, addr, size):
+        # returns a copy with the untouched pages filled with zeros
+
+        addr    = int(addr)
+        data    = np.zeros(size, dtype = np.uint8)
+        for pn in range(addr >> self.PAGE_SHIFT, (addr + size + self.PAGE_MASK) >> self.PAGE_SHIFT):
+            page = self.pages.get(pn)
+            if page is None:
+                continue
+            start   = max(pn << self.PAGE_SHIFT, addr)
+            end     = min((pn + 1) << self.PAGE_SHIFT, addr + size)
+            base    = pn << self.PAGE_SHIFT
+            data[start - addr:end - addr] = \
+                np.frombuffer(page, dtype = np.uint8)[start - base:end - base]
+        return data
+
+    def array(self):
+        # returns a copy with the untouched pages filled with zeros
+        return self.read_bytes(self.mem_start, self.mem_words * WORD_SIZE).view(WORD)
+
+    def dump(self, skipzero = False, out = None):
+        # shows the allocated pages only
+
+        print("Memory 0x%08x - 0x%08x" % (self.mem_start, self.mem_end - 1), file = out)
+        print("=" * 30, file = out)
+        for pn in sorted(self.pages):
+            words   = np.frombuffer(self.pages[pn], dtype = WORD)
+            addrs   = (pn << self.PAGE_SHIFT) + np.arange(len(words), dtype = np.int64) * WORD_SIZE
+            keep    = (addrs >= self.mem_start) & (addrs < self.mem_end)
+            if skipzero:
+                keep &= words != 0
+            print(Memory.format(addrs[keep], words[keep]), end = '', file = out)
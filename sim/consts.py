@@ -24,6 +24,24 @@ import numpy as np
 WORD                = np.uint32
 SWORD               = np.int32
 
+# Plain Python int versions used by the native-int engine (ENGINE_INT)
+WORD_MASK           = 0xffffffff
+
+def sword(v):
+    return ((v & WORD_MASK) ^ 0x80000000) - 0x80000000
+
+
+
+#--------------------------------------------------------------------------
+#   Execution engines
+#--------------------------------------------------------------------------
+
+ENGINE_NUMPY        = 'numpy'   # architectural state held in WORD/SWORD scalars
+ENGINE_INT          = 'int'     # architectural state held in Python ints
+ENGINE_DBT          = 'dbt'     # ENGINE_INT + basic-block translation (sim only)
+ENGINE_NUMBA        = 'numba'   # ENGINE_NUMPY + Numba-compiled loop (sim only)
+
+NO_LIMIT            = 1 << 63   # instruction/cycle budget meaning no limit
 
 #--------------------------------------------------------------------------
 #   RISC-V constants
@@ -151,6 +169,9 @@ MT_BU               = 5
 MT_HU               = 6
 MT_WU               = 7
 
+# Access sizes in bytes (MT_D is not supported on RV32)
+MT_SIZE             = { MT_B: 1, MT_H: 2, MT_W: 4, MT_BU: 1, MT_HU: 2, MT_WU: 4 }
+
 
 #--------------------------------------------------------------------------
 #   Exceptions
@@ -168,3 +189,15 @@ EXC_MSG = {         EXC_IMEM_ERROR:     "imem access error",
                     EXC_EBREAK:         "ebreak",
 }
 
+
+
+#--------------------------------------------------------------------------
+#   Trace record flags (tracefile.py)
+#--------------------------------------------------------------------------
+
+TR_RD               = 0x01      # rd written with wbdata
+TR_LOAD             = 0x02      # addr, data: load address and the loaded word
+TR_STORE            = 0x04      # addr, data: store address and the stored word
+TR_CTRL             = 0x08      # addr: next pc of a control transfer instruction
+TR_TAKEN            = 0x10      # the branch (or jump) was taken
+TR_EXC              = 0x20      # the instruction raised an exception
@@ -0,0 +1,247 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Classes for basic-block dynamic binary translation (the 'dbt' engine).
+#
+#   Jin-Soo Kim
+#   Systems Software and Architecture Laboratory
+#   Seoul National University
+#   http://csl.snu.ac.kr
+#
+#==========================================================================
+
+
+from consts import *
+from isa import *
+from components import *
+from program import *
+
+
+#--------------------------------------------------------------------------
+#   Block: a translated basic block
+#--------------------------------------------------------------------------
+
+class Block(object):
+
+    def __init__(self, pc, end, fn):
+        self.pc         = pc        # entry pc
+        self.end        = end       # address right after the last instruction
+        self.fn         = fn        # returns the next pc, or -status on exit
+        self.links      = { }       # next pc -> successor block (chaining)
+        self.valid      = True
+
+
+#--------------------------------------------------------------------------
+#   Translator: generates Python source code for basic blocks
+#--------------------------------------------------------------------------
+
+# Within a generated block, R is the register file (a list of ints), M is
+# the dmem word list, and P is the pc register. A block returns the pc of
+# its successor, or -status after leaving the faulting (or ebreak) pc in P.
+
+class Translator(object):
+
+    MAX_BLOCK_INSTS = 64
+
+    def __init__(self, cpu):
+        self.imem       = cpu.imem
+        self.dmem_start = cpu.dmem.mem_start
+        self.dmem_end   = cpu.dmem.mem_end
+
+    @staticmethod
+    def stats(counts, indent):
+        # counts: [ cycle/icount, inst_alu, inst_mem, inst_ctrl ]
+        code = [ "Stat.cycle += %d" % counts[0], "Stat.icount += %d" % counts[0] ]
+        for name, n in zip([ 'inst_alu', 'inst_mem', 'inst_ctrl' ], counts[1:]):
+            if n:
+                code.append("Stat.%s += %d" % (name, n))
+        return [ indent + c for c in code ]
+
+    def fetch(self, pc):
+        # returns ((inst, opcode), EXC_NONE), or (None, status) on failure
+        inst = self.imem.read_word(pc)
+        if inst is None:
+            return None, EXC_IMEM_ERROR
+        opcode = RISCV.opcode(inst)
+        if opcode == ILLEGAL:
+            return None, EXC_ILLEGAL_INST
+        return (inst, opcode), EXC_NONE
+
+    def trap(self, pc, status, name):
+        # block for a pc which cannot be fetched or decoded
+        return [ "def %s():" % name ] + self.stats([ 1, 0, 0, 0 ], "    ") + \
+               [ "    P.r = 0x%08x" % pc, "    return -%d" % status ]
+
+    def translate(self, pc, name = 'block'):
+        # returns (source lines of function name(), end address)
+
+        fetched, status = self.fetch(pc)
+        if fetched is None:
+            return self.trap(pc, status, name), pc + WORD_SIZE
+
+        code = [ "def %s():" % name ]
+        counts = [ 0, 0, 0, 0 ]
+        addr = pc
+        while True:
+            inst, opcode = fetched
+            cs = isa[opcode]
+            counts[0] += 1
+            counts[1 + cs[IN_CLASS]] += 1
+            if cs[IN_CLASS] == CL_CTRL:
+                code += self.ctrl(addr, inst, opcode, counts)
+                return code, addr + WORD_SIZE
+            elif cs[IN_CLASS] == CL_MEM:
+                code += self.mem(addr, inst, cs, counts)
+            else:
+                code += self.alu(addr, inst, cs)
+
+            addr += WORD_SIZE
+            if counts[0] >= self.MAX_BLOCK_INSTS:
+                break
+            fetched, status = self.fetch(addr)
+            if fetched is None:
+                break
+
+        # Fall through to the next block
+        return code + self.stats(counts, "    ") + [ "    return 0x%08x" % addr ], addr
+
+    def alu(self, pc, inst, cs):
+
+        rd      = int(RISCV.rd(inst))
+        if rd == 0:
+            return [ ]
+        a       = "R[%d]" % RISCV.rs1(inst)     if cs[IN_ALU1] == OP1_RS1  else \
+                  "0x%08x" % pc                 if cs[IN_ALU1] == OP1_PC   else \
+                  "0"
+        b       = "R[%d]" % RISCV.rs2(inst)     if cs[IN_ALU2] == OP2_RS2  else \
+                  "0x%08x" % RISCV.imm_i(inst)  if cs[IN_ALU2] == OP2_IMI  else \
+                  "0x%08x" % RISCV.imm_u(inst)
+        expr    = "(%s + %s) & 0xffffffff" % (a, b)     if cs[IN_OP] == ALU_ADD   else \
+                  "(%s - %s) & 0xffffffff" % (a, b)     if cs[IN_OP] == ALU_SUB   else \
+                  "%s & %s" % (a, b)                    if cs[IN_OP] == ALU_AND   else \
+                  "%s | %s" % (a, b)                    if cs[IN_OP] == ALU_OR    else \
+                  "%s ^ %s" % (a, b)                    if cs[IN_OP] == ALU_XOR   else \
+                  "1 if (%s ^ 0x80000000) < (%s ^ 0x80000000) else 0" % (a, b)  \
+                                                        if cs[IN_OP] == ALU_SLT   else \
+                  "1 if %s < %s else 0" % (a, b)        if cs[IN_OP] == ALU_SLTU  else \
+                  "(%s << (%s & 0x1f)) & 0xffffffff" % (a, b)                   \
+                                                        if cs[IN_OP] == ALU_SLL   else \
+                  "(((%s ^ 0x80000000) - 0x80000000) >> (%s & 0x1f)) & 0xffffffff" % (a, b) \
+                                                        if cs[IN_OP] == ALU_SRA   else \
+                  "%s >> (%s & 0x1f)" % (a, b)          if cs[IN_OP] == ALU_SRL   else \
+                  "0"
+        return [ "    R[%d] = %s" % (rd, expr) ]
+
+    def mem(self, pc, inst, cs, counts):
+
+        rs1     = int(RISCV.rs1(inst))
+        if cs[IN_OP] == MEM_LD:
+            imm = sword(RISCV.imm_i(inst))
+        else:
+            imm = sword(RISCV.imm_s(inst))
+
+        code = [ "    a = R[%d] + %d" % (rs1, imm),
+                 "    if a < 0x%08x or a >= 0x%08x or a & 3:" % (self.dmem_start, self.dmem_end) ]
+        code += self.stats(counts, "        ")
+        code += [ "        P.r = 0x%08x" % pc,
+                  "        return -%d" % EXC_DMEM_ERROR ]
+
+        if cs[IN_OP] == MEM_LD:
+            rd = int(RISCV.rd(inst))
+            if rd:
+                code.append("    R[%d] = M[(a - 0x%08x) >> 2]" % (rd, self.dmem_start))
+        else:
+            rs2 = int(RISCV.rs2(inst))
+            code.append("    M[(a - 0x%08x) >> 2] = R[%d]" % (self.dmem_start, rs2))
+        return code
+
+    def ctrl(self, pc, inst, opcode, counts):
+
+        code = self.stats(counts, "    ")
+        if opcode in [ EBREAK, ECALL ]:
+            return code + [ "    P.r = 0x%08x" % pc, "    return -%d" % EXC_EBREAK ]
+
+        rs1     = int(RISCV.rs1(inst))
+        rs2     = int(RISCV.rs2(inst))
+        rd      = int(RISCV.rd(inst))
+        pc_plus4 = (pc + 4) & WORD_MASK
+        link    = [ "    R[%d] = 0x%08x" % (rd, pc_plus4) ] if rd else [ ]
+
+        if opcode == JAL:
+            target = (pc + RISCV.imm_j(inst)) & WORD_MASK
+            return code + link + [ "    return 0x%08x" % target ]
+        elif opcode == JALR:
+            imm = RISCV.imm_i(inst)
+            return code + [ "    t = (R[%d] + 0x%08x) & 0xfffffffe" % (rs1, imm) ] + \
+                   link + [ "    return t" ]
+
+        a, b = "R[%d]" % rs1, "R[%d]" % rs2
+        cond    = "%s == %s" % (a, b)                   if opcode == BEQ    else \
+                  "%s != %s" % (a, b)                   if opcode == BNE    else \
+                  "(%s ^ 0x80000000) < (%s ^ 0x80000000)" % (a, b)          \
+                                                        if opcode == BLT    else \
+                  "(%s ^ 0x80000000) >= (%s ^ 0x80000000)" % (a, b)         \
+                                                        if opcode == BGE    else \
+                  "%s < %s" % (a, b)                    if opcode == BLTU   else \
+                  "%s >= %s" % (a, b)
+        target = (pc + RISCV.imm_b(inst)) & WORD_MASK
+        return code + [ "    if %s:" % cond,
+                        "        return 0x%08x" % target,
+                        "    return 0x%08x" % pc_plus4 ]
+
+
+#--------------------------------------------------------------------------
+#   DBT: runs the program by executing translated basic blocks
+#--------------------------------------------------------------------------
+
+class DBT(object):
+
+    def __init__(self, cpu):
+
+        self.cpu        = cpu
+        self.translator = Translator(cpu)
+        self.blocks     = { }
+        self.env        = { 'R': cpu.regs.reg, 'M': cpu.dmem.mem, 'P': cpu.pc, 'Stat': cpu.stat }
+
+        # Stores into imem invalidate the translated blocks
+        cpu.imem.write_hook = self.invalidate
+
+    def run(self, limit = NO_LIMIT):
+        # returns None with the next pc in cpu.pc once a block might take
+        # the instruction count past limit
+
+        stat = self.cpu.stat
+        limit -= Translator.MAX_BLOCK_INSTS
+        blk = self.lookup(self.cpu.pc.read())
+        Startup.mark("first instruction")
+        while stat.icount <= limit:
+            pc = blk.fn()
+            if pc < 0:
+                return -pc
+            nxt = blk.links.get(pc)
+            if nxt is None or not nxt.valid:
+                nxt = self.lookup(pc)
+                blk.links[pc] = nxt
+            blk = nxt
+        self.cpu.pc.write(blk.pc)
+        return None
+
+    def lookup(self, pc):
+
+        blk = self.blocks.get(pc)
+        if blk is None:
+            code, end = self.translator.translate(pc)
+            exec(compile('\n'.join(code), '<block 0x%08x>' % pc, 'exec'), self.env)
+            blk = Block(pc, end, self.env['block'])
+            self.blocks[pc] = blk
+        return blk
+
+    def invalidate(self, addr):
+
+        for blk in list(self.blocks.values()):
+            if blk.pc <= addr < blk.end:
+                blk.valid = False
+                del self.blocks[blk.pc]
@@ -154,6 +154,37 @@ isa         = {
 }
 
 
+#--------------------------------------------------------------------------
+#   Decode table: isa table entries grouped by opcode and funct3
+#--------------------------------------------------------------------------
+
+# Every instruction mask covers the opcode field and either all or none of 
+# the funct3 field. decode_table[funct3 << 7 | opcode] holds the list of 
+# (mask, { encoding: isa key }) groups that can match such instructions, 
+# so that RISCV.opcode() needs a single dictionary lookup per group instead 
+# of scanning the whole isa table. All the entries in a bucket share the 
+# same mask for RV32I, hence there is only one group per bucket.
+
+def build_decode_table():
+
+    table = [ [] for i in range(1 << 10) ]
+    for k, v in isa.items():
+        mask = int(v[IN_MASK])
+        for funct3 in range(8):
+            if (mask & FUNCT3_MASK) and ((k & FUNCT3_MASK) >> FUNCT3_SHIFT) != funct3:
+                continue
+            groups = table[(funct3 << 7) | int(k & OP_MASK)]
+            for m, keys in groups:
+                if m == mask:
+                    keys[int(k)] = k
+                    break
+            else:
+                groups.append((mask, { int(k): k }))
+    return table
+
+decode_table = build_decode_table()
+
+
 #--------------------------------------------------------------------------
 #   RISCV: decodes RISC-V instructions
 #--------------------------------------------------------------------------
@@ -167,6 +198,16 @@ class RISCV(object):
 
     @staticmethod
     def opcode(inst):
+        inst = int(inst)
+        for mask, keys in decode_table[((inst >> 5) & 0x380) | (inst & 0x7f)]:
+            k = keys.get(inst & mask)
+            if k is not None:
+                return k
+        return ILLEGAL
+
+    # Reference decoder: scans the whole isa table (see bench_decode.py)
+    @staticmethod
+    def opcode_scan(inst):
         for k, v in isa.items():
             if not (inst & v[IN_MASK]) ^ k:
                 return k
@@ -178,15 +219,15 @@ class RISCV(object):
 
     @staticmethod
     def rs1(inst):
-        return (inst & RS1_MASK) >> RS1_SHIFT
+        return (inst >> RS1_SHIFT) & 0x1f
 
     @staticmethod
     def rs2(inst):
-        return (inst & RS2_MASK) >> RS2_SHIFT
+        return (inst >> RS2_SHIFT) & 0x1f
 
     @staticmethod
     def rd(inst):
-        return (inst & RD_MASK) >> RD_SHIFT
+        return (inst >> RD_SHIFT) & 0x1f
 
     @staticmethod
     def sign_extend(v, n):
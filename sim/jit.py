@@ -0,0 +1,270 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Numba-compiled simulation loop (the 'numba' engine).
+#
+#   Jin-Soo Kim
+#   Systems Software and Architecture Laboratory
+#   Seoul National University
+#   http://csl.snu.ac.kr
+#
+#==========================================================================
+
+
+from consts import *
+from isa import *
+from components import *
+from program import *
+
+
+#--------------------------------------------------------------------------
+#   Constants
+#--------------------------------------------------------------------------
+
+# Control transfer kinds in the decoded-op tables
+CT_BRK              = 0         # ebreak, ecall
+CT_JAL              = 1
+CT_JALR             = 2
+CT_BEQ              = 3
+CT_BNE              = 4
+CT_BLT              = 5
+CT_BGE              = 6
+CT_BLTU             = 7
+CT_BGEU             = 8
+
+UNDECODED           = -2        # ids[] entry not decoded yet (-1: illegal)
+
+
+#--------------------------------------------------------------------------
+#   Simulation kernel (compiled with numba.njit)
+#--------------------------------------------------------------------------
+
+# Runs at most budget instructions starting from pc on the flat uint32
+# arrays of the register file and memories. Stops on ebreak/ecall, on an
+# exception, or when the budget runs out, leaving the pc of the stopping
+# instruction (or the next pc) in the return value. stats[] accumulates
+# [ icount, inst_alu, inst_mem, inst_ctrl ].
+
+def kernel(regs, imem, imem_start, dmem, dmem_start, pc, budget, ids,
+           starts, ends, e_mask, e_match, e_id, cls, op, op1, op2, stats):
+
+    imem_bytes  = imem.shape[0] * WORD_SIZE
+    dmem_bytes  = dmem.shape[0] * WORD_SIZE
+    status      = EXC_NONE
+    n           = 0
+
+    while n < budget:
+        n += 1
+
+        # Instruction fetch
+        off = pc - imem_start
+        if off < 0 or off >= imem_bytes or (pc & 3) != 0:
+            status = EXC_IMEM_ERROR
+            break
+        idx = off >> 2
+        inst = np.int64(imem[idx])
+
+        # Instruction decode (cached per imem word)
+        k = ids[idx]
+        if k == UNDECODED:
+            k = -1
+            b = ((inst >> 5) & 0x380) | (inst & 0x7f)
+            for e in range(starts[b], ends[b]):
+                if (inst & e_mask[e]) == e_match[e]:
+                    k = e_id[e]
+                    break
+            ids[idx] = k
+        if k < 0:
+            status = EXC_ILLEGAL_INST
+            break
+
+        rd  = (inst >> 7) & 0x1f
+        rs1 = (inst >> 15) & 0x1f
+        rs2 = (inst >> 20) & 0x1f
+        imm_i = inst >> 20
+        if imm_i & 0x800:
+            imm_i |= 0xfffff000
+
+        if cls[k] == CL_ALU:
+            stats[1] += 1
+            s1 = op1[k]
+            s2 = op2[k]
+            a = np.int64(regs[rs1]) if s1 == OP1_RS1 else pc if s1 == OP1_PC else 0
+            b = np.int64(regs[rs2]) if s2 == OP2_RS2 else imm_i if s2 == OP2_IMI else \
+                inst & 0xfffff000
+            o = op[k]
+            if o == ALU_ADD:
+                r = (a + b) & WORD_MASK
+            elif o == ALU_SUB:
+                r = (a - b) & WORD_MASK
+            elif o == ALU_AND:
+                r = a & b
+            elif o == ALU_OR:
+                r = a | b
+            elif o == ALU_XOR:
+                r = a ^ b
+            elif o == ALU_SLT:
+                r = 1 if (a ^ 0x80000000) < (b ^ 0x80000000) else 0
+            elif o == ALU_SLTU:
+                r = 1 if a < b else 0
+            elif o == ALU_SLL:
+                r = (a << (b & 0x1f)) & WORD_MASK
+            elif o == ALU_SRA:
+                r = (((a ^ 0x80000000) - 0x80000000) >> (b & 0x1f)) & WORD_MASK
+            elif o == ALU_SRL:
+                r = a >> (b & 0x1f)
+            else:
+                r = 0
+            if rd != 0:
+                regs[rd] = r
+            pc = (pc + 4) & WORD_MASK
+
+        elif cls[k] == CL_MEM:
+            stats[2] += 1
+            if op[k] == MEM_LD:
+                imm = inst >> 20
+            else:
+                imm = ((inst >> 20) & 0xfe0) | ((inst >> 7) & 0x1f)
+            if imm & 0x800:
+                imm -= 0x1000
+            addr = np.int64(regs[rs1]) + imm
+            doff = addr - dmem_start
+            if doff < 0 or doff >= dmem_bytes or (addr & 3) != 0:
+                status = EXC_DMEM_ERROR
+                break
+            if op[k] == MEM_LD:
+                if rd != 0:
+                    regs[rd] = dmem[doff >> 2]
+            else:
+                dmem[doff >> 2] = regs[rs2]
+            pc = (pc + 4) & WORD_MASK
+
+        else:
+            stats[3] += 1
+            o = op[k]
+            if o == CT_BRK:
+                status = EXC_EBREAK
+                break
+            pc_plus4 = (pc + 4) & WORD_MASK
+            if o == CT_JAL:
+                imm = (((inst >> 31) & 1) << 20) | (((inst >> 12) & 0xff) << 12) | \
+                      (((inst >> 20) & 1) << 11) | (((inst >> 21) & 0x3ff) << 1)
+                pc_next = (pc + imm + (0xffe00000 if imm & 0x100000 else 0)) & WORD_MASK
+            elif o == CT_JALR:
+                pc_next = (np.int64(regs[rs1]) + imm_i) & 0xfffffffe
+            else:
+                a = np.int64(regs[rs1])
+                b = np.int64(regs[rs2])
+                if o == CT_BEQ:
+                    taken = a == b
+                elif o == CT_BNE:
+                    taken = a != b
+                elif o == CT_BLT:
+                    taken = (a ^ 0x80000000) < (b ^ 0x80000000)
+                elif o == CT_BGE:
+                    taken = (a ^ 0x80000000) >= (b ^ 0x80000000)
+                elif o == CT_BLTU:
+                    taken = a < b
+                else:
+                    taken = a >= b
+                if taken:
+                    imm = (((inst >> 31) & 1) << 12) | (((inst >> 7) & 1) << 11) | \
+                          (((inst >> 25) & 0x3f) << 5) | (((inst >> 8) & 0xf) << 1)
+                    pc_next = (pc + imm + (0xffffe000 if imm & 0x1000 else 0)) & WORD_MASK
+                else:
+                    pc_next = pc_plus4
+            if o == CT_JAL or o == CT_JALR:
+                if rd != 0:
+                    regs[rd] = pc_plus4
+            pc = pc_next
+
+    stats[0] += n
+    return status, pc
+
+
+#--------------------------------------------------------------------------
+#   JIT: runs the program with the compiled kernel
+#--------------------------------------------------------------------------
+
+class JIT(object):
+
+    BUDGET      = 1 << 24       # instructions per kernel call
+    compiled    = None          # njit-compiled kernel, False if unavailable
+
+    ctrl_kinds  = {
+        EBREAK  : CT_BRK,   ECALL   : CT_BRK,   JAL     : CT_JAL,   JALR    : CT_JALR,
+        BEQ     : CT_BEQ,   BNE     : CT_BNE,   BLT     : CT_BLT,   BGE     : CT_BGE,
+        BLTU    : CT_BLTU,  BGEU    : CT_BGEU,
+    }
+
+    @staticmethod
+    def kernel():
+        # returns the compiled kernel, or None if numba is not installed
+
+        if JIT.compiled is None:
+            try:
+                from numba import njit
+                # A cached kernel refers to this module by name, so it is
+                # not cached when this module is loaded by pyrisc.run()
+                JIT.compiled = njit(cache = __name__ == 'jit')(kernel)
+            except ImportError:
+                JIT.compiled = False
+        return JIT.compiled or None
+
+    @staticmethod
+    def tables():
+        # flattens decode_table and isa into arrays the kernel can use
+
+        keys = list(isa.keys())
+        starts, ends = [ ], [ ]
+        e_mask, e_match, e_id = [ ], [ ], [ ]
+        for groups in decode_table:
+            starts.append(len(e_id))
+            for mask, encodings in groups:
+                for enc, key in encodings.items():
+                    e_mask.append(mask)
+                    e_match.append(enc)
+                    e_id.append(keys.index(key))
+            ends.append(len(e_id))
+
+        cls = [ isa[k][IN_CLASS] for k in keys ]
+        op  = [ JIT.ctrl_kinds[k] if isa[k][IN_CLASS] == CL_CTRL else isa[k][IN_OP] for k in keys ]
+        op1 = [ isa[k][IN_ALU1] for k in keys ]
+        op2 = [ isa[k][IN_ALU2] for k in keys ]
+
+        i32, i64 = np.int32, np.int64
+        return ( np.array(starts, i32), np.array(ends, i32), np.array(e_mask, i64),
+                 np.array(e_match, i64), np.array(e_id, i32), np.array(cls, i32),
+                 np.array(op, i32), np.array(op1, i32), np.array(op2, i32) )
+
+    @staticmethod
+    def run(cpu, limit = NO_LIMIT):
+        # returns None once the instruction count reaches limit
+
+        run = JIT.kernel()
+        tables = JIT.tables()
+        ids = np.full(cpu.imem.mem_words, UNDECODED, dtype = np.int32)
+        stats = np.zeros(4, dtype = np.int64)
+
+        stat = cpu.stat
+        pc = int(cpu.pc.read())
+        Startup.mark("first instruction")
+        while True:
+            budget = min(JIT.BUDGET, limit - stat.icount)
+            if budget <= 0:
+                return None
+            stats[:] = 0
+            status, pc = run(cpu.regs.reg, cpu.imem.mem, int(cpu.imem.mem_start),
+                             cpu.dmem.mem, int(cpu.dmem.mem_start), pc, budget,
+                             ids, *tables, stats)
+            stat.cycle      += int(stats[0])
+            stat.icount     += int(stats[0])
+            stat.inst_alu   += int(stats[1])
+            stat.inst_mem   += int(stats[2])
+            stat.inst_ctrl  += int(stats[3])
+            cpu.pc.write(pc)
+            if not status == EXC_NONE:
+                return status
@@ -23,196 +23,375 @@ from program import *
 
 
 #--------------------------------------------------------------------------
-#   Sim: simulates the CPU execution
+#   DecodedInst: an instruction decoded once and ready to execute
 #--------------------------------------------------------------------------
 
-class Sim(object):
+class DecodedInst(object):
 
-    @staticmethod
-    def run(cpu, entry_point):
+    # Fields set by Sim.decode():
+    #
+    #   inst, opcode        instruction word and its isa[] key
+    #   func                handler in Sim.func[]
+    #   rs1, rs2, rd        register numbers
+    #   op1_sel, op2_sel    ALU operand selects
+    #   imm                 immediate, already sign-extended (signed for loads/stores)
+    #   pc_plus4            pc + 4
+    #   alu                 ALU operation (ALU class)
+    #   load                True for loads (MEM class)
+    #   link, cond, target  link register?, branch condition, branch/jump target (CTRL class)
 
-        Sim.cpu = cpu
-        Sim.cpu.pc.write(entry_point)
+    pass
 
-        while True:
-            # Execute a single instruction
-            status = Sim.single_step()
 
-            # Update stats
-            Stat.cycle      += 1
-            Stat.icount     += 1
+#--------------------------------------------------------------------------
+#   DecodeCache: caches decoded instructions indexed by pc
+#--------------------------------------------------------------------------
 
-            # Show logs after executing a single instruction
-            if Log.level >= 5:
-                Sim.cpu.regs.dump()
-            if Log.level >= 6:
-                Sim.cpu.dmem.dump(skipzero = True)
+class DecodeCache(object):
+
+    def __init__(self):
+        self.cache = { }
+
+    def add(self, pc, d):
+        self.cache[pc] = d
+
+    def lookup(self, pc):
+        # returns None if not found
+        return self.cache.get(pc)
+
+    def invalidate(self, addr):
+        self.cache.pop(addr, None)
+
+
+#--------------------------------------------------------------------------
+#   Sim: simulates the CPU execution
+#--------------------------------------------------------------------------
+
+class Sim(object):
+
+    def __init__(self, cpu):
+
+        self.cpu        = cpu
+        self.stat       = cpu.stat
+
+        # Stores into imem invalidate the predecoded instructions
+        self.dcache     = DecodeCache()
+        cpu.imem.write_hook = self.dcache.invalidate
+
+        # Memory fast paths bound once for the interpreter loop
+        self.imem_read  = cpu.imem.read_word
+        self.dmem_read  = cpu.dmem.read_word
+        self.dmem_write = cpu.dmem.write_word
+
+    def execute(self, entry_point, budget = None):
+        # runs at most budget instructions (no limit if None) without
+        # printing the outcome; returns the status of the instruction that
+        # stopped the program, or EXC_NONE if the budget ran out
+
+        cpu = self.cpu
+        if cpu.engine in [ ENGINE_NUMPY, ENGINE_NUMBA ]:
+            np.seterr(all='ignore')
+
+        cpu.pc.write(entry_point)
+        limit = NO_LIMIT if budget is None else self.stat.icount + budget
+
+        # Translated blocks do not log or trace each instruction. The engine modules
+        # are imported only when they are used to keep the startup short.
+        # An engine returns None when it leaves the rest to the interpreter
+        # (e.g., for the last few instructions of the budget).
+        status = None
+        if cpu.log.level < 3 and cpu.trace is None:
+            if cpu.aot_module is not None:
+                from aot import AOT
+                status = AOT.run(cpu, cpu.aot_module, self.single_step, limit)
+            elif cpu.engine == ENGINE_DBT:
+                from dbt import DBT
+                status = DBT(cpu).run(limit)
+                cpu.imem.write_hook = self.dcache.invalidate
+            elif cpu.engine == ENGINE_NUMBA:
+                from jit import JIT
+                if JIT.kernel():
+                    status = JIT.run(cpu, limit)
+        if status is None:
+            status = self.loop(limit)
+        return status
+
+    @staticmethod
+    def report(cpu, status):
+        # prints the outcome of execute() and the final dumps
 
-            if not status == EXC_NONE:
-                break
-      
         # Handle exceptions, if any
+        out = cpu.log.out
         if (status & EXC_DMEM_ERROR):
-            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_DMEM_ERROR], Sim.cpu.pc.read()))
+            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_DMEM_ERROR], cpu.pc.read()), file = out)
         elif (status & EXC_EBREAK):
-            print("Execution completed")
+            print("Execution completed", file = out)
         elif (status & EXC_ILLEGAL_INST):
-            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_ILLEGAL_INST], Sim.cpu.pc.read()))
+            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_ILLEGAL_INST], cpu.pc.read()), file = out)
         elif (status & EXC_IMEM_ERROR):
-            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_IMEM_ERROR], Sim.cpu.pc.read()))
+            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_IMEM_ERROR], cpu.pc.read()), file = out)
+
+        # Show the instructions that led to the exception
+        if status not in [ EXC_NONE, EXC_EBREAK ] and cpu.log.level > 0 and \
+            cpu.history is not None:
+            cpu.history.dump(cpu.asmcache, out)
 
         # Show logs after finishing the program execution
-        if Log.level > 0:
-            if Log.level < 5:
-                Sim.cpu.regs.dump()
-            if Log.level > 1 and Log.level < 6:
-                Sim.cpu.dmem.dump(skipzero = True)
+        if cpu.log.level > 0:
+            if cpu.log.level < 5:
+                cpu.regs.dump(out = out)
+            if cpu.log.level > 1 and cpu.log.level < 6:
+                cpu.dmem.dump(skipzero = True, out = out)
+
+    def loop(self, limit):
+
+        cpu, log, stat = self.cpu, self.cpu.log, self.stat
+        dump = None
+        if log.level >= 5:
+            dump = CycleDump(cpu.regs, cpu.dmem if log.level >= 6 else None)
+        Startup.mark("first instruction")
+        status = EXC_NONE
+        while stat.icount < limit:
+            # Execute a single instruction
+            status = self.single_step()
 
-    @staticmethod
-    def log(pc, inst, rd, wbdata, pc_next):
+            # Update stats
+            stat.cycle      += 1
+            stat.icount     += 1
+
+            # Show logs after executing a single instruction
+            if dump is not None:
+                dump.show(log.out)
 
-        if Stat.cycle < Log.start_cycle:
+            if not status == EXC_NONE:
+                break
+        if dump is not None:
+            dump.close()
+        return status
+
+    def log(self, pc, inst, rd, wbdata, pc_next, flags = 0, addr = 0, data = 0):
+        # records an executed instruction in the history, the trace, and
+        # the log. flags, addr, data: as in the trace (TR_RD is added here
+        # except for control transfers, whose rd field is logged even if
+        # not written)
+
+        if rd and not flags & TR_CTRL:
+            flags |= TR_RD
+        h = self.cpu.history
+        if h is not None:
+            # History.add(), inlined
+            h.records[h.n % h.size] = (self.stat.cycle, pc, inst, rd, wbdata, flags, addr)
+            h.n += 1
+
+        log = self.cpu.log
+        if self.stat.cycle < log.start_cycle:
             return
-        if Log.level >= 4:
+        if self.cpu.trace is not None:
+            self.cpu.trace.write(self.stat.cycle, pc, inst, rd, flags, wbdata, addr, data)
+        if log.level >= 4:
             info = "# R[%d] <- 0x%08x, pc_next=0x%08x" % (rd, wbdata, pc_next) if rd else \
                    "# pc_next=0x%08x" % pc_next
         else:
             info = ''
-        if Log.level >= 3:
-            print("%d 0x%08x: %-30s%-s" % (Stat.cycle, pc, Program.disasm(pc, inst), info))
+        if log.level >= 3:
+            print("%d 0x%08x: %-30s%-s" % (self.stat.cycle, pc, Program.disasm(pc, inst, self.cpu.asmcache), info),
+                  file = log.out)
         else:
             return
 
-    def run_alu(pc, inst, opcode, cs):
-        np.seterr(all='ignore')
-
-        Stat.inst_alu += 1
-
-        rs1         = RISCV.rs1(inst)
-        rs2         = RISCV.rs2(inst)
-        rd          = RISCV.rd(inst)
-
-        imm_i       = RISCV.imm_i(inst)
-        imm_u       = RISCV.imm_u(inst)
-
-        rs1_data    = Sim.cpu.regs.read(rs1)
-        rs2_data    = Sim.cpu.regs.read(rs2)
-
-        alu1        = rs1_data      if cs[IN_ALU1] == OP1_RS1    else \
-                      pc            if cs[IN_ALU1] == OP1_PC     else \
-                      WORD(0)       
-
-        alu2        = rs2_data      if cs[IN_ALU2] == OP2_RS2    else \
-                      imm_i         if cs[IN_ALU2] == OP2_IMI    else \
-                      imm_u         if cs[IN_ALU2] == OP2_IMU    else \
-                      WORD(0)
-
-        
-        alu_out     = WORD(alu1 + alu2)                     if (cs[IN_OP] == ALU_ADD)           else \
-                      WORD(alu1 - alu2)                     if (cs[IN_OP] == ALU_SUB)           else \
-                      WORD(alu1 & alu2)                     if (cs[IN_OP] == ALU_AND)           else \
-                      WORD(alu1 | alu2)                     if (cs[IN_OP] == ALU_OR)            else \
-                      WORD(alu1 ^ alu2)                     if (cs[IN_OP] == ALU_XOR)           else \
-                      WORD(1)                               if (cs[IN_OP] == ALU_SLT and             \
-                                                                (SWORD(alu1) < SWORD(alu2)))    else \
-                      WORD(1)                               if (cs[IN_OP] == ALU_SLTU and            \
-                                                                (alu1 < alu2))                  else \
-                      WORD(alu1 << (alu2 & 0x1f))           if (cs[IN_OP] == ALU_SLL)           else \
-                      WORD(SWORD(alu1) >> (alu2 & 0x1f))    if (cs[IN_OP] == ALU_SRA)           else \
-                      WORD(alu1 >> (alu2 & 0x1f))           if (cs[IN_OP] == ALU_SRL)           else \
-                      WORD(0)
-
-        pc_next     = pc + 4
-
-        Sim.cpu.regs.write(rd, alu_out)
-        Sim.cpu.pc.write(pc_next)
-        Sim.log(pc, inst, rd, alu_out, pc_next)
+    def run_alu(self, pc, d):
+
+        self.stat.inst_alu += 1
+
+        alu1        = self.cpu.regs.read(d.rs1) if d.op1_sel == OP1_RS1    else \
+                      pc                        if d.op1_sel == OP1_PC     else \
+                      0
+
+        alu2        = self.cpu.regs.read(d.rs2) if d.op2_sel == OP2_RS2    else \
+                      d.imm
+
+        alu_out     = d.alu(alu1, alu2)
+        pc_next     = d.pc_plus4
+
+        self.cpu.regs.write(d.rd, alu_out)
+        self.cpu.pc.write(pc_next)
+        self.log(pc, d.inst, d.rd, alu_out, pc_next)
         return EXC_NONE
 
-    def run_mem(pc, inst, opcode, cs):
+    def run_mem(self, pc, d):
+
+        self.stat.inst_mem += 1
 
-        Stat.inst_mem += 1
-       
-        rs1         = RISCV.rs1(inst)
-        rs1_data    = Sim.cpu.regs.read(rs1)
+        rs1_data    = self.cpu.regs.read(d.rs1)
+        mem_addr    = rs1_data + d.imm
 
-        if (cs[IN_OP] == MEM_LD):
-            rd          = RISCV.rd(inst)
-            imm_i       = RISCV.imm_i(inst)
-            mem_addr    = rs1_data + SWORD(imm_i)
-            mem_data, dmem_ok = Sim.cpu.dmem.access(True, mem_addr, 0, M_XRD)
+        if d.load:
+            rd          = d.rd
+            mem_data    = self.dmem_read(mem_addr)
+            dmem_ok     = mem_data is not None
             if dmem_ok:
-                Sim.cpu.regs.write(rd, mem_data)
+                self.cpu.regs.write(rd, mem_data)
         else:
-            rd          = 0                     
-            rs2         = RISCV.rs2(inst)
-            rs2_data    = Sim.cpu.regs.read(rs2)
-
-            imm_s       = RISCV.imm_s(inst)
-            mem_addr    = rs1_data + SWORD(imm_s)
-            mem_data, dmem_ok = Sim.cpu.dmem.access(True, mem_addr, rs2_data, M_XWR)
+            rd          = 0
+            rs2_data    = self.cpu.regs.read(d.rs2)
+            mem_data    = 0
+            dmem_ok     = self.dmem_write(mem_addr, rs2_data)
 
         if not dmem_ok:
+            if self.cpu.history is not None:
+                self.cpu.history.add(self.stat.cycle, pc, d.inst, 0, 0,
+                                     TR_EXC | (TR_LOAD if d.load else TR_STORE), mem_addr)
             return EXC_DMEM_ERROR
 
-        pc_next         = pc + 4
-        Sim.cpu.pc.write(pc_next)
-        Sim.log(pc, inst, rd, mem_data, pc_next)
+        pc_next         = d.pc_plus4
+        self.cpu.pc.write(pc_next)
+        if d.load:
+            self.log(pc, d.inst, rd, mem_data, pc_next, TR_LOAD, mem_addr, mem_data)
+        else:
+            self.log(pc, d.inst, rd, mem_data, pc_next, TR_STORE, mem_addr, rs2_data)
         return EXC_NONE
 
-    def run_ctrl(pc, inst, opcode, cs):
+    def run_ctrl(self, pc, d):
 
-        Stat.inst_ctrl += 1
+        self.stat.inst_ctrl += 1
 
-        if inst in [ EBREAK, ECALL ]:
-            Sim.log(pc, inst, 0, 0, 0) 
+        if d.opcode in [ EBREAK, ECALL ]:
+            self.log(pc, d.inst, 0, 0, 0, TR_CTRL)
             return EXC_EBREAK
 
-        rs1             = RISCV.rs1(inst)
-        rs2             = RISCV.rs2(inst)
-        rd              = RISCV.rd(inst)
-        rs1_data        = Sim.cpu.regs.read(rs1)
-        rs2_data        = Sim.cpu.regs.read(rs2)
-
-        imm_i           = RISCV.imm_i(inst)
-        imm_j           = RISCV.imm_j(inst)
-        imm_b           = RISCV.imm_b(inst)
-        pc_plus4        = pc + 4
-
-        pc_next         = pc + imm_j        if opcode == JAL    else                                             \
-                          pc + imm_b        if (opcode == BEQ and rs1_data == rs2_data) or                       \
-                                                (opcode == BNE and not (rs1_data == rs2_data)) or                \
-                                                (opcode == BLT and SWORD(rs1_data) < SWORD(rs2_data)) or         \
-                                                (opcode == BGE and not (SWORD(rs1_data) < SWORD(rs2_data))) or   \
-                                                (opcode == BLTU and WORD(rs1_data) < WORD(rs2_data)) or          \
-                                                (opcode == BGEU and not (WORD(rs1_data) < WORD(rs2_data)))  else \
-                          (rs1_data + imm_i) & WORD(0xfffffffe)     if opcode == JALR   else                     \
-                          pc_plus4
-
-        if (opcode in [ JAL, JALR ]):
-            Sim.cpu.regs.write(rd, pc_plus4)
-        Sim.cpu.pc.write(pc_next)
-        Sim.log(pc, inst, rd, pc_plus4, pc_next) 
+        if d.opcode == JAL:
+            pc_next     = d.target
+        elif d.opcode == JALR:
+            pc_next     = (self.cpu.regs.read(d.rs1) + d.imm) & 0xfffffffe
+        elif d.cond(self.cpu.regs.read(d.rs1), self.cpu.regs.read(d.rs2)):
+            pc_next     = d.target
+        else:
+            pc_next     = d.pc_plus4
+
+        if d.link:
+            self.cpu.regs.write(d.rd, d.pc_plus4)
+        self.cpu.pc.write(pc_next)
+        flags = TR_CTRL | TR_RD if d.link and d.rd else TR_CTRL
+        if pc_next != d.pc_plus4:
+            flags |= TR_TAKEN
+        self.log(pc, d.inst, d.rd, d.pc_plus4, pc_next, flags, pc_next)
         return EXC_NONE
 
 
     func = [ run_alu, run_mem, run_ctrl ]
 
-    @staticmethod
-    def single_step():
-
-        pc      = Sim.cpu.pc.read()
-
-        # Instruction fetch
-        inst, imem_status = Sim.cpu.imem.access(True, pc, 0, M_XRD)
-        if not imem_status:
-            return EXC_IMEM_ERROR
-
-        # Instruction decode 
-        opcode  = RISCV.opcode(inst)
-        if opcode == ILLEGAL:
-            return EXC_ILLEGAL_INST
+    # ALU operations on (alu1, alu2) for each engine, indexed by isa[opcode][IN_OP]
+    alu_ops = {
+        ENGINE_NUMPY : {
+            ALU_ADD     : lambda a, b: WORD(a + b),
+            ALU_SUB     : lambda a, b: WORD(a - b),
+            ALU_AND     : lambda a, b: WORD(a & b),
+            ALU_OR      : lambda a, b: WORD(a | b),
+            ALU_XOR     : lambda a, b: WORD(a ^ b),
+            ALU_SLT     : lambda a, b: WORD(1) if SWORD(a) < SWORD(b) else WORD(0),
+            ALU_SLTU    : lambda a, b: WORD(1) if a < b else WORD(0),
+            ALU_SLL     : lambda a, b: WORD(a << (b & 0x1f)),
+            ALU_SRA     : lambda a, b: WORD(SWORD(a) >> (b & 0x1f)),
+            ALU_SRL     : lambda a, b: WORD(a >> (b & 0x1f)),
+        },
+        ENGINE_INT : {
+            ALU_ADD     : lambda a, b: (a + b) & WORD_MASK,
+            ALU_SUB     : lambda a, b: (a - b) & WORD_MASK,
+            ALU_AND     : lambda a, b: a & b,
+            ALU_OR      : lambda a, b: a | b,
+            ALU_XOR     : lambda a, b: a ^ b,
+            ALU_SLT     : lambda a, b: 1 if sword(a) < sword(b) else 0,
+            ALU_SLTU    : lambda a, b: 1 if a < b else 0,
+            ALU_SLL     : lambda a, b: (a << (b & 0x1f)) & WORD_MASK,
+            ALU_SRA     : lambda a, b: (sword(a) >> (b & 0x1f)) & WORD_MASK,
+            ALU_SRL     : lambda a, b: a >> (b & 0x1f),
+        },
+    }
+
+    # Branch conditions on (rs1_data, rs2_data) for each engine, indexed by opcode
+    br_conds = {
+        ENGINE_NUMPY : {
+            BEQ         : lambda a, b: a == b,
+            BNE         : lambda a, b: not (a == b),
+            BLT         : lambda a, b: SWORD(a) < SWORD(b),
+            BGE         : lambda a, b: not (SWORD(a) < SWORD(b)),
+            BLTU        : lambda a, b: WORD(a) < WORD(b),
+            BGEU        : lambda a, b: not (WORD(a) < WORD(b)),
+        },
+        ENGINE_INT : {
+            BEQ         : lambda a, b: a == b,
+            BNE         : lambda a, b: a != b,
+            BLT         : lambda a, b: sword(a) < sword(b),
+            BGE         : lambda a, b: sword(a) >= sword(b),
+            BLTU        : lambda a, b: a < b,
+            BGEU        : lambda a, b: a >= b,
+        },
+    }
+
+    # Signed conversion of load/store offsets for each engine
+    signed = { ENGINE_NUMPY: SWORD, ENGINE_INT: sword }
+
+    # The dbt and numba engines interpret instructions just like the int
+    # and numpy engines, respectively
+    alu_ops[ENGINE_DBT]     = alu_ops[ENGINE_INT]
+    br_conds[ENGINE_DBT]    = br_conds[ENGINE_INT]
+    signed[ENGINE_DBT]      = signed[ENGINE_INT]
+    alu_ops[ENGINE_NUMBA]   = alu_ops[ENGINE_NUMPY]
+    br_conds[ENGINE_NUMBA]  = br_conds[ENGINE_NUMPY]
+    signed[ENGINE_NUMBA]    = signed[ENGINE_NUMPY]
+
+    def decode(self, pc, inst, opcode):
 
         cs = isa[opcode]
-        return Sim.func[cs[IN_CLASS]](pc, inst, opcode, cs)
-
+        engine = self.cpu.engine
+        d = DecodedInst()
+        d.inst      = inst
+        d.opcode    = opcode
+        d.func      = Sim.func[cs[IN_CLASS]]
+        d.rs1       = int(RISCV.rs1(inst))
+        d.rs2       = int(RISCV.rs2(inst))
+        d.rd        = int(RISCV.rd(inst))
+        d.op1_sel   = cs[IN_ALU1]
+        d.op2_sel   = cs[IN_ALU2]
+        d.pc_plus4  = (pc + 4) & WORD_MASK
+
+        if cs[IN_CLASS] == CL_ALU:
+            d.alu   = Sim.alu_ops[engine].get(cs[IN_OP], lambda a, b: 0)
+            d.imm   = RISCV.imm_i(inst)     if d.op2_sel == OP2_IMI   else \
+                      RISCV.imm_u(inst)     if d.op2_sel == OP2_IMU   else \
+                      0
+        elif cs[IN_CLASS] == CL_MEM:
+            d.load  = cs[IN_OP] == MEM_LD
+            imm     = RISCV.imm_i(inst) if d.load else RISCV.imm_s(inst)
+            d.imm   = Sim.signed[engine](imm)
+        else:
+            d.link  = opcode in [ JAL, JALR ]
+            d.cond  = Sim.br_conds[engine].get(opcode)
+            d.imm   = RISCV.imm_i(inst)
+            imm     = RISCV.imm_j(inst) if opcode == JAL else RISCV.imm_b(inst)
+            d.target = (pc + imm) & WORD_MASK
+        return d
+
+    def single_step(self):
+
+        pc      = self.cpu.pc.read()
+
+        # Look up the predecoded instruction first
+        d = self.dcache.lookup(pc)
+        if d is None:
+            # Instruction fetch
+            inst    = self.imem_read(pc)
+            if inst is None:
+                return EXC_IMEM_ERROR
+
+            # Instruction decode
+            opcode  = RISCV.opcode(inst)
+            if opcode == ILLEGAL:
+                if self.cpu.history is not None:
+                    self.cpu.history.add(self.stat.cycle, pc, inst, 0, 0, TR_EXC)
+                return EXC_ILLEGAL_INST
+
+            d = self.decode(pc, inst, opcode)
+            self.dcache.add(pc, d)
+
+        return d.func(self, pc, d)
@@ -16,6 +16,10 @@
 #==========================================================================
 
 import sys
+import copy
+import time
+
+STARTED = time.perf_counter()      # for --startup-report
 
 from consts import *
 from isa import *
@@ -23,6 +27,8 @@ from components import *
 from program import *
 from sim import *
 
+IMPORTED = time.perf_counter()
+
 
 #--------------------------------------------------------------------------
 #   Configurations
@@ -44,16 +50,111 @@ DMEM_SIZE   = WORD(64 * 1024)
 
 class SNURISC(object):
 
+    # Engines for -e, and those that work with --paged
+    engines         = [ ENGINE_NUMPY, ENGINE_INT, ENGINE_DBT, ENGINE_NUMBA ]
+    paged_engines   = [ ENGINE_NUMPY, ENGINE_INT ]
+
+    # Defaults for new machines (set from the command line)
+    engine          = ENGINE_NUMPY      # default execution engine
+    aot             = False             # run a statically recompiled module (--aot)
+    paged           = False             # use sparse paged memories (--paged)
+    dmem_size       = DMEM_SIZE
+    trace_file      = None              # binary trace file name (--trace)
+    log_file        = None              # log output file name (--log-file)
+    log_tail        = 0                 # lines of the log kept (--log-tail)
+    load_mem        = [ ]               # (file, addr) to load (--load-mem)
+    dump_mem        = [ ]               # (start, end, file) to dump (--dump-mem)
+    checkpoint_at   = None              # instruction count to checkpoint at (--checkpoint-at)
+    checkpoint_file = None
+    restore_file    = None              # checkpoint to start from (--restore)
+
+    def __init__(self, engine = None, paged = None, dmem_size = None):
+
+        if engine is not None:
+            self.engine     = engine
+        if paged is not None:
+            self.paged      = paged
+        if dmem_size is not None:
+            self.dmem_size  = WORD(dmem_size)
+        self.aot_module = None
+
+        # Per-machine simulation state
+        self.stat       = Stat()
+        self.log        = Log()
+        self.asmcache   = AsmCache()
+        self.trace      = None              # TraceWriter, if tracing
+        self.history    = History() if History.size else None
+        self.checkpoint = None              # Checkpoint to take, if any
 
-    def __init__(self):
+        if self.engine in [ ENGINE_INT, ENGINE_DBT ]:
+            self.pc     = IntRegister()
+            self.regs   = IntRegisterFile()
+        else:
+            self.pc     = Register()
+            self.regs   = RegisterFile()
 
-        self.pc     = Register()
-        self.regs   = RegisterFile()
-        self.imem   = Memory(IMEM_START, IMEM_SIZE, WORD_SIZE)
-        self.dmem   = Memory(DMEM_START, DMEM_SIZE, WORD_SIZE)
+        if self.paged:
+            dtype       = None if self.engine == ENGINE_INT else WORD
+            self.imem   = PagedMemory([ (IMEM_START, IMEM_SIZE, 'r') ], WORD_SIZE, dtype)
+            self.dmem   = PagedMemory([ (DMEM_START, self.dmem_size, 'rw') ], WORD_SIZE, dtype)
+        elif self.engine in [ ENGINE_INT, ENGINE_DBT ]:
+            self.imem   = ByteMemory(IMEM_START, IMEM_SIZE, WORD_SIZE)
+            self.dmem   = ByteMemory(DMEM_START, self.dmem_size, WORD_SIZE)
+        else:
+            self.imem   = Memory(IMEM_START, IMEM_SIZE, WORD_SIZE)
+            self.dmem   = Memory(DMEM_START, self.dmem_size, WORD_SIZE)
 
     def run(self, entry_point):
-        Sim.run(self, entry_point)
+
+        ck = self.checkpoint
+        if ck is not None and self.stat.icount < ck.at:
+            # Stop at the checkpoint and go on from the next instruction
+            status = self.execute(entry_point, ck.at - self.stat.icount)
+            if status == EXC_NONE:
+                try:
+                    ck.save(self, self.pc.read(), self.regs)
+                except OSError as e:
+                    print("Cannot write checkpoint %s: %s" % (ck.filename, e))
+                status = self.execute(self.pc.read())
+            else:
+                print("No checkpoint taken: the program stopped before %d instructions" % ck.at)
+        else:
+            status = self.execute(entry_point)
+        Sim.report(self, status)
+
+    def execute(self, entry_point, max_insts = None, max_cycles = None):
+        # runs the program without printing the outcome; returns the
+        # status as Sim.execute() (one instruction takes one cycle here)
+        if self.engine in [ ENGINE_INT, ENGINE_DBT ]:
+            entry_point = int(entry_point)
+        budgets = [ n for n in [ max_insts, max_cycles ] if n is not None ]
+        return Sim(self).execute(entry_point, min(budgets) if budgets else None)
+
+    def fork(self):
+        # returns a copy of the machine that goes on independently, e.g.,
+        # with some registers or memory words changed. Only the registers
+        # are copied: with paged memories, the pages are shared copy-on-write
+        # (PagedMemory.fork()), and flat ones are copied. The copy shares the
+        # log output and the disassembly cache, but not the trace or the
+        # checkpoint to take. It can be pickled to run in another process.
+
+        memo = { id(self.imem): self.imem.fork(), id(self.dmem): self.dmem.fork(),
+                 id(self.asmcache): self.asmcache }
+        child = copy.deepcopy(self, memo)
+        child.log.out = self.log.out
+        child.aot_module = self.aot_module
+        return child
+
+    def __getstate__(self):
+        # also used by fork(): the log output, the trace, the checkpoint to
+        # take, and the AOT module (the engine is still dbt) stay with this
+        # machine
+
+        state = dict(self.__dict__)
+        state.update(trace = None, checkpoint = None, aot_module = None)
+        state['log'] = copy.copy(self.log)
+        state['log'].out = None
+        return state
 
 
 #--------------------------------------------------------------------------
@@ -62,7 +163,7 @@ class SNURISC(object):
 
 def show_usage(name):
     print("SNURISC: A RISC-V Instruction Set Simulator in Python")
-    print("Usage: %s [-l n] [-c m] filename" % name)
+    print("Usage: %s [-l n] [-c m] [-e engine] [--aot] [--paged] [--dmem-size n] [--trace file] [--log-file file] [--log-tail n] [--history n] [--snapshot n] [--load-mem file@addr] [--dump-mem start:end:file] [--checkpoint-at n file] [--restore file] [--startup-report] filename" % name)
     print("\tfilename: RISC-V executable file name")
     print("\t-l sets the desired log level n (default: 1)")
     print("\t   0: shows no output message")
@@ -72,16 +173,66 @@ def show_usage(name):
     print("\t   4: 3 + shows full information for each instruction")
     print("\t   5: 4 + dumps registers for each cycle")
     print("\t   6: 5 + dumps data memory for each cycle")
-    print("\t-c shows logs after cycle m (default: 0, only effective for log level 3 or higher)")
+    print("\t-c shows logs after cycle m (default: 0, only effective for log level 3 or higher or --trace)")
+    print("\t-e selects the execution engine (default: numpy)")
+    print("\t   numpy: keeps registers and memory in NumPy 32-bit integers")
+    print("\t   int:   keeps registers and memory in Python ints (faster)")
+    print("\t   dbt:   int + translates basic blocks into Python functions (fastest, log level 0-2)")
+    print("\t   numba: numpy + runs a Numba-compiled loop if Numba is installed (log level 0-2)")
+    print("\t--aot recompiles the whole program into a Python module cached by the ELF hash")
+    print("\t   (implies -e dbt; reused by later runs of the same executable)")
+    print("\t--paged allocates memory in 4KB pages on first touch (imem: read-only, dmem: read/write)")
+    print("\t--dmem-size sets the dmem size in bytes, with an optional K/M/G suffix (default: 64K)")
+    print("\t   (--paged is only supported by the numpy and int engines)")
+    print("\t--trace writes a binary trace of the executed instructions to file (gzip-compressed")
+    print("\t   if it ends with .gz; runs on the interpreter); see tracefile.py to read it")
+    print("\t--log-file writes the output of the run to file in large blocks instead of stdout")
+    print("\t   (compressed on a background thread if it ends with .gz, or .zst with zstandard)")
+    print("\t--log-tail keeps only the last n lines of the output, shown at the end (or written to --log-file)")
+    print("\t--history shows the last n instructions executed when an exception occurs (default: 16, 0: off)")
+    print("\t--snapshot dumps everything every n cycles at log levels 5-6, and only what changed in between")
+    print("\t   (default: 0, only in the first cycle; 1: every cycle)")
+    print("\t--load-mem copies a raw binary or .npy file to dmem at addr after loading (repeatable)")
+    print("\t--dump-mem writes dmem from start up to end (exclusive) to file after the run, as raw")
+    print("\t   little-endian bytes, or as .npy if file ends with .npy (repeatable)")
+    print("\t--checkpoint-at writes the state after n instructions to file, keeping only the memory")
+    print("\t   pages changed since loading, and continues the run")
+    print("\t--restore starts the run from a checkpoint of the same executable file")
+    print("\t--startup-report shows the time spent on imports, loading, and setup before the first instruction")
+
+
+def parse_size(arg):
+    # returns the number of bytes in arg (e.g., 4096, 0x1000, 256M), or None
+    units = { 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30 }
+    try:
+        if arg[-1:].upper() in units:
+            return int(arg[:-1], 0) * units[arg[-1:].upper()]
+        return int(arg, 0)
+    except ValueError:
+        return None
 
 
 def parse_args(args):
-    if (not len(args) in [ 2, 4, 6 ]):
+    if len(args) < 2:
         return None
 
     index = 1
-    while True:
+    while index < len(args):
         if args[index].startswith('-'):
+            if args[index] == '--aot':
+                SNURISC.aot = True
+                index += 1
+                continue
+            elif args[index] == '--paged':
+                SNURISC.paged = True
+                index += 1
+                continue
+            elif args[index] == '--startup-report':
+                Startup.enabled = True
+                index += 1
+                continue
+            elif index + 2 >= len(args):
+                return None
             if args[index] == '-l':
                 try:
                     level = int(args[index + 1])
@@ -100,6 +251,78 @@ def parse_args(args):
                     return None
                 index += 2
                 Log.start_cycle = cycle
+            elif args[index] == '-e':
+                if args[index + 1] not in SNURISC.engines:
+                    print("Invalid engine '%s'" % args[index + 1])
+                    return None
+                SNURISC.engine = args[index + 1]
+                index += 2
+            elif args[index] == '--dmem-size':
+                size = parse_size(args[index + 1])
+                if size is None or size <= 0 or size % WORD_SIZE or \
+                    int(DMEM_START) + size >= 1 << 32:
+                    print("Invalid dmem size '%s'" % args[index + 1])
+                    return None
+                SNURISC.dmem_size = WORD(size)
+                index += 2
+            elif args[index] == '--trace':
+                SNURISC.trace_file = args[index + 1]
+                index += 2
+            elif args[index] == '--history':
+                if not args[index + 1].isdigit():
+                    print("Invalid number of instructions '%s'" % args[index + 1])
+                    return None
+                History.size = int(args[index + 1])
+                index += 2
+            elif args[index] == '--snapshot':
+                if not args[index + 1].isdigit():
+                    print("Invalid number of cycles '%s'" % args[index + 1])
+                    return None
+                CycleDump.snapshot = int(args[index + 1])
+                index += 2
+            elif args[index] == '--log-file':
+                SNURISC.log_file = args[index + 1]
+                index += 2
+            elif args[index] == '--log-tail':
+                if not args[index + 1].isdigit() or int(args[index + 1]) < 1:
+                    print("Invalid number of lines '%s'" % args[index + 1])
+                    return None
+                SNURISC.log_tail = int(args[index + 1])
+                index += 2
+            elif args[index] == '--checkpoint-at':
+                if index + 3 >= len(args):
+                    return None
+                if not args[index + 1].isdigit():
+                    print("Invalid number of instructions '%s'" % args[index + 1])
+                    return None
+                SNURISC.checkpoint_at = int(args[index + 1])
+                SNURISC.checkpoint_file = args[index + 2]
+                index += 3
+            elif args[index] == '--restore':
+                SNURISC.restore_file = args[index + 1]
+                index += 2
+            elif args[index] == '--load-mem':
+                name, _, addr = args[index + 1].rpartition('@')
+                try:
+                    addr = int(addr, 0)
+                except ValueError:
+                    name = ''
+                if not name:
+                    print("Invalid file@addr '%s'" % args[index + 1])
+                    return None
+                SNURISC.load_mem.append((name, addr))
+                index += 2
+            elif args[index] == '--dump-mem':
+                fields = args[index + 1].split(':', 2)
+                try:
+                    start, end = int(fields[0], 0), int(fields[1], 0)
+                except (ValueError, IndexError):
+                    start, end = 0, 0
+                if start >= end or len(fields) < 3 or not fields[2]:
+                    print("Invalid start:end:file '%s'" % args[index + 1])
+                    return None
+                SNURISC.dump_mem.append((start, end, fields[2]))
+                index += 2
             else:
                 print("Invalid option '%s'" % args[index])
                 return None
@@ -107,7 +330,14 @@ def parse_args(args):
             break
 
     if len(args) != index + 1:
-        print("Invalid argument '%s'" % args[index + 1:])
+        if index < len(args):
+            print("Invalid argument '%s'" % args[index + 1:])
+        return None
+
+    if SNURISC.aot:
+        SNURISC.engine = ENGINE_DBT
+    if SNURISC.paged and SNURISC.engine not in SNURISC.paged_engines:
+        print("--paged is not supported by the '%s' engine" % SNURISC.engine)
         return None
 
     return args[index]      # executable file name
@@ -124,13 +354,63 @@ def main():
         show_usage(sys.argv[0])
         sys.exit()
 
+    Startup.mark("start", STARTED)
+    Startup.mark("imports", IMPORTED)
+
     cpu = SNURISC()
+    Startup.mark("machine")
     prog = Program()
     entry_point = prog.load(cpu, filename)
     if not entry_point:
         sys.exit()
+    Startup.mark("load")
+    if SNURISC.restore_file:
+        try:
+            pc, pipeline = Checkpoint.restore(cpu, SNURISC.restore_file, prog, cpu.regs)
+        except (OSError, ValueError) as e:
+            print(e)
+            sys.exit()
+        entry_point = WORD(pc)
+        Startup.mark("restore")
+    if SNURISC.checkpoint_file:
+        cpu.checkpoint = Checkpoint(SNURISC.checkpoint_file, SNURISC.checkpoint_at, prog)
+    try:
+        for name, addr in SNURISC.load_mem:
+            MemFile.load(cpu, name, addr)
+        for start, end, name in SNURISC.dump_mem:
+            MemFile.memory(cpu, start, end - start)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit()
+    if SNURISC.aot:
+        from aot import AOT
+        cpu.aot_module = AOT.load(cpu, filename, entry_point)
+        Startup.mark("aot")
+    if SNURISC.trace_file:
+        from tracefile import TraceWriter
+        try:
+            cpu.trace = TraceWriter(SNURISC.trace_file)
+        except OSError:
+            print("Cannot open trace file %s" % SNURISC.trace_file)
+            sys.exit()
+    if SNURISC.log_file or SNURISC.log_tail:
+        try:
+            cpu.log.out = Log.sink(SNURISC.log_file, SNURISC.log_tail)
+        except (OSError, ImportError) as e:
+            print("Cannot open log file %s: %s" % (SNURISC.log_file, e))
+            sys.exit()
     cpu.run(entry_point)
-    Stat.show()
+    if cpu.trace:
+        cpu.trace.close()
+    try:
+        for start, end, name in SNURISC.dump_mem:
+            MemFile.save(cpu, start, end, name)
+    except (OSError, ValueError) as e:
+        print(e)
+    cpu.stat.show(cpu.log.out)
+    if cpu.log.out:
+        cpu.log.out.close()
+    Startup.show()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Binary instruction traces (--trace) and their reader.
+#
+#   Jin-Soo Kim
+#   Systems Software and Architecture Laboratory
+#   Seoul National University
+#   http://csl.snu.ac.kr
+#
+#==========================================================================
+
+
+import sys
+import gzip
+import struct
+
+from consts import *
+from isa import *
+from components import *
+from program import *
+
+
+#--------------------------------------------------------------------------
+#   Trace file format
+#--------------------------------------------------------------------------
+
+# A trace file is a 16-byte header followed by one fixed-size record per
+# executed instruction, both in little endian:
+#
+#   header:  magic, version, flags (TRACE_DELTA), reserved
+#   record:  cycle, pc, inst, rd, flags (TR_*), reserved, wbdata, addr, data
+#
+# wbdata is valid with TR_RD, addr and data with TR_LOAD or TR_STORE, and
+# addr (the next pc) with TR_CTRL. A file name ending with '.gz' is written
+# compressed with gzip, and pc and addr are then stored as the differences
+# from the previous record, which compress much better.
+
+TRACE_MAGIC         = b'PYRISCTR'
+TRACE_VERSION       = 1
+TRACE_DELTA         = 0x0001    # header flag: pc and addr are delta-encoded
+
+TRACE_HEADER        = np.dtype([ ('magic', 'S8'), ('version', '<u2'), ('flags', '<u2'),
+                                 ('reserved', '<u4') ])
+TRACE_RECORD        = np.dtype([ ('cycle', '<u8'), ('pc', '<u4'), ('inst', '<u4'),
+                                 ('rd', 'u1'), ('flags', 'u1'), ('reserved', '<u2'),
+                                 ('wbdata', '<u4'), ('addr', '<u4'), ('data', '<u4') ])
+
+
+#--------------------------------------------------------------------------
+#   TraceWriter: appends records to a trace file
+#--------------------------------------------------------------------------
+
+class TraceWriter(object):
+
+    RECORDS     = 1 << 14       # records buffered before each write
+    record      = struct.Struct('<QIIBBHIII')
+
+    def __init__(self, filename):
+
+        self.delta      = filename.endswith('.gz')
+        self.file       = gzip.open(filename, 'wb', 6) if self.delta else open(filename, 'wb')
+        self.buf        = bytearray(self.RECORDS * self.record.size)
+        self.n          = 0
+        self.last       = { 'pc': 0, 'addr': 0 }    # for delta encoding
+
+        header = np.array([ (TRACE_MAGIC, TRACE_VERSION, TRACE_DELTA if self.delta else 0, 0) ],
+                          dtype = TRACE_HEADER)
+        self.file.write(header.tobytes())
+
+    def write(self, cycle, pc, inst, rd, flags, wbdata = 0, addr = 0, data = 0):
+
+        self.record.pack_into(self.buf, self.n * self.record.size, cycle, pc, inst, rd,
+                              flags, 0, wbdata, addr, data)
+        self.n += 1
+        if self.n == self.RECORDS:
+            self.flush()
+
+    def flush(self):
+
+        records = np.frombuffer(self.buf, dtype = TRACE_RECORD, count = self.n)
+        if self.delta and self.n:
+            records = records.copy()
+            for field in [ 'pc', 'addr' ]:
+                v = records[field].copy()
+                records[field][1:] -= v[:-1]
+                records[field][0] -= np.uint32(self.last[field])
+                self.last[field] = int(v[-1])
+        self.file.write(records.tobytes())
+        self.n = 0
+
+    def close(self):
+
+        self.flush()
+        self.file.close()
+
+
+#--------------------------------------------------------------------------
+#   TraceFile: reads and renders trace files
+#--------------------------------------------------------------------------
+
+class TraceFile(object):
+
+    @staticmethod
+    def open(filename):
+        # returns the records as a NumPy array of TRACE_RECORD, memory-mapped
+        # unless the file is compressed. Raises ValueError if it is not a
+        # trace file.
+
+        with open(filename, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+        if compressed:
+            with gzip.open(filename, 'rb') as f:
+                data = f.read()
+        else:
+            data = np.memmap(filename, dtype = np.uint8, mode = 'r')
+
+        size = TRACE_HEADER.itemsize
+        if len(data) < size:
+            raise ValueError("File %s is not a trace file" % filename)
+        header = np.frombuffer(data[:size], dtype = TRACE_HEADER)[0]
+        if header['magic'] != TRACE_MAGIC or header['version'] != TRACE_VERSION:
+            raise ValueError("File %s is not a trace file" % filename)
+
+        count = (len(data) - size) // TRACE_RECORD.itemsize
+        if count == 0:
+            return np.zeros(0, dtype = TRACE_RECORD)
+        if not compressed:
+            return np.memmap(filename, dtype = TRACE_RECORD, mode = 'r', offset = size,
+                             shape = (count,))
+        records = np.frombuffer(data, dtype = TRACE_RECORD, count = count, offset = size).copy()
+        if header['flags'] & TRACE_DELTA:
+            for field in [ 'pc', 'addr' ]:
+                records[field] = np.cumsum(records[field], dtype = np.uint32)
+        return records
+
+    @staticmethod
+    def render(records, level = 3, out = sys.stdout):
+        # writes the records as the log lines of -l 3 (or -l 4)
+
+        asmcache = AsmCache()
+        for start in range(0, len(records), TraceWriter.RECORDS):
+            lines = [ ]
+            for cycle, pc, inst, rd, flags, _, wbdata, addr, data in \
+                    records[start:start + TraceWriter.RECORDS].tolist():
+                if level >= 4:
+                    pc_next = addr if flags & TR_CTRL else (pc + 4) & WORD_MASK
+                    info = "# R[%d] <- 0x%08x, pc_next=0x%08x" % (rd, wbdata, pc_next) if rd else \
+                           "# pc_next=0x%08x" % pc_next
+                else:
+                    info = ''
+                lines.append("%d 0x%08x: %-30s%-s\n" % (cycle, pc, Program.disasm(pc, inst, asmcache), info))
+            out.write(''.join(lines))
+
+
+#--------------------------------------------------------------------------
+#   Utility functions for command line parsing
+#--------------------------------------------------------------------------
+
+def show_usage(name):
+    print("Usage: %s [-l n] tracefile" % name)
+    print("\ttracefile: trace file written by snurisc --trace")
+    print("\t-l shows the trace as the log of level n: 3 (default) or 4")
+
+
+def main():
+
+    args = sys.argv[1:]
+    level = 3
+    if len(args) == 3 and args[0] == '-l' and args[1] in [ '3', '4' ]:
+        level = int(args[1])
+        args = args[2:]
+    if len(args) != 1:
+        show_usage(sys.argv[0])
+        sys.exit()
+
+    try:
+        records = TraceFile.open(args[0])
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    try:
+        TraceFile.render(records, level)
+    except BrokenPipeError:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Lock-step vectorized simulation of N instances of a program.
+#
+#   Jin-Soo Kim
+#   Systems Software and Architecture Laboratory
+#   Seoul National University
+#   http://csl.snu.ac.kr
+#
+#==========================================================================
+
+
+import sys
+import time
+
+from consts import *
+from isa import *
+from components import *
+from program import *
+from sim import *
+from snurisc import *
+
+
+#--------------------------------------------------------------------------
+#   VSim: runs N lanes of the same program in lock step
+#--------------------------------------------------------------------------
+
+# All lanes share imem, while each lane has its own registers, pc, and
+# dmem, kept as rows of 2-D arrays in the same word layout as
+# RegisterFile.reg and Memory.mem:
+#
+#   regs[lane, regno], pc[lane], dmem[lane, (addr - dmem_start) // 4]
+#
+# At each step, the running lanes are grouped by pc (hence by opcode,
+# since imem is shared) and each group executes as a single NumPy
+# operation. A lane stops individually when it hits ebreak/ecall or an
+# exception; status[lane] then holds its EXC_* code and pc[lane] the pc
+# of that instruction, just as in Sim.
+
+class VSim(object):
+
+    def __init__(self, cpu, entry_point, lanes):
+        # cpu: a SNURISC with the program loaded, used as the initial state
+
+        self.lanes      = lanes
+        self.imem       = cpu.imem
+        self.dmem_start = int(cpu.dmem.mem_start)
+        self.dmem_end   = int(cpu.dmem.mem_end)
+
+        self.regs       = np.tile(np.array(cpu.regs.reg, dtype = WORD), (lanes, 1))
+        self.dmem       = np.tile(np.array(cpu.dmem.mem, dtype = WORD), (lanes, 1))
+        self.pc         = np.full(lanes, int(entry_point), dtype = np.int64)
+        self.status     = np.full(lanes, EXC_NONE, dtype = np.int32)
+
+        # Per-lane statistics (cycle == icount as in Sim)
+        self.icount     = np.zeros(lanes, dtype = np.int64)
+        self.inst_alu   = np.zeros(lanes, dtype = np.int64)
+        self.inst_mem   = np.zeros(lanes, dtype = np.int64)
+        self.inst_ctrl  = np.zeros(lanes, dtype = np.int64)
+
+        self.decoded    = { }
+
+    def write_dmem(self, lane, addr, words):
+        # stores a sequence of words into the dmem of a lane (input data)
+
+        i = (addr - self.dmem_start) // WORD_SIZE
+        self.dmem[lane, i:i + len(words)] = words
+
+    def read_dmem(self, lane, addr, nwords):
+
+        i = (addr - self.dmem_start) // WORD_SIZE
+        return self.dmem[lane, i:i + nwords]
+
+    def regfile(self, lane):
+        # returns a RegisterFile view of the registers of a lane
+
+        rf = RegisterFile()
+        rf.reg = self.regs[lane]
+        return rf
+
+    def memory(self, lane):
+        # returns a Memory view of the dmem of a lane
+
+        m = Memory(WORD(self.dmem_start), WORD(self.dmem_end - self.dmem_start), WORD_SIZE)
+        m.mem = self.dmem[lane]
+        return m
+
+    def run(self, max_steps = None):
+        # runs until all lanes stop (or for max_steps steps); returns the
+        # number of steps taken
+
+        steps = 0
+        while max_steps is None or steps < max_steps:
+            active = np.flatnonzero(self.status == EXC_NONE)
+            if active.size == 0:
+                break
+            steps += 1
+
+            pcs = self.pc[active]
+            first = pcs[0]
+            if (pcs == first).all():
+                self.step(int(first), active)
+                continue
+
+            # Group the lanes by pc
+            upcs, inverse, counts = np.unique(pcs, return_inverse = True, return_counts = True)
+            groups = np.split(active[np.argsort(inverse, kind = 'stable')], np.cumsum(counts)[:-1])
+            for pc, lanes in zip(upcs, groups):
+                self.step(int(pc), lanes)
+        return steps
+
+    def decode(self, pc):
+        # returns (EXC_NONE, DecodedInst) or (exception, None); cached per pc
+
+        res = self.decoded.get(pc)
+        if res is not None:
+            return res
+
+        inst, ok = self.imem.access(True, WORD(pc), 0, M_XRD)
+        opcode = RISCV.opcode(inst) if ok else ILLEGAL
+        if not ok:
+            res = ( EXC_IMEM_ERROR, None )
+        elif opcode == ILLEGAL:
+            res = ( EXC_ILLEGAL_INST, None )
+        else:
+            cs = isa[opcode]
+            d = DecodedInst()
+            d.inst      = inst
+            d.opcode    = opcode
+            d.cls       = cs[IN_CLASS]
+            d.rs1       = int(RISCV.rs1(inst))
+            d.rs2       = int(RISCV.rs2(inst))
+            d.rd        = int(RISCV.rd(inst))
+            d.op1_sel   = cs[IN_ALU1]
+            d.op2_sel   = cs[IN_ALU2]
+            d.pc_plus4  = (pc + 4) & WORD_MASK
+            if d.cls == CL_ALU:
+                d.alu   = VSim.alu_ops.get(cs[IN_OP], lambda a, b: 0)
+                d.imm   = int(RISCV.imm_i(inst))    if d.op2_sel == OP2_IMI   else \
+                          int(RISCV.imm_u(inst))    if d.op2_sel == OP2_IMU   else \
+                          0
+            elif d.cls == CL_MEM:
+                d.load  = cs[IN_OP] == MEM_LD
+                d.imm   = sword(int(RISCV.imm_i(inst) if d.load else RISCV.imm_s(inst)))
+            else:
+                d.link  = opcode in [ JAL, JALR ]
+                d.cond  = VSim.br_conds.get(opcode)
+                d.imm   = int(RISCV.imm_i(inst))
+                imm     = RISCV.imm_j(inst) if opcode == JAL else RISCV.imm_b(inst)
+                d.target = (pc + int(imm)) & WORD_MASK
+            res = ( EXC_NONE, d )
+        self.decoded[pc] = res
+        return res
+
+    def read(self, lanes, regno):
+        return self.regs[lanes, regno].astype(np.int64)
+
+    def step(self, pc, lanes):
+        # executes the instruction at pc on the given lanes
+
+        self.icount[lanes] += 1
+        status, d = self.decode(pc)
+        if status != EXC_NONE:
+            self.status[lanes] = status
+            return
+
+        if d.cls == CL_ALU:
+            self.inst_alu[lanes] += 1
+            alu1    = self.read(lanes, d.rs1)   if d.op1_sel == OP1_RS1    else \
+                      pc                        if d.op1_sel == OP1_PC     else \
+                      0
+            alu2    = self.read(lanes, d.rs2)   if d.op2_sel == OP2_RS2    else \
+                      d.imm
+            if d.rd:
+                self.regs[lanes, d.rd] = d.alu(alu1, alu2)
+            self.pc[lanes] = d.pc_plus4
+
+        elif d.cls == CL_MEM:
+            self.inst_mem[lanes] += 1
+            addr    = self.read(lanes, d.rs1) + d.imm
+            ok      = (addr >= self.dmem_start) & (addr < self.dmem_end) & ((addr & 3) == 0)
+            if not ok.all():
+                self.status[lanes[~ok]] = EXC_DMEM_ERROR
+                lanes, addr = lanes[ok], addr[ok]
+            index   = (addr - self.dmem_start) >> 2
+            if d.load:
+                if d.rd:
+                    self.regs[lanes, d.rd] = self.dmem[lanes, index]
+            else:
+                self.dmem[lanes, index] = self.regs[lanes, d.rs2]
+            self.pc[lanes] = d.pc_plus4
+
+        else:
+            self.inst_ctrl[lanes] += 1
+            if d.opcode in [ EBREAK, ECALL ]:
+                self.status[lanes] = EXC_EBREAK
+                return
+            if d.opcode == JAL:
+                self.pc[lanes] = d.target
+            elif d.opcode == JALR:
+                self.pc[lanes] = (self.read(lanes, d.rs1) + d.imm) & 0xfffffffe
+            else:
+                taken = d.cond(self.read(lanes, d.rs1), self.read(lanes, d.rs2))
+                self.pc[lanes] = np.where(taken, d.target, d.pc_plus4)
+            if d.link and d.rd:
+                self.regs[lanes, d.rd] = d.pc_plus4
+
+
+    # ALU operations on int64 arrays (or ints) holding 32-bit values
+    alu_ops = {
+        ALU_ADD     : lambda a, b: (a + b) & WORD_MASK,
+        ALU_SUB     : lambda a, b: (a - b) & WORD_MASK,
+        ALU_AND     : lambda a, b: a & b,
+        ALU_OR      : lambda a, b: a | b,
+        ALU_XOR     : lambda a, b: a ^ b,
+        ALU_SLT     : lambda a, b: (a ^ 0x80000000) < (b ^ 0x80000000),
+        ALU_SLTU    : lambda a, b: a < b,
+        ALU_SLL     : lambda a, b: (a << (b & 0x1f)) & WORD_MASK,
+        ALU_SRA     : lambda a, b: (((a ^ 0x80000000) - 0x80000000) >> (b & 0x1f)) & WORD_MASK,
+        ALU_SRL     : lambda a, b: a >> (b & 0x1f),
+    }
+
+    # Branch conditions on int64 arrays, indexed by opcode
+    br_conds = {
+        BEQ         : lambda a, b: a == b,
+        BNE         : lambda a, b: a != b,
+        BLT         : lambda a, b: (a ^ 0x80000000) < (b ^ 0x80000000),
+        BGE         : lambda a, b: (a ^ 0x80000000) >= (b ^ 0x80000000),
+        BLTU        : lambda a, b: a < b,
+        BGEU        : lambda a, b: a >= b,
+    }
+
+
+#--------------------------------------------------------------------------
+#   Main: runs N copies of a program and reports the throughput
+#--------------------------------------------------------------------------
+
+def main():
+
+    if len(sys.argv) == 4 and sys.argv[1] == '-n':
+        lanes, filename = int(sys.argv[2]), sys.argv[3]
+    elif len(sys.argv) == 2:
+        lanes, filename = 1000, sys.argv[1]
+    else:
+        print("Usage: %s [-n lanes] filename" % sys.argv[0])
+        sys.exit()
+
+    cpu = SNURISC()
+    prog = Program()
+    entry_point = prog.load(cpu, filename)
+    if not entry_point:
+        sys.exit()
+
+    vsim = VSim(cpu, entry_point, lanes)
+    t = time.time()
+    steps = vsim.run()
+    t = time.time() - t
+
+    for status in sorted(set(vsim.status.tolist())):
+        print("%d lanes stopped with '%s'" % ((vsim.status == status).sum(), EXC_MSG[status]))
+    icount = int(vsim.icount.sum())
+    print("%d instructions executed in %d steps (%.3f s, %.2f MIPS aggregate)" %
+          (icount, steps, t, icount / t / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for the numba engine of sim/ (sim/jit.py)
+#
+#==========================================================================
+
+
+import os
+import sys
+import struct
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pyrisc
+
+pytest.importorskip('numba')
+
+
+DMEM_START          = 0x80010000
+EBREAK              = 0x00100073
+
+
+def itype(opcode, rd, funct3, rs1, imm):
+    return ((imm & 0xfff) << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
+
+def stype(opcode, funct3, rs1, rs2, imm):
+    return (((imm >> 5) & 0x7f) << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | \
+           ((imm & 0x1f) << 7) | opcode
+
+def elf(words, entry = 0x80000000):
+    # returns a minimal RV32 executable with the words as its text segment
+
+    text = b''.join(struct.pack('<I', w) for w in words)
+    header = b'\x7fELF' + bytes([ 1, 1, 1, 0 ]) + bytes(8) + \
+             struct.pack('<HHIIIIIHHHHHH', 2, 243, 1, entry, 52, 0, 0, 52, 32, 1, 40, 0, 0)
+    phdr = struct.pack('<IIIIIIII', 1, 96, entry, entry, len(text), len(text), 7, 4)
+    return header + phdr + bytes(96 - 84) + text
+
+
+def test_negative_load_offset():
+    # s1 points past the words it accesses, so every offset is negative
+
+    program = elf([ DMEM_START | (9 << 7) | 0x37,               # lui  s1, 0x80010
+                    itype(0x13, 9, 0, 9, 0x100),                # addi s1, s1, 256
+                    itype(0x13, 5, 0, 0, 0x123),                # addi t0, zero, 0x123
+                    stype(0x23, 2, 9, 5, -4),                   # sw   t0, -4(s1)
+                    itype(0x03, 6, 2, 9, -4),                   # lw   t1, -4(s1)
+                    itype(0x03, 7, 2, 9, -256),                 # lw   t2, -256(s1)
+                    EBREAK ])
+
+    expected = pyrisc.run(program, engine = 'int')
+    result = pyrisc.run(program, engine = 'numba')
+    assert expected.completed and expected.regs[6] == 0x123
+    assert result.status == expected.status
+    assert result.regs == expected.regs
+    assert (result.dmem == expected.dmem).all()